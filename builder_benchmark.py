@@ -0,0 +1,52 @@
+import tensorflow_datasets as tfds
+import tensorflow as tf
+import argparse
+import glob
+import os
+import time
+
+# Compare shard bytes and read throughput between prepared builder versions
+# python builder_benchmark.py --dataset CustomCelebahq --versions 1.0.0,2.0.0
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_dir",    type=str,   help="데이터셋 다운로드 디렉토리 설정", default='./datasets/')
+parser.add_argument("--dataset",        type=str,   help="데이터셋 종류", default='CustomCelebahq')
+parser.add_argument("--versions",       type=str,   help="비교할 버전 (콤마 구분)", default='1.0.0,2.0.0')
+parser.add_argument("--num_examples",   type=int,   help="read throughput 측정 example 수", default=2000)
+
+args = parser.parse_args()
+
+
+def shard_bytes(builder):
+    files = glob.glob(os.path.join(builder.data_dir, '*.tfrecord*'))
+    return sum(os.path.getsize(file) for file in files)
+
+
+def read_examples_per_sec(builder):
+    # Every stored feature is decoded, as a plain tfds.load caller would
+    dataset = builder.as_dataset(split='train').take(args.num_examples)
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    count = 0
+    start = time.perf_counter()
+    for _ in dataset:
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    results = {}
+    for version in args.versions.split(','):
+        builder = tfds.builder(args.dataset + ':' + version, data_dir=args.dataset_dir)
+        if not os.path.exists(builder.data_dir):
+            print("%s:%s 는 준비되지 않았습니다 (tfds build --version %s)" % (args.dataset, version, version))
+            continue
+
+        results[version] = (shard_bytes(builder), read_examples_per_sec(builder))
+        print("%s:%s  features=%s  shard bytes=%.2f GB  read=%.1f examples/sec" % (
+            args.dataset, version, sorted(builder.info.features.keys()),
+            results[version][0] / 1024**3, results[version][1]))
+
+    if len(results) == 2:
+        (old_bytes, old_speed), (new_bytes, new_speed) = [results[v] for v in args.versions.split(',')]
+        print("bytes ratio: %.2fx, read throughput ratio: %.2fx" % (new_bytes / old_bytes, new_speed / old_speed))
@@ -0,0 +1,95 @@
+import tensorflow as tf
+import tensorflow_io as tfio
+from skimage import color as sk_color
+from utils import color
+import numpy as np
+import argparse
+import time
+
+# python color_benchmark.py --batch_size 8 --image_size 512
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--batch_size",     type=int,   help="배치 사이즈값 설정", default=8)
+parser.add_argument("--image_size",     type=int,   help="이미지 해상도", default=512)
+parser.add_argument("--repeat",         type=int,   help="throughput 측정 반복 횟수", default=20)
+parser.add_argument("--cpu",            help="CPU에서만 측정", action='store_true')
+
+args = parser.parse_args()
+
+
+def denormalize(l_channel, ab_channel):
+    """ normalized L, ab -> CIE LAB units """
+    l_channel = tf.cast(l_channel, tf.float32) * color.L_SCALE + color.L_SCALE
+    ab_channel = tf.cast(ab_channel, tf.float32) * color.AB_SCALE
+    return tf.concat([l_channel, ab_channel], axis=-1).numpy()
+
+
+def images_per_sec(fn, images):
+    fn(images)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        out = fn(images)
+    # Wait for async ops
+    np.asarray(out[0] if isinstance(out, tuple) else out)
+    return args.repeat * images.shape[0] / (time.perf_counter() - start)
+
+
+def report_error(name, lab, reference):
+    diff = np.abs(lab - reference)
+    print("%-28s max |dLab| %.5f  mean |dLab| %.6f" % (name, diff.max(), diff.mean()))
+
+
+if __name__ == '__main__':
+    if args.cpu:
+        tf.config.set_visible_devices([], 'GPU')
+
+    rgb_uint8 = tf.random.uniform((args.batch_size, args.image_size, args.image_size, 3),
+                                  minval=0, maxval=256, dtype=tf.int32)
+    rgb_uint8 = tf.cast(rgb_uint8, tf.uint8)
+    rgb_float = tf.cast(rgb_uint8, tf.float32)
+
+    lut_fn = tf.function(lambda rgb: color.rgb_to_lab(rgb))
+    lut_f16_fn = tf.function(lambda rgb: color.rgb_to_lab(rgb, dtype=tf.float16))
+    float_fn = tf.function(lambda rgb: color.rgb_to_lab(rgb))
+    tfio_fn = tf.function(lambda rgb: tfio.experimental.color.rgb_to_lab(rgb / 255.))
+    inverse_fn = tf.function(lambda lab: color.lab_to_rgb(lab))
+    inverse_uint8_fn = tf.function(lambda lab: color.lab_to_rgb(lab, dtype=tf.uint8))
+    tfio_inverse_fn = tf.function(lambda lab: tfio.experimental.color.lab_to_rgb(lab))
+
+    # ---------------------
+    #  Accuracy (CIE LAB units), reference: skimage
+    # ---------------------
+    sk_lab = sk_color.rgb2lab(rgb_uint8.numpy())
+    tfio_lab = tfio_fn(rgb_float).numpy()
+
+    report_error('utils.color uint8 (LUT)', denormalize(*lut_fn(rgb_uint8)), sk_lab)
+    report_error('utils.color uint8 -> fp16', denormalize(*lut_f16_fn(rgb_uint8)), sk_lab)
+    report_error('utils.color float32', denormalize(*float_fn(rgb_float)), sk_lab)
+    report_error('tfio', tfio_lab, sk_lab)
+
+    l_channel, ab_channel = lut_fn(rgb_uint8)
+    norm_lab = tf.concat([l_channel, ab_channel], axis=-1)
+    roundtrip = inverse_uint8_fn(norm_lab).numpy().astype(np.int32)
+    print("%-28s max |dRGB| %d  exact %.4f" % ('lab_to_rgb uint8 roundtrip',
+                                                np.abs(roundtrip - rgb_uint8.numpy()).max(),
+                                                np.mean(roundtrip == rgb_uint8.numpy())))
+
+    # ---------------------
+    #  Throughput
+    # ---------------------
+    sk_fn = lambda rgb: sk_color.rgb2lab(rgb.numpy())
+    sk_inverse_fn = lambda lab: sk_color.lab2rgb(lab.numpy())
+    unnorm_lab = tf.constant(denormalize(l_channel, ab_channel))
+
+    print()
+    print("rgb_to_lab images/sec")
+    print("  utils.color uint8 (LUT)   : %.2f" % images_per_sec(lut_fn, rgb_uint8))
+    print("  utils.color uint8 -> fp16 : %.2f" % images_per_sec(lut_f16_fn, rgb_uint8))
+    print("  utils.color float32       : %.2f" % images_per_sec(float_fn, rgb_float))
+    print("  tfio                      : %.2f" % images_per_sec(tfio_fn, rgb_float))
+    print("  skimage                   : %.2f" % images_per_sec(sk_fn, rgb_uint8))
+    print("lab_to_rgb images/sec")
+    print("  utils.color float32       : %.2f" % images_per_sec(inverse_fn, norm_lab))
+    print("  utils.color uint8         : %.2f" % images_per_sec(inverse_uint8_fn, norm_lab))
+    print("  tfio                      : %.2f" % images_per_sec(tfio_inverse_fn, unnorm_lab))
+    print("  skimage                   : %.2f" % images_per_sec(sk_inverse_fn, unnorm_lab))
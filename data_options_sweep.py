@@ -0,0 +1,85 @@
+from utils.datasets import Dataset
+from utils.data_options import add_data_option_args, data_options_from_args, save_profile
+import argparse
+import time
+import os
+
+# Find the fastest tf.data threading / prefetch settings for this host and save them as a profile
+# python data_options_sweep.py --dataset_dir ./datasets/ --profile data_profile.json
+# python train.py --data_profile data_profile.json
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_dir",    type=str,   help="데이터셋 다운로드 디렉토리 설정", default='./datasets/')
+parser.add_argument("--dataset",        type=str,   help="데이터셋 종류", default='CustomCelebahq')
+parser.add_argument("--batch_size",     type=int,   help="배치 사이즈값 설정", default=8)
+parser.add_argument("--image_size",     type=int,   help="이미지 해상도", default=512)
+parser.add_argument("--augment_mode",   type=str,   help="학습 데이터 증강 방식", default='example', choices=['example', 'batch'])
+parser.add_argument("--warmup_batches", type=int,   help="측정 전 warmup 배치 수", default=5)
+parser.add_argument("--num_batches",    type=int,   help="설정당 측정할 배치 수", default=30)
+parser.add_argument("--threadpool_sizes", type=str, help="sweep 할 threadpool 크기 (콤마 구분, 미지정 시 코어 수의 1/4, 1/2, 전체)", default=None)
+parser.add_argument("--prefetch_depths", type=str,  help="sweep 할 prefetch 배치 수 (콤마 구분, -1: AUTOTUNE)", default='-1,2,4')
+parser.add_argument("--sweep_deterministic", help="deterministic 도 sweep (False 선택 시 재현/재개 순서가 보장되지 않음)", action='store_true')
+parser.add_argument("--profile",        type=str,   help="프로파일 저장 경로", default='data_profile.json')
+# Starting point of the sweep, values not swept (e.g. --autotune_ram_gb) are kept as given
+add_data_option_args(parser)
+
+args = parser.parse_args()
+
+
+def examples_per_sec(dataset_config, data_options):
+    dataset_config.data_options = data_options
+    iterator = iter(dataset_config.get_trainData(dataset_config.train_data).repeat())
+    for _ in range(args.warmup_batches):
+        next(iterator)
+
+    start = time.perf_counter()
+    for _ in range(args.num_batches):
+        next(iterator)
+    return args.num_batches * args.batch_size / (time.perf_counter() - start)
+
+
+def candidates():
+    """ Values tried for each option, swept one option at a time in this order """
+    cpu_count = os.cpu_count()
+    if args.threadpool_sizes:
+        threadpool_sizes = [int(size) for size in args.threadpool_sizes.split(',')]
+    else:
+        threadpool_sizes = sorted({max(cpu_count // 4, 1), max(cpu_count // 2, 1), cpu_count})
+
+    sweep = [
+        ('threadpool_size', [None] + threadpool_sizes),
+        ('max_intra_op_parallelism', [None, 1]),
+        ('prefetch', [None if int(depth) < 0 else int(depth) for depth in args.prefetch_depths.split(',')]),
+    ]
+    if args.sweep_deterministic:
+        sweep.append(('deterministic', [True, False]))
+    return sweep
+
+
+if __name__ == '__main__':
+    dataset_config = Dataset(
+        data_dir=args.dataset_dir,
+        image_size=(args.image_size, args.image_size),
+        batch_size=args.batch_size,
+        dataset=args.dataset,
+        augment_mode=args.augment_mode,
+    )
+
+    best = data_options_from_args(args)
+    best_rate = examples_per_sec(dataset_config, best)
+    print("시작 설정 %s: %.2f examples/sec" % (best, best_rate))
+
+    # Coordinate search, keep the best value of each option before sweeping the next
+    for key, values in candidates():
+        for value in values:
+            if value == best[key]:
+                continue
+            data_options = dict(best, **{key: value})
+            rate = examples_per_sec(dataset_config, data_options)
+            print("  %s=%s: %.2f examples/sec" % (key, value, rate))
+            if rate > best_rate:
+                best, best_rate = data_options, rate
+        print("%s -> %s" % (key, best[key]))
+
+    save_profile(args.profile, best, best_rate)
+    print("최적 설정 %s: %.2f examples/sec, 프로파일 저장: %s" % (best, best_rate, args.profile))
@@ -0,0 +1,49 @@
+import tensorflow_datasets as tfds
+import tensorflow as tf
+import argparse
+import time
+
+# Compare full JPEG decode against DCT-domain reduced decode (ratio 2, 4, 8)
+# python decode_benchmark.py --dataset CustomCelebahq --num_examples 500
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_dir",    type=str,   help="데이터셋 다운로드 디렉토리 설정", default='./datasets/')
+parser.add_argument("--dataset",        type=str,   help="데이터셋 종류", default='CustomCelebahq')
+parser.add_argument("--num_examples",   type=int,   help="측정 이미지 수", default=500)
+parser.add_argument("--ratios",         type=str,   help="비교할 decode ratio (콤마 구분)", default='1,2,4,8')
+
+args = parser.parse_args()
+
+
+def load_encoded():
+    # Keep the encoded bytes in memory so only the decode is timed
+    dataset = tfds.load(args.dataset, data_dir=args.dataset_dir, split='train',
+                        decoders={'image': tfds.decode.SkipDecoding()})
+    dataset = dataset.map(lambda sample: sample['image']).take(args.num_examples)
+    return [encoded for encoded in dataset]
+
+
+def decode_ms_per_image(encoded_images, ratio):
+    decode = tf.function(lambda encoded: tf.io.decode_jpeg(encoded, channels=3, ratio=ratio))
+    img = decode(encoded_images[0])
+
+    start = time.perf_counter()
+    for encoded in encoded_images:
+        img = decode(encoded)
+    img.numpy()
+    return (time.perf_counter() - start) * 1000 / len(encoded_images), img.shape
+
+
+if __name__ == '__main__':
+    tf.config.set_visible_devices([], 'GPU')
+
+    encoded_images = load_encoded()
+    print("%s: %d encoded images, source shape %s" % (
+        args.dataset, len(encoded_images), tf.image.extract_jpeg_shape(encoded_images[0]).numpy()))
+
+    baseline = None
+    for ratio in [int(ratio) for ratio in args.ratios.split(',')]:
+        ms, shape = decode_ms_per_image(encoded_images, ratio)
+        baseline = baseline or ms
+        print("ratio %d  decoded shape %-16s %.3f ms/image  speedup %.2fx" % (
+            ratio, tuple(shape), ms, baseline / ms))
@@ -1,6 +1,7 @@
 from tensorflow.keras.layers import Conv2D, Add, BatchNormalization, Activation, UpSampling2D, Concatenate, LeakyReLU, Input, Conv2DTranspose, Dropout
 from tensorflow.keras.initializers import RandomNormal
 from tensorflow.keras.models import Model
+from model.remat import Block, run_blocks
 
 
 class ResUNet():
@@ -8,81 +9,117 @@ class ResUNet():
         self.image_size = image_size
         self.kernel_weights_init = RandomNormal(stddev=0.02)
     
-    def bn_act(self, x, act=True):
-        x = BatchNormalization()(x)
+    # Block helpers create their layers in call order and return (fn(x, training=None), layers),
+    # so the generator can be rerun block by block (see model.remat)
+    def bn_act(self, act=True):
+        layers = [BatchNormalization()]
         if act == True:
-            # x = Activation("relu")(x)
-            x = LeakyReLU(alpha=0.2)(x)
-        return x
+            # layers.append(Activation("relu"))
+            layers.append(LeakyReLU(alpha=0.2))
 
-    def conv_block(self, x, filters, kernel_size=(4, 4), padding="same", strides=1, dropout=False):
-        conv = self.bn_act(x)
-        conv = Conv2D(filters, kernel_size, padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)(conv)
+        def fn(x, training=None):
+            x = layers[0](x, training=training)
+            for layer in layers[1:]:
+                x = layer(x)
+            return x
+        return fn, layers
+
+    def conv_block(self, filters, kernel_size=(4, 4), padding="same", strides=1, dropout=False):
+        bn_act, layers = self.bn_act()
+        layers = layers + [Conv2D(filters, kernel_size, padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)]
         if dropout:
-            conv= Dropout(0.5)(conv)
-        return conv
+            layers.append(Dropout(0.5))
 
-    def stem(self, x, filters, kernel_size=(4, 4), padding="same", strides=1):
-        conv = Conv2D(filters, kernel_size, padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)(x)
-        conv = self.conv_block(conv, filters, kernel_size=kernel_size, padding=padding, strides=strides)
-        
-        shortcut = Conv2D(filters, kernel_size=(1, 1), padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)(x)
-        shortcut = self.bn_act(shortcut, act=False)
-        
-        output = Add()([conv, shortcut])
-        return output
+        def fn(x, training=None):
+            conv = layers[2](bn_act(x, training=training))
+            if dropout:
+                conv = layers[3](conv, training=training)
+            return conv
+        return fn, layers
 
-    def residual_block(self, x, filters, kernel_size=(4, 4), padding="same", strides=1):
-        res = self.conv_block(x, filters, kernel_size=kernel_size, padding=padding, strides=strides)
-        res = self.conv_block(res, filters, kernel_size=kernel_size, padding=padding, strides=1)
-        
-        shortcut = Conv2D(filters, kernel_size=(1, 1), padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)(x)
-        shortcut = self.bn_act(shortcut, act=False)
-        
-        output = Add()([shortcut, res])
-        return output
+    def stem(self, filters, kernel_size=(4, 4), padding="same", strides=1):
+        conv_in = Conv2D(filters, kernel_size, padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)
+        conv_block, conv_layers = self.conv_block(filters, kernel_size=kernel_size, padding=padding, strides=strides)
+
+        shortcut_conv = Conv2D(filters, kernel_size=(1, 1), padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)
+        shortcut_bn, shortcut_layers = self.bn_act(act=False)
+        add = Add()
+
+        def fn(x, training=None):
+            conv = conv_block(conv_in(x), training=training)
+            shortcut = shortcut_bn(shortcut_conv(x), training=training)
+            return add([conv, shortcut])
+        return fn, [conv_in] + conv_layers + [shortcut_conv] + shortcut_layers + [add]
+
+    def residual_block(self, filters, kernel_size=(4, 4), padding="same", strides=1):
+        conv_block1, layers1 = self.conv_block(filters, kernel_size=kernel_size, padding=padding, strides=strides)
+        conv_block2, layers2 = self.conv_block(filters, kernel_size=kernel_size, padding=padding, strides=1)
+
+        shortcut_conv = Conv2D(filters, kernel_size=(1, 1), padding=padding, strides=strides, kernel_initializer=self.kernel_weights_init)
+        shortcut_bn, shortcut_layers = self.bn_act(act=False)
+        add = Add()
+
+        def fn(x, training=None):
+            res = conv_block2(conv_block1(x, training=training), training=training)
+            shortcut = shortcut_bn(shortcut_conv(x), training=training)
+            return add([shortcut, res])
+        return fn, layers1 + layers2 + [shortcut_conv] + shortcut_layers + [add]
+
+    def upsample_concat_block(self, filters):
+        layers = [Conv2DTranspose(filters, (4,4), strides=(2,2), padding='same', kernel_initializer=self.kernel_weights_init),
+                  BatchNormalization(),
+                  LeakyReLU(alpha=0.2),
+                  Concatenate()]
+
+        def fn(x, xskip, training=None):
+            x = layers[0](x)
+            x = layers[1](x, training=True)
+            x = layers[2](x)
+            return layers[3]([x, xskip])
+        return fn, layers
+
+    def add_block(self, name, block, inputs, group, scale, remat_safe=True):
+        fn, layers = block
+        self.blocks.append(Block(name, fn, inputs, group, scale, layers, remat_safe))
 
-    def upsample_concat_block(self, x, xskip, filters):
-        x = Conv2DTranspose(filters, (4,4), strides=(2,2), padding='same', kernel_initializer=self.kernel_weights_init)(x)
-        x = BatchNormalization()(x, training=True)
-        x = LeakyReLU(alpha=0.2)(x)
 
-        c = Concatenate()([x, xskip])
-        return c
-    
-    
     def res_u_net_generator(self):
         gen_input_shape=(self.image_size[0], self.image_size[1], 1)
 
         filter_list = [32, 64, 128, 256, 512]
         
         e0 = Input(shape=gen_input_shape)
+        self.blocks = []
         
         # Encoder
-        e1 = self.stem(x=e0, filters=filter_list[0], strides=1) # 1/1
-        e2 = self.residual_block(x=e1, filters=filter_list[1], strides=2) # 1/2
-        e3 = self.residual_block(x=e2, filters=filter_list[2], strides=2) # 1/4
-        e4 = self.residual_block(x=e3, filters=filter_list[3], strides=2) # 1/8
-        e5 = self.residual_block(x=e4, filters=filter_list[4], strides=2) # 1/16
+        self.add_block('e1', self.stem(filters=filter_list[0], strides=1), ['input'], 'encoder', 1) # 1/1
+        self.add_block('e2', self.residual_block(filters=filter_list[1], strides=2), ['e1'], 'encoder', 1/2) # 1/2
+        self.add_block('e3', self.residual_block(filters=filter_list[2], strides=2), ['e2'], 'encoder', 1/4) # 1/4
+        self.add_block('e4', self.residual_block(filters=filter_list[3], strides=2), ['e3'], 'encoder', 1/8) # 1/8
+        self.add_block('e5', self.residual_block(filters=filter_list[4], strides=2), ['e4'], 'encoder', 1/16) # 1/16
         
-        # Bridge
-        b0 = self.conv_block(e5, filter_list[4], strides=1, dropout=True) # 1/16
-        b1 = self.conv_block(b0, filter_list[4], strides=1, dropout=True) # 1/16
+        # Bridge, dropout blocks are not recomputed
+        self.add_block('b0', self.conv_block(filter_list[4], strides=1, dropout=True), ['e5'], 'bottleneck', 1/16, False) # 1/16
+        self.add_block('b1', self.conv_block(filter_list[4], strides=1, dropout=True), ['b0'], 'bottleneck', 1/16, False) # 1/16
         
         # Decoder
-        u1 = self.upsample_concat_block(b1, e4, filters=filter_list[3]) # 1/8
-        d1 = self.residual_block(u1, filter_list[3])
+        self.add_block('u1', self.upsample_concat_block(filters=filter_list[3]), ['b1', 'e4'], 'decoder', 1/8) # 1/8
+        self.add_block('d1', self.residual_block(filter_list[3]), ['u1'], 'decoder', 1/8)
         
-        u2 = self.upsample_concat_block(d1, e3, filters=filter_list[2]) # 1/4
-        d2 = self.residual_block(u2, filter_list[2])
+        self.add_block('u2', self.upsample_concat_block(filters=filter_list[2]), ['d1', 'e3'], 'decoder', 1/4) # 1/4
+        self.add_block('d2', self.residual_block(filter_list[2]), ['u2'], 'decoder', 1/4)
         
-        u3 = self.upsample_concat_block(d2, e2, filters=filter_list[1]) # 1/2
-        d3 = self.residual_block(u3, filter_list[1])
+        self.add_block('u3', self.upsample_concat_block(filters=filter_list[1]), ['d2', 'e2'], 'decoder', 1/2) # 1/2
+        self.add_block('d3', self.residual_block(filter_list[1]), ['u3'], 'decoder', 1/2)
         
-        u4 = self.upsample_concat_block(d3, e1, filters=filter_list[0]) # 1/1
-        d4 = self.residual_block(u4, filter_list[0])
+        self.add_block('u4', self.upsample_concat_block(filters=filter_list[0]), ['d3', 'e1'], 'decoder', 1) # 1/1
+        self.add_block('d4', self.residual_block(filter_list[0]), ['u4'], 'decoder', 1)
         
-        outputs = Conv2D(2, (1, 1), padding="same", activation="tanh")(d4)
+        # float32 output under mixed precision
+        head = Conv2D(2, (1, 1), padding="same", activation="tanh", dtype='float32')
+        self.blocks.append(Block('out', lambda x, training=None: head(x), ['d4'], 'output', 1, [head], True))
+
+        outputs = run_blocks(self.blocks, e0)
         model = Model(e0, outputs)
         
         return model
@@ -100,19 +137,21 @@ class ResUNet():
         d = LeakyReLU(alpha=0.2)(d)
         
         # 128
-        d = self.residual_block(x=d, filters=64, strides=2)
+        d = self.residual_block(filters=64, strides=2)[0](d)
         
         # 64
-        d = self.residual_block(x=d, filters=128, strides=2)
+        d = self.residual_block(filters=128, strides=2)[0](d)
         
         # 32
-        d = self.residual_block(x=d, filters=256, strides=2)
+        d = self.residual_block(filters=256, strides=2)[0](d)
         
         # 32
-        d = self.residual_block(x=d, filters=512, strides=1)
+        d = self.residual_block(filters=512, strides=1)[0](d)
         
         # for patchGAN
         output = Conv2D(1, (4,4), strides=(1,1), padding='same', use_bias=True, kernel_initializer=self.kernel_weights_init)(d)
+        # float32 logits under mixed precision
+        output = Activation('linear', dtype='float32')(output)
     
         # define model
         model = Model(input, output, name='discriminator_model')
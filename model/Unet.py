@@ -1,6 +1,7 @@
 from tensorflow.keras.layers import Conv2D, Add, BatchNormalization, Activation, UpSampling2D, Concatenate, LeakyReLU, Input, Conv2DTranspose, Dropout
 from tensorflow.keras.initializers import RandomNormal
 from tensorflow.keras.models import Model
+from model.remat import Block, run_blocks
 
 class Unet():
     def __init__(self, image_size: tuple, input_channel: int, output_channel: int):
@@ -14,63 +15,84 @@ class Unet():
         gen_input_shape=(self.image_size[0], self.image_size[1], self.input_channel)
         input_src_image = Input(shape=gen_input_shape)
 
+        # Blocks of the generator, run_blocks builds the model from them and
+        # Pix2Pix reruns them with activation recomputation (--remat)
+        self.blocks = []
+
         # encoder model
-        e1 = self._encoder_block(input_src_image, 32, batchnorm=False) # 256 1/2
-        e2 = self._encoder_block(e1, 64) # 128 1/4
-        e3 = self._encoder_block(e2, 128) # 64 1/8
-        e4 = self._encoder_block(e3, 256) # 32 1/16
-        e5 = self._encoder_block(e4, 512) # 16 1/32
+        self._encoder_block('e1', 'input', 32, 1/2, batchnorm=False) # 256 1/2
+        self._encoder_block('e2', 'e1', 64, 1/4) # 128 1/4
+        self._encoder_block('e3', 'e2', 128, 1/8) # 64 1/8
+        self._encoder_block('e4', 'e3', 256, 1/16) # 32 1/16
+        self._encoder_block('e5', 'e4', 512, 1/32) # 16 1/32
 
         # bottleneck, no batch norm and relu
-        b = Conv2D(512, (4,4), strides=(2,2), padding='same', use_bias=True, kernel_initializer=self.kernel_weights_init)(e5)
-        b = Activation('relu')(b)
+        bottleneck = [Conv2D(512, (4,4), strides=(2,2), padding='same', use_bias=True, kernel_initializer=self.kernel_weights_init),
+                      Activation('relu')]
+        self.blocks.append(Block('b', lambda x, training=None: bottleneck[1](bottleneck[0](x)),
+                                 ['e5'], 'bottleneck', 1/64, bottleneck, True))
 
         # decoder model
-        d3 = self._decoder_block(b, e5, 512)
-        d4 = self._decoder_block(d3, e4, 256, dropout=True)
-        d5 = self._decoder_block(d4, e3, 128, dropout=True)
-        d6 = self._decoder_block(d5, e2, 64, dropout=True)
-        d7 = self._decoder_block(d6, e1, 32, dropout=True)
+        self._decoder_block('d3', 'b', 'e5', 512, 1/32)
+        self._decoder_block('d4', 'd3', 'e4', 256, 1/16, dropout=True)
+        self._decoder_block('d5', 'd4', 'e3', 128, 1/8, dropout=True)
+        self._decoder_block('d6', 'd5', 'e2', 64, 1/4, dropout=True)
+        self._decoder_block('d7', 'd6', 'e1', 32, 1/2, dropout=True)
 
         # output
         # g = UpSampling2D()(d7)
         # g = Conv2D(filters=2, kernel_size=4, strides=1, padding='same', kernel_initializer=self.kernel_weights_init)(g)
-        
-        g = Conv2DTranspose(self.output_channel, (4,4), strides=(2,2), padding='same', kernel_initializer=self.kernel_weights_init)(d7)
-    
-        out_image = Activation('tanh')(g)
-        
+
+        # float32 output under mixed precision, losses and the LAB concat stay in float32
+        head = [Conv2DTranspose(self.output_channel, (4,4), strides=(2,2), padding='same', kernel_initializer=self.kernel_weights_init),
+                Activation('tanh', dtype='float32')]
+        self.blocks.append(Block('out', lambda x, training=None: head[1](head[0](x)),
+                                 ['d7'], 'output', 1, head, True))
+
+        out_image = run_blocks(self.blocks, input_src_image)
+
         # define model
         model = Model(input_src_image, out_image, name='generator_model')
         model.trainable = True
 
         return model
 
-    def _decoder_block(self, layer_in, skip_in, n_filters, dropout=True):
-        # add upsampling layer
-        g = Conv2DTranspose(n_filters, (4,4), strides=(2,2), padding='same', use_bias=False, kernel_initializer=self.kernel_weights_init)(layer_in)
-        # add batch normalization
-        g = BatchNormalization(momentum=0.8)(g, training=True)
-        if dropout:
-            g = Dropout(0.5)(g, training=True)
-        # merge with skip connection
-        g = Concatenate()([g, skip_in])
-        # relu activation
-        g = LeakyReLU(0.2)(g)
-
-        return g
-
-    def _encoder_block(self, layer_in, n_filters, batchnorm=True):
+    def _decoder_block(self, name, layer_in, skip_in, n_filters, scale, dropout=True):
+        # Two blocks, `<name>_up` (upsampling, batch normalization) can always be recomputed,
+        # `<name>` (dropout, merge with skip connection, relu activation) only without dropout
+        upsample = Conv2DTranspose(n_filters, (4,4), strides=(2,2), padding='same', use_bias=False, kernel_initializer=self.kernel_weights_init)
+        batchnorm = BatchNormalization(momentum=0.8)
+        merge = [Dropout(0.5)] if dropout else []
+        merge += [Concatenate(), LeakyReLU(0.2)]
+
+        def up_block(x, training=None):
+            return batchnorm(upsample(x), training=True)
+
+        def merge_block(g, skip, training=None):
+            if dropout:
+                g = merge[0](g, training=True)
+            g = merge[-2]([g, skip])
+            return merge[-1](g)
+
+        self.blocks.append(Block(name + '_up', up_block, [layer_in], 'decoder', scale, [upsample, batchnorm], True))
+        self.blocks.append(Block(name, merge_block, [name + '_up', skip_in], 'decoder', scale, merge, not dropout))
+
+    def _encoder_block(self, name, layer_in, n_filters, scale, batchnorm=True):
         if batchnorm == True:
             use_bias = False
         else:
             use_bias = True
-        
-        # add downsampling layer
-        g = Conv2D(n_filters, (4,4), strides=(2,2), padding='same', use_bias=use_bias, kernel_initializer=self.kernel_weights_init)(layer_in)
+
+        # downsampling, batch normalization, leaky relu activation
+        layers = [Conv2D(n_filters, (4,4), strides=(2,2), padding='same', use_bias=use_bias, kernel_initializer=self.kernel_weights_init)]
         if batchnorm:
-            g = BatchNormalization(momentum=0.8)(g, training=True)
-        # leaky relu activation
-        g = LeakyReLU(alpha=0.2)(g)
+            layers.append(BatchNormalization(momentum=0.8))
+        layers.append(LeakyReLU(alpha=0.2))
+
+        def block(x, training=None):
+            g = layers[0](x)
+            if batchnorm:
+                g = layers[1](g, training=True)
+            return layers[-1](g)
 
-        return g
+        self.blocks.append(Block(name, block, [layer_in], 'encoder', scale, layers, True))
@@ -16,7 +16,8 @@ from tqdm import tqdm
 import tensorflow_datasets as tfds
 import matplotlib.pyplot as plt
 import tensorflow_io as tfio
-from skimage import color
+from utils import color
+from utils.manifest import load_manifest
 import time
 import numpy as np
 # LD_PRELOAD="/usr/lib/x86_64-linux-gnu/libtcmalloc_minimal 
@@ -214,7 +215,7 @@ class Pix2Pix():
         Convert to rgb image to lab image
 
         Args:
-            rgb (Tensor): (H, W, 3)
+            rgb (Tensor): (..., H, W, 3)
 
         Returns:
             Normalized lab image
@@ -223,25 +224,9 @@ class Pix2Pix():
                 L : -1 ~ 1
                 ab : -1 ~ 1
             }
-            L, ab (Tensor): (H, W, 1), (H, W, 2)
+            L, ab (Tensor): (..., H, W, 1), (..., H, W, 2)
         """
-        # normalize image 0 ~ 1.
-        rgb /= 255. 
-        
-        # Convert to float32 data type.
-        rgb = tf.cast(rgb, tf.float32)
-        
-        # Convert to rgb to lab
-        lab = tfio.experimental.color.rgb_to_lab(rgb)
-
-        l_channel = lab[:, :, :1]
-        ab_channel = lab[:, :, 1:]
-
-        # -1 ~ 1 scaling
-        l_channel = (l_channel - 50.) / 50. 
-        ab_channel /= 127.        
-        
-        return (l_channel, ab_channel)
+        return color.rgb_to_lab(rgb)
     
     
     def lab_to_rgb(self, lab):
@@ -249,27 +234,16 @@ class Pix2Pix():
         Convert to lab image to rgb image
 
         Args:
-            lab (Tensor, float32): (H, W, 3)
+            lab (Tensor, float32): (..., H, W, 3)
 
         Returns:
             {
                 Normalized lab image
                 Value Range : 0 ~ 1
             }
-            RGB (Tensor, float32) :(H, W,)
+            RGB (Tensor, float32) :(..., H, W, 3)
         """      
-        batch_l = lab[:, :, :1]
-        batch_ab = lab[:, :, 1:]
-
-        
-        batch_l = (batch_l * 50) + 50.
-        batch_ab *= 127.
-        
-        batch_lab = tf.concat([batch_l, batch_ab], axis=-1)
-
-        rgb = tfio.experimental.color.lab_to_rgb(batch_lab)
-        
-        return rgb
+        return color.lab_to_rgb(lab)
     
     
     @tf.function
@@ -324,7 +298,7 @@ class Pix2Pix():
         # train_data = celebA_hq.concatenate(celebA)
         train_data = celebA_hq
 
-        number_train = train_data.reduce(0, lambda x, _: x + 1).numpy()
+        number_train = load_manifest(DATASET_DIR, 'CustomCelebahq', 'train')['num_examples']
         print("학습 데이터 개수", number_train)
         steps_per_epoch = number_train // BATCH_SIZE
         train_data = train_data.shuffle(1024)
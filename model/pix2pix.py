@@ -4,12 +4,40 @@ from tensorflow.keras.layers import (
     UpSampling2D, Activation, BatchNormalization, Conv2D,  Concatenate, LeakyReLU, MaxPooling2D, Input, Flatten, Dense, Dropout, concatenate,
     DepthwiseConv2D,  ZeroPadding2D, Conv2DTranspose, GlobalAveragePooling2D)
 from model.Unet import Unet
+from model.ResUnet import ResUNet
+from model.remat import run_blocks, select_blocks, adjust_batchnorm_momentum
 from tensorflow.keras.initializers import RandomNormal
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam, SGD
 from tensorflow.keras.losses import binary_crossentropy, mean_absolute_error, MeanAbsoluteError, MeanSquaredError, BinaryCrossentropy, mean_squared_error
-from tensorflow.keras.mixed_precision import experimental as mixed_precision
-from tensorflow.keras.metrics import mean_absolute_error
+from tensorflow.keras import mixed_precision
+from tensorflow.keras.metrics import mean_absolute_error, binary_accuracy
+
+# Keras dtype policies of --precision
+PRECISIONS = ('float32', 'mixed_float16', 'mixed_bfloat16')
+# Dataset dtype of each policy, the input pipeline carries L/ab in the compute dtype
+INPUT_DTYPES = {'float32': 'float32', 'mixed_float16': 'float16', 'mixed_bfloat16': 'bfloat16'}
+
+
+def precision_supported(precision: str):
+    """
+    mixed_bfloat16 needs bfloat16 conv kernels, on CPU stock TF builds only have them
+    with oneDNN (TF_ENABLE_ONEDNN_OPTS=1). One small conv + gradient tells.
+    """
+    if precision != 'mixed_bfloat16':
+        return True
+    try:
+        x = tf.zeros((1, 8, 8, 2), tf.bfloat16)
+        kernel = tf.zeros((4, 4, 2, 2), tf.bfloat16)
+        with tf.GradientTape() as tape:
+            tape.watch(kernel)
+            y = tf.nn.conv2d(x, kernel, strides=2, padding='SAME')
+        tape.gradient(y, kernel).numpy()
+    except tf.errors.OpError as e:
+        print("bfloat16 conv 를 지원하지 않는 환경입니다 (CPU 는 TF_ENABLE_ONEDNN_OPTS=1 필요):", str(e).strip().split('\n')[0])
+        return False
+    return True
+
 
 class Pix2Pix():
     def __init__(self,
@@ -21,41 +49,57 @@ class Pix2Pix():
 
         # Set model prefix name
         self.prefix = args.model_prefix
-        self.mixed_precision = args.mixed_precision
-
-
-        # Input shape
+        # Dtype policy, see PRECISIONS
+        self.precision = getattr(args, 'precision', 'float32')
+        if not precision_supported(self.precision):
+            print("float32 로 학습합니다")
+            self.precision = 'float32'
+        # Network configuration, generator: unet | resunet, discriminator: patchgan | resnet
+        self.generator = getattr(args, 'generator', 'unet')
+        self.discriminator = getattr(args, 'discriminator', 'patchgan')
+        # XLA compilation of the train steps and generator inference, see setup_xla
+        self.xla = getattr(args, 'xla', False)
+        # Micro-batches per optimizer update of the fused loop, see accumulate_step
+        self.accum_steps = getattr(args, 'accum_steps', 1)
+        # Generator blocks recomputed in the backward pass of the fused loop, see model.remat.select_blocks
+        self.remat = getattr(args, 'remat', 'none')
+        self.infer_fn = None
+        self.xla_report = {}
+        # Label smoothing draws of the fused step, the state is saved with the checkpoint for an exact resume
+        self.label_rng = tf.random.Generator.from_seed(getattr(args, 'seed', 0))
+
+        # Training resolution (H, W), see set_resolution
         self.image_size = (image_size[0], image_size[1])
         self.gen_input_channel = gen_input_channel
         self.gen_output_channel = gen_output_channel
         self.dis_input_channel = dis_input_channel
 
-        opt = Adam(lr=args.lr, beta_1=0.5)
+        # Set the dtype policy before any layer is built
+        mixed_precision.set_global_policy(self.precision)
 
-        # Set mixed precision
-        if self.mixed_precision:
-            self.policy = mixed_precision.Policy('mixed_float16', loss_scale=1024)
-            mixed_precision.set_policy(self.policy)
-            opt = mixed_precision.LossScaleOptimizer(opt, loss_scale='dynamic')
+        # One optimizer per network, each with its own slots, step count and loss scale
+        self.d_opt = self.build_optimizer(args.lr)
+        self.gen_opt = self.build_optimizer(args.lr)
 
-        # Calculate output shape of D (PatchGAN)
-        patch = int(self.image_size[0] / 2**5)
-        self.disc_patch = (patch, patch, 1)
-
-        # Build discriminator
+        # Build discriminator, D and G take any image size (multiple of 64), see set_resolution
         self.d_model = self.build_discriminator(
-            image_size=self.image_size, input_channel=self.dis_input_channel)
-        self.d_model.compile(loss=self.discriminator_loss,
-                             optimizer=opt, metrics=['accuracy'])
+            image_size=(None, None), input_channel=self.dis_input_channel)
+
+        # Output shape of D (PatchGAN) at the training resolution
+        self.disc_patch = self.patch_shape(self.image_size)
+        self.compile_discriminator()
 
         # Build generator
         self.gen_model = self.build_generator(
-            image_size=self.image_size, input_channel=self.gen_input_channel, output_channel=self.gen_output_channel)
+            image_size=(None, None), input_channel=self.gen_input_channel, output_channel=self.gen_output_channel)
+        self.remat_blocks = select_blocks(self.gen_blocks, self.remat)
+        adjust_batchnorm_momentum(self.gen_blocks, self.remat_blocks)
+        if self.remat_blocks:
+            print("activation 재계산 블록:", ', '.join(block.name for block in self.gen_blocks if block.name in self.remat_blocks))
 
         self.d_model.trainable = False
 
-        input_src_image = Input(shape=(
-            self.image_size[0], self.image_size[1], self.gen_input_channel))  # Input = L channel input
+        input_src_image = Input(shape=(None, None, self.gen_input_channel))  # Input = L channel input
         gen_out = self.gen_model(input_src_image)  # return ab channel
 
         # (B, H, W, 3)
@@ -68,10 +112,35 @@ class Pix2Pix():
         self.gan_model = Model(
             input_src_image, [dis_out, gen_out], name='gan_model')
 
-        self.gan_model.compile(loss=[self.discriminator_loss, self.generator_loss], metrics=[
-                               'accuracy', 'mae'], optimizer=opt, loss_weights=[1, 100])
+        self.compile_gan()
         self.gan_model.summary()
 
+    def build_optimizer(self, lr: float):
+        opt = Adam(learning_rate=lr, beta_1=0.5)
+        if self.precision == 'mixed_float16':
+            # Dynamic loss scale, float16 gradients underflow without it. bfloat16 has the float32 range.
+            opt = mixed_precision.LossScaleOptimizer(opt)
+        return opt
+
+    def scale_loss(self, optimizer, loss):
+        if isinstance(optimizer, mixed_precision.LossScaleOptimizer):
+            return optimizer.get_scaled_loss(loss)
+        return loss
+
+    def unscale_gradients(self, optimizer, grads):
+        if isinstance(optimizer, mixed_precision.LossScaleOptimizer):
+            return optimizer.get_unscaled_gradients(grads)
+        return grads
+
+    def compile_discriminator(self, jit_compile=None):
+        self.d_model.compile(loss=self.discriminator_loss,
+                             optimizer=self.d_opt, metrics=['accuracy'], jit_compile=jit_compile)
+
+    def compile_gan(self, jit_compile=None):
+        # D has to be frozen when this is called, keras fixes the trainable weights at compile time
+        self.gan_model.compile(loss=[self.discriminator_loss, self.generator_loss], metrics=[
+                               'accuracy', 'mae'], optimizer=self.gen_opt, loss_weights=[1, 100], jit_compile=jit_compile)
+
     def generator_loss(self, y_true, y_pred):
         """_summary_
 
@@ -79,25 +148,317 @@ class Pix2Pix():
             y_true (Tensor, float32 (B,H,W,C)): gt
             y_pred (Tensor, float32 ((B,H,W,C)): dl model prediction
         """
-        mae_loss = mean_absolute_error(y_true=y_true, y_pred=y_pred)
+        # Losses in float32 whatever the input / compute dtype
+        mae_loss = mean_absolute_error(y_true=tf.cast(y_true, tf.float32), y_pred=tf.cast(y_pred, tf.float32))
 
         return mae_loss
 
     def discriminator_loss(self, y_true, y_pred):
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.cast(y_pred, tf.float32)
         # Calculate bce Loss
         dis_loss = tf.reduce_mean(binary_crossentropy(
             y_true=y_true, y_pred=y_pred, from_logits=True))
 
         return dis_loss
 
+    def patch_shape(self, image_size: tuple):
+        """ Output shape of D (PatchGAN) for one image of `image_size`, depends on the discriminator configuration """
+        output_shape = self.d_model.compute_output_shape((1, image_size[0], image_size[1], self.dis_input_channel))
+        return tuple(tf.TensorShape(output_shape)[1:].as_list())
+
+    def set_resolution(self, image_size: tuple):
+        """
+        Train at another image size, e.g. the next phase of a progressive-resolution schedule.
+        The models keep their weights, only the PatchGAN label shape changes.
+        Call compile_train_step / setup_xla again afterwards for the new shapes.
+
+        Args:
+            image_size (tuple): (H, W), multiple of 64
+        """
+        self.image_size = (image_size[0], image_size[1])
+        self.disc_patch = self.patch_shape(self.image_size)
+
+    def build_patch_labels(self, batch_size: int):
+        """
+        Build constant PatchGAN labels once so the fused train step does not
+        allocate new label tensors every batch.
+
+        Args:
+            batch_size (int): batch size of the training dataset
+        """
+        self.fake_patch_labels = tf.zeros((batch_size,) + self.disc_patch)
+        self.real_patch_labels = tf.ones((batch_size,) + self.disc_patch)
+
+    def compute_gradients(self, l_channel, ab_channel, random_augment=True):
+        """
+        Forward and backward pass of the fused train step.
+        Generator runs once and the D and G gradients come from the same forward pass.
+
+        Args:
+            l_channel (Tensor, float32 (B,H,W,1)): generator input
+            ab_channel (Tensor, float32 (B,H,W,2)): gt ab channel
+
+        Returns:
+            dis_grads, gen_grads (list): unscaled gradients of the D / G trainable variables
+            dis_res (Tensor): [Dis loss, Dis ACC]
+            gan_res (Tensor): [Gan loss, Gan adversarial loss, Gen MAE, Gan ACC],
+                              the first four values of gan_model.train_on_batch in the same order
+        """
+        batch_size = tf.shape(l_channel)[0]
+        fake_y_dis = self.fake_patch_labels[:batch_size]
+        real_y_dis = self.real_patch_labels[:batch_size]
+
+        # Same label smoothing as Dataset.generate_patch_labels
+        if random_augment:
+            real_factor = tf.where(self.label_rng.uniform([]) < 0.05,
+                                   self.label_rng.uniform([], minval=0.8, maxval=1.),
+                                   1.)
+            real_y_dis *= real_factor
+
+        original_lab = tf.concat([l_channel, ab_channel], axis=-1)
+
+        with tf.GradientTape() as gen_tape, tf.GradientTape() as dis_tape:
+            pred_ab = self.generator_forward(l_channel, training=True)
+            # Real and generated LAB in the input dtype, pred_ab is float32
+            pred_lab = tf.concat([l_channel, tf.cast(pred_ab, l_channel.dtype)], axis=-1)
+
+            d_real = self.d_model(original_lab, training=True)
+            d_fake = self.d_model(pred_lab, training=True)
+
+            # ---------------------
+            #  Discriminator loss
+            # ---------------------
+            dis_loss = 0.5 * (self.discriminator_loss(real_y_dis, d_real) +
+                              self.discriminator_loss(fake_y_dis, d_fake))
+
+            # ---------------------
+            #  Generator loss
+            # ---------------------
+            gan_loss = self.discriminator_loss(real_y_dis, d_fake)
+            gen_loss = tf.reduce_mean(self.generator_loss(y_true=ab_channel, y_pred=pred_ab))
+            total_gen_loss = gan_loss + 100 * gen_loss
+
+            scaled_dis_loss = self.scale_loss(self.d_opt, dis_loss)
+            scaled_gen_loss = self.scale_loss(self.gen_opt, total_gen_loss)
+
+        dis_grads = self.unscale_gradients(
+            self.d_opt, dis_tape.gradient(scaled_dis_loss, self.d_model.trainable_variables))
+        gen_grads = self.unscale_gradients(
+            self.gen_opt, gen_tape.gradient(scaled_gen_loss, self.gen_model.trainable_variables))
+
+        dis_acc = 0.5 * (tf.reduce_mean(binary_accuracy(real_y_dis, d_real)) +
+                         tf.reduce_mean(binary_accuracy(fake_y_dis, d_fake)))
+        gan_acc = tf.reduce_mean(binary_accuracy(real_y_dis, d_fake))
+        dis_res = tf.stack([dis_loss, dis_acc])
+        # Keras order: total loss, D output loss, G output loss (MAE), D output accuracy
+        gan_res = tf.stack([total_gen_loss, gan_loss, gen_loss, gan_acc])
+
+        return dis_grads, gen_grads, dis_res, gan_res
+
+    def generator_forward(self, l_channel, training=True):
+        """
+        Generator forward pass of the fused train step.
+        With --remat the selected blocks keep only their inputs and are recomputed in the backward pass,
+        same layers and weights as gen_model.
+        """
+        if self.remat_blocks:
+            return run_blocks(self.gen_blocks, l_channel, training=training, remat=self.remat_blocks)
+        return self.gen_model(l_channel, training=training)
+
+    def train_step(self, l_channel, ab_channel, random_augment=True):
+        """
+        Fused single-graph train step, D and G are updated from one forward pass.
+
+        Returns:
+            dis_res (Tensor): [Dis loss, Dis ACC]
+            gan_res (Tensor): [Gan loss, Gan adversarial loss, Gen MAE, Gan ACC]
+        """
+        dis_grads, gen_grads, dis_res, gan_res = self.compute_gradients(l_channel, ab_channel, random_augment)
+
+        self.d_opt.apply_gradients(zip(dis_grads, self.d_model.trainable_variables))
+        self.gen_opt.apply_gradients(zip(gen_grads, self.gen_model.trainable_variables))
+
+        return dis_res, gan_res
+
+    def accumulate_step(self, l_channel, ab_channel, random_augment=True):
+        """
+        One micro-batch of an accumulated update, its unscaled gradients divided by accum_steps are added
+        to the preallocated accumulators, which then hold the mean gradient apply_accumulated updates with.
+        """
+        dis_grads, gen_grads, dis_res, gan_res = self.compute_gradients(l_channel, ab_channel, random_augment)
+
+        scale = 1. / self.accum_steps
+        for accum, grad in zip(self.dis_accum, dis_grads):
+            accum.assign_add(tf.cast(grad, accum.dtype) * scale)
+        for accum, grad in zip(self.gen_accum, gen_grads):
+            accum.assign_add(tf.cast(grad, accum.dtype) * scale)
+
+        return dis_res, gan_res
+
+    def apply_accumulated(self):
+        """
+        Update D and G with the mean gradient of the accumulated micro-batches, then zero
+        the accumulators in place. A non-finite micro-batch gradient makes the mean non-finite,
+        so a LossScaleOptimizer skips the whole update and lowers its scale.
+        """
+        for opt, accums, variables in ((self.d_opt, self.dis_accum, self.d_model.trainable_variables),
+                                       (self.gen_opt, self.gen_accum, self.gen_model.trainable_variables)):
+            opt.apply_gradients(zip(accums, variables))
+            for accum in accums:
+                # Overwritten from the preallocated zeros, assign_sub(accum) would keep a skipped inf/nan
+                accum.assign(self.accum_zeros[tuple(accum.shape)])
+
+    def compile_train_step(self, batch_size: int):
+        """
+        Prepare the fused train step.
+        D stays trainable for the whole run since the fused step does not toggle it.
+
+        Args:
+            batch_size (int): batch size of the training dataset
+        """
+        self.d_model.trainable = True
+        self.build_patch_labels(batch_size=batch_size)
+        if self.accum_steps > 1:
+            # Allocated once, float32 like the variables under every precision policy
+            self.dis_accum = [tf.Variable(tf.zeros_like(v), trainable=False) for v in self.d_model.trainable_variables]
+            self.gen_accum = [tf.Variable(tf.zeros_like(v), trainable=False) for v in self.gen_model.trainable_variables]
+            # One zero tensor per variable shape, apply_accumulated resets without allocating
+            self.accum_zeros = {tuple(accum.shape): tf.zeros(accum.shape, accum.dtype)
+                                for accum in self.dis_accum + self.gen_accum}
+            self.step_fn = self.accumulate_step
+        else:
+            self.step_fn = self.train_step
+        # step_fn is replaced by an XLA compiled version in setup_xla
+        self.train_steps = tf.function(self._train_steps)
+
+    def xla_compatible(self, name: str, fn, *example_args):
+        """
+        Lower `fn` to HLO without running it. Unsupported ops fail here instead of
+        at the first train step, so each function can fall back on its own.
+
+        Returns:
+            True if `fn` compiles with XLA, the result is kept in xla_report
+        """
+        try:
+            tf.function(fn, jit_compile=True).experimental_get_compiler_ir(*example_args)(stage='hlo')
+        except (tf.errors.OpError, ValueError) as e:
+            reason = str(e).strip().split('\n')[0]
+            print("XLA 컴파일 불가, %s 는 XLA 없이 실행: %s" % (name, reason))
+            self.xla_report[name] = reason
+            return False
+
+        print("XLA 컴파일:", name)
+        self.xla_report[name] = 'xla'
+        return True
+
+    def setup_xla(self, batch_size: int, train_loop: str = 'fused'):
+        """
+        Compile the train steps of `train_loop` and the generator inference with XLA,
+        each one falls back to a plain graph when it has ops XLA does not support.
+        Shapes are fixed to `batch_size` so every function is compiled once, train batches
+        have to be full (Dataset drop_remainder) and predict_ab pads partial batches.
+
+        Args:
+            batch_size (int): batch size of the training dataset
+            train_loop (str): 'fused' (call after compile_train_step) or 'keras'
+        """
+        h, w = self.image_size
+        # Same dtype as the Dataset batches, or the first real call would compile again
+        dtype = INPUT_DTYPES[self.precision]
+        l_channel = tf.zeros((batch_size, h, w, self.gen_input_channel), dtype)
+        ab_channel = tf.zeros((batch_size, h, w, self.gen_output_channel), dtype)
+        lab = tf.zeros((batch_size, h, w, self.dis_input_channel), dtype)
+        patch_labels = tf.zeros((batch_size,) + self.disc_patch)
+
+        if train_loop == 'fused':
+            # D and G updates share one generator forward pass, they are compiled as one function
+            step_name = 'accumulate_step' if self.accum_steps > 1 else 'train_step'
+            if self.xla_compatible(step_name, self.step_fn, l_channel, ab_channel):
+                self.step_fn = tf.function(self.step_fn, jit_compile=True)
+        else:
+            self.d_model.trainable = True
+            self.compile_discriminator(jit_compile=True)
+            if not self.xla_compatible('discriminator train step',
+                                       lambda x, y: self.d_model.train_step((x, y)), lab, patch_labels):
+                self.compile_discriminator()
+
+            self.d_model.trainable = False
+            self.compile_gan(jit_compile=True)
+            if not self.xla_compatible('generator train step',
+                                       lambda x, y_dis, y_gen: self.gan_model.train_step((x, [y_dis, y_gen])),
+                                       l_channel, patch_labels, ab_channel):
+                self.compile_gan()
+
+        infer = lambda x: self.gen_model(x, training=False)
+        self.infer_batch_size = batch_size
+        if self.xla_compatible('generator inference', infer, l_channel):
+            self.infer_fn = tf.function(infer, jit_compile=True)
+        else:
+            self.infer_fn = tf.function(infer)
+
+    def predict_ab(self, l_channel):
+        """
+        Generator inference. With setup_xla, batches are padded to the compiled batch size
+        so a partial last batch does not trigger another compilation.
+        """
+        if self.infer_fn is None:
+            return self.gen_model.predict(l_channel)
+
+        batch_size = int(l_channel.shape[0])
+        pad = self.infer_batch_size - batch_size
+        if pad > 0:
+            l_channel = tf.pad(l_channel, [[0, pad], [0, 0], [0, 0], [0, 0]])
+        return self.infer_fn(l_channel)[:batch_size]
+
+    def _train_steps(self, iterator, steps):
+        """
+        Run several fused train steps in one call to amortize the python overhead.
+        With accum_steps > 1 every step is one optimizer update over accum_steps batches.
+
+        Args:
+            iterator (tf.data.Iterator): train dataset iterator
+            steps (Tensor, int32): number of steps to run in this call
+
+        Returns:
+            Last dis_res, gan_res (mean over the micro-batches of the last update)
+        """
+        dis_res = tf.zeros([2])
+        gan_res = tf.zeros([4])
+        for _ in tf.range(steps):
+            if self.accum_steps == 1:
+                l_channel, ab_channel, _ = next(iterator)
+                dis_res, gan_res = self.step_fn(l_channel, ab_channel)
+            else:
+                dis_res = tf.zeros([2])
+                gan_res = tf.zeros([4])
+                for _ in tf.range(self.accum_steps):
+                    l_channel, ab_channel, _ = next(iterator)
+                    micro_dis_res, micro_gan_res = self.step_fn(l_channel, ab_channel)
+                    dis_res += micro_dis_res / self.accum_steps
+                    gan_res += micro_gan_res / self.accum_steps
+                self.apply_accumulated()
+
+        return dis_res, gan_res
+
     def build_generator(self, image_size: tuple, input_channel: int, output_channel: int):
-        unet = Unet(image_size=image_size,
-                    input_channel=input_channel, output_channel=output_channel)
-        model = unet.build_generator()
+        if self.generator == 'resunet':
+            builder = ResUNet(image_size=image_size)
+            model = builder.res_u_net_generator()
+        else:
+            builder = Unet(image_size=image_size,
+                           input_channel=input_channel, output_channel=output_channel)
+            model = builder.build_generator()
+
+        # Blocks of the generator, for --remat
+        self.gen_blocks = builder.blocks
 
         return model
 
     def build_discriminator(self, image_size: tuple, input_channel: int):
+        if self.discriminator == 'resnet':
+            return ResUNet(image_size=image_size).res_discriminator()
+
         kernel_weights_init = RandomNormal(stddev=0.02)
         src_image_shape = (image_size[0], image_size[1], input_channel)
         input_src_image = Input(shape=src_image_shape)
@@ -134,6 +495,8 @@ class Pix2Pix():
         # for patchGAN
         output = Conv2D(1, (4, 4), strides=(1, 1), padding='same',
                         use_bias=True, kernel_initializer=kernel_weights_init)(d)
+        # float32 logits under mixed precision
+        output = Activation('linear', dtype='float32')(output)
 
         # define model
         model = Model(input_src_image, output, name='discriminator_model')
@@ -142,7 +505,7 @@ class Pix2Pix():
 
     def calc_metric(self, y_true, y_pred, method='mae'):
         if method == 'mae':
-            metric = mean_absolute_error(y_true, y_pred)
+            metric = mean_absolute_error(tf.cast(y_true, tf.float32), tf.cast(y_pred, tf.float32))
         metric = tf.reduce_mean(metric)
         return metric
 
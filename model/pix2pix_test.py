@@ -0,0 +1,85 @@
+import tensorflow as tf
+import types
+from tensorflow.keras.layers import Dropout
+from model.pix2pix import Pix2Pix
+
+MICRO_BATCH = 2
+ACCUM_STEPS = 3
+
+
+def build_pix2pix(accum_steps=ACCUM_STEPS):
+    """ Small float32 Pix2Pix whose fused step is deterministic, dropout off and no label smoothing in the calls """
+    args = types.SimpleNamespace(model_prefix='test', lr=0.001, precision='float32', accum_steps=accum_steps, seed=0)
+    gan = Pix2Pix(args, image_size=(64, 64), gen_input_channel=1, gen_output_channel=2, dis_input_channel=3)
+    for layer in gan.gen_model.layers:
+        if isinstance(layer, Dropout):
+            layer.rate = 0.
+    gan.compile_train_step(batch_size=MICRO_BATCH * accum_steps)
+    return gan
+
+
+def micro_batch(seed):
+    l_channel = tf.random.stateless_uniform((MICRO_BATCH, 64, 64, 1), seed=[seed, 0], minval=-1., maxval=1.)
+    ab_channel = tf.random.stateless_uniform((MICRO_BATCH, 64, 64, 2), seed=[seed, 1], minval=-1., maxval=1.)
+    return l_channel, ab_channel
+
+
+class AccumulationTest(tf.test.TestCase):
+    """ accumulate_step / apply_accumulated against one step over the full batch """
+
+    def assertGradientsClose(self, actual, expected):
+        for a, e in zip(actual, expected):
+            self.assertAllClose(a, e, rtol=1e-3, atol=1e-5)
+
+    def test_micro_batches_match_the_full_batch(self):
+        gan = build_pix2pix()
+        l_channel, ab_channel = micro_batch(0)
+
+        # Copies of one micro-batch, the BatchNorm batch statistics of the full batch are the same
+        full_l, full_ab = tf.tile(l_channel, [ACCUM_STEPS, 1, 1, 1]), tf.tile(ab_channel, [ACCUM_STEPS, 1, 1, 1])
+        dis_grads, gen_grads, dis_res, gan_res = gan.compute_gradients(full_l, full_ab, random_augment=False)
+        for _ in range(ACCUM_STEPS):
+            micro_dis_res, micro_gan_res = gan.accumulate_step(l_channel, ab_channel, random_augment=False)
+
+        self.assertGradientsClose(gan.dis_accum, dis_grads)
+        self.assertGradientsClose(gan.gen_accum, gen_grads)
+        self.assertAllClose(micro_dis_res, dis_res, rtol=1e-4)
+        self.assertAllClose(micro_gan_res, gan_res, rtol=1e-4)
+
+    def test_accumulators_hold_the_mean_gradient(self):
+        gan = build_pix2pix()
+        batches = [micro_batch(seed) for seed in range(ACCUM_STEPS)]
+
+        expected_dis = [tf.zeros_like(v) for v in gan.d_model.trainable_variables]
+        expected_gen = [tf.zeros_like(v) for v in gan.gen_model.trainable_variables]
+        for l_channel, ab_channel in batches:
+            dis_grads, gen_grads, _, _ = gan.compute_gradients(l_channel, ab_channel, random_augment=False)
+            expected_dis = [e + g / ACCUM_STEPS for e, g in zip(expected_dis, dis_grads)]
+            expected_gen = [e + g / ACCUM_STEPS for e, g in zip(expected_gen, gen_grads)]
+        for l_channel, ab_channel in batches:
+            gan.accumulate_step(l_channel, ab_channel, random_augment=False)
+
+        self.assertGradientsClose(gan.dis_accum, expected_dis)
+        self.assertGradientsClose(gan.gen_accum, expected_gen)
+
+    def test_apply_updates_once_and_resets(self):
+        gan = build_pix2pix()
+        # Plain SGD with lr 1, the update is the accumulated gradient itself
+        gan.d_opt = tf.keras.optimizers.SGD(learning_rate=1.)
+        gan.gen_opt = tf.keras.optimizers.SGD(learning_rate=1.)
+        for seed in range(ACCUM_STEPS):
+            gan.accumulate_step(*micro_batch(seed), random_augment=False)
+
+        variables = gan.d_model.trainable_variables + gan.gen_model.trainable_variables
+        accums = gan.dis_accum + gan.gen_accum
+        expected = [v.numpy() - accum.numpy() for v, accum in zip(variables, accums)]
+        gan.apply_accumulated()
+
+        for v, e in zip(variables, expected):
+            self.assertAllClose(v, e, atol=1e-6)
+        for accum in accums:
+            self.assertAllEqual(accum, tf.zeros_like(accum))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,82 @@
+import tensorflow as tf
+from tensorflow.keras.layers import BatchNormalization
+from collections import namedtuple
+import math
+
+# One generator block
+#   name: block name, selectable with --remat (e.g. 'e1', 'd3')
+#   fn: fn(*inputs, training=None) -> output tensor, calls the block's layers
+#   inputs: names of the blocks (or 'input') it reads
+#   group: 'encoder' | 'bottleneck' | 'decoder' | 'output'
+#   scale: output resolution relative to the input image (1, 1/2, ...)
+#   layers: layers of the block
+#   remat_safe: False for blocks with dropout, a recomputed random mask would not match the forward pass
+Block = namedtuple('Block', ['name', 'fn', 'inputs', 'group', 'scale', 'layers', 'remat_safe'])
+
+REMAT_GROUPS = ('all', 'encoder', 'decoder', 'full_res')
+
+
+def run_blocks(blocks, inputs, training=None, remat=()):
+    """
+    Run the generator block by block.
+
+    Args:
+        blocks (list): Block list of a generator builder
+        inputs (Tensor): generator input
+        training: passed to the layers that follow the model training flag
+        remat (set): names of the blocks whose activations are recomputed in the backward pass
+    """
+    tensors = {'input': inputs}
+    for block in blocks:
+        args = [tensors[name] for name in block.inputs]
+        if block.name in remat:
+            # Only the block inputs are kept for backprop, the inner activations are recomputed
+            tensors[block.name] = tf.recompute_grad(lambda *x, block=block: block.fn(*x, training=training))(*args)
+        else:
+            tensors[block.name] = block.fn(*args, training=training)
+    return tensors[blocks[-1].name]
+
+
+def select_blocks(blocks, remat: str):
+    """
+    Block names of a --remat setting.
+
+    Args:
+        remat (str): 'none', or comma separated REMAT_GROUPS / block names
+                     (e.g. 'encoder', 'full_res', 'e1,e2,u4,d4')
+    """
+    if remat in (None, '', 'none'):
+        return set()
+
+    selected = set()
+    by_name = {block.name: block for block in blocks}
+    for item in remat.split(','):
+        item = item.strip()
+        if item == 'all':
+            selected |= {block.name for block in blocks if block.remat_safe}
+        elif item in ('encoder', 'decoder'):
+            selected |= {block.name for block in blocks if block.group == item and block.remat_safe}
+        elif item == 'full_res':
+            # Blocks at 1/1 and 1/2 resolution hold most of the activation memory
+            selected |= {block.name for block in blocks if block.scale >= 0.5 and block.remat_safe}
+        elif item in by_name:
+            if not by_name[item].remat_safe:
+                raise ValueError("%s 블록은 dropout 이 있어 재계산할 수 없습니다" % item)
+            selected.add(item)
+        else:
+            raise ValueError("알 수 없는 remat 설정: %s (%s 또는 블록 이름 %s)" % (
+                item, ', '.join(REMAT_GROUPS), ', '.join(by_name)))
+    return selected
+
+
+def adjust_batchnorm_momentum(blocks, remat):
+    """
+    A recomputed block updates its BatchNorm moving statistics twice per step,
+    on the forward pass and again on the recompute, with the same batch statistics.
+    Two updates with sqrt(momentum) equal one update with momentum.
+    """
+    for block in blocks:
+        if block.name in remat:
+            for layer in block.layers:
+                if isinstance(layer, BatchNormalization):
+                    layer.momentum = math.sqrt(layer.momentum)
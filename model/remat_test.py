@@ -0,0 +1,91 @@
+import tensorflow as tf
+from tensorflow.keras.layers import BatchNormalization, Dropout
+from model.Unet import Unet
+from model.ResUnet import ResUNet
+from model.remat import run_blocks, select_blocks, adjust_batchnorm_momentum
+
+
+def build_blocks(generator):
+    """ Generator model and its blocks, dropout off so two passes are comparable """
+    if generator == 'resunet':
+        builder = ResUNet(image_size=(None, None))
+        model = builder.res_u_net_generator()
+    else:
+        builder = Unet(image_size=(None, None), input_channel=1, output_channel=2)
+        model = builder.build_generator()
+    for layer in model.layers:
+        if isinstance(layer, Dropout):
+            layer.rate = 0.
+    return model, builder.blocks
+
+
+def batchnorm_layers(blocks):
+    return [layer for block in blocks for layer in block.layers if isinstance(layer, BatchNormalization)]
+
+
+class RematTest(tf.test.TestCase):
+    """ run_blocks with recomputed blocks against the plain forward / backward pass """
+
+    def forward_backward(self, model, blocks, x, remat):
+        with tf.GradientTape() as tape:
+            tape.watch(x)
+            y = run_blocks(blocks, x, training=True, remat=remat)
+            loss = tf.reduce_mean(tf.square(y - 0.1))
+        grads = tape.gradient(loss, [x] + model.trainable_variables)
+        return y, grads
+
+    def check_same_outputs_and_gradients(self, generator, remat):
+        model, blocks = build_blocks(generator)
+        x = tf.random.stateless_uniform((2, 64, 64, 1), seed=[0, 0], minval=-1., maxval=1.)
+        selected = select_blocks(blocks, remat)
+        self.assertNotEmpty(selected)
+
+        y, grads = self.forward_backward(model, blocks, x, remat=())
+        remat_y, remat_grads = self.forward_backward(model, blocks, x, remat=selected)
+
+        self.assertAllClose(remat_y, y, atol=1e-6)
+        for remat_grad, grad in zip(remat_grads, grads):
+            self.assertAllClose(remat_grad, grad, rtol=1e-4, atol=1e-6)
+
+    def test_unet(self):
+        for remat in ('all', 'encoder', 'full_res', 'e1,d7_up'):
+            self.check_same_outputs_and_gradients('unet', remat)
+
+    def test_resunet(self):
+        for remat in ('all', 'decoder', 'u4,d4'):
+            self.check_same_outputs_and_gradients('resunet', remat)
+
+    def test_dropout_blocks_are_not_recomputed(self):
+        _, blocks = build_blocks('unet')
+
+        self.assertNotIn('d4', select_blocks(blocks, 'all'))
+        self.assertIn('d4_up', select_blocks(blocks, 'all'))
+        with self.assertRaises(ValueError):
+            select_blocks(blocks, 'd4')
+        with self.assertRaises(ValueError):
+            select_blocks(blocks, 'e9')
+
+    def test_batchnorm_statistics_match_one_update(self):
+        model, blocks = build_blocks('unet')
+        x = tf.random.stateless_uniform((2, 64, 64, 1), seed=[0, 1], minval=-1., maxval=1.)
+        layers = batchnorm_layers(blocks)
+        initial = [[w.numpy() for w in (layer.moving_mean, layer.moving_variance)] for layer in layers]
+
+        self.forward_backward(model, blocks, x, remat=())
+        expected = [[w.numpy() for w in (layer.moving_mean, layer.moving_variance)] for layer in layers]
+
+        for layer, (mean, variance) in zip(layers, initial):
+            layer.moving_mean.assign(mean)
+            layer.moving_variance.assign(variance)
+        selected = select_blocks(blocks, 'all')
+        adjust_batchnorm_momentum(blocks, selected)
+        # Forward pass and recompute both update the recomputed blocks
+        self.forward_backward(model, blocks, x, remat=selected)
+
+        for layer, (mean, variance) in zip(layers, expected):
+            self.assertAllClose(layer.moving_mean, mean, rtol=1e-4, atol=1e-6)
+            self.assertAllClose(layer.moving_variance, variance, rtol=1e-4, atol=1e-6)
+
+
+if __name__ == '__main__':
+    tf.test.main()
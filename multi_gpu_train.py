@@ -16,7 +16,8 @@ from tqdm import tqdm
 import time
 import tensorflow_datasets as tfds
 import matplotlib.pyplot as plt
-import tensorflow_io as tfio
+from utils import color
+from utils.manifest import load_manifest
 # LD_PRELOAD="/usr/lib/x86_64-linux-gnu/libtcmalloc_minimal 
 # LD_PRELOAD="/usr/lib/x86_64-linux-gnu/libtcmalloc_minimal.so.4.5.9" python gan_train.py
 # LD_PRELOAD="/usr/lib/x86_64-linux-gnu/libtcmalloc_minimal.so.4.3.0" python multi_gpu_train.py 
@@ -126,7 +127,7 @@ class Pix2Pix():
         Convert to rgb image to lab image
 
         Args:
-            rgb (Tensor): (H, W, 3)
+            rgb (Tensor): (..., H, W, 3)
 
         Returns:
             Normalized lab image
@@ -135,71 +136,26 @@ class Pix2Pix():
                 L : -1 ~ 1
                 ab : -1 ~ 1
             }
-            L, ab (Tensor): (H, W, 1), (H, W, 2)
+            L, ab (Tensor): (..., H, W, 1), (..., H, W, 2)
         """
-        # normalize image 0 ~ 1.
-        rgb /= 255. 
-        
-        # Convert to float32 data type.
-        rgb = tf.cast(rgb, tf.float32)
-        
-        # Convert to rgb to lab
-        lab = tfio.experimental.color.rgb_to_lab(rgb)
-
-        l_channel = lab[:, :, 0]
-        a_channel = lab[:, :, 1]
-        b_channel = lab[:, :, 2]
-        
-        l_channel = tf.expand_dims(l_channel, axis=-1)
-        a_channel = tf.expand_dims(a_channel, axis=-1)
-        b_channel = tf.expand_dims(b_channel, axis=-1)
-
-        ab_channel = tf.concat([a_channel, b_channel], axis=-1)
-        
-        # -1 ~ 1 scaling
-        l_channel = (l_channel - 50.) / 50. 
-        ab_channel /= 128.       
-        
-        return l_channel, ab_channel
+        return color.rgb_to_lab(rgb)
     
     
-    def lab_to_rgb(self, lab, dim=3):
+    def lab_to_rgb(self, lab):
         """
         Convert to lab image to rgb image
 
         Args:
-            lab (Tensor, float32): (H, W, 3)
+            lab (Tensor, float32): (..., H, W, 3)
 
         Returns:
             {
                 Normalized lab image
                 Value Range : 0 ~ 1
             }
-            RGB (Tensor, float32) :(H, W, 3)
+            RGB (Tensor, float32) :(..., H, W, 3)
         """      
-        if dim == 4:
-            batch_l = lab[:, :, :, 0]
-            batch_a = lab[:, :, :, 1]
-            batch_b = lab[:, :, :, 2]
-        else:
-            batch_l = lab[:, :, 0]
-            batch_a = lab[:, :, 1]
-            batch_b = lab[:, :, 2]
-
-        
-        batch_l = (batch_l * 50) + 50.
-        batch_a *= 128.
-        batch_b *= 128.
-        
-        batch_l = tf.expand_dims(batch_l, axis=-1)
-        batch_a = tf.expand_dims(batch_a, axis=-1)
-        batch_b = tf.expand_dims(batch_b, axis=-1)
-        
-        batch_lab = tf.concat([batch_l, batch_a, batch_b], axis=-1)
-
-        rgb = tfio.experimental.color.lab_to_rgb(batch_lab)
-        
-        return rgb
+        return color.lab_to_rgb(lab)
     
     
     @tf.function
@@ -299,7 +255,7 @@ class Pix2Pix():
         train_data = tfds.load('CustomCelebahq',
                             data_dir=DATASET_DIR, split='train', shuffle_files=True)
 
-        number_train = train_data.reduce(0, lambda x, _: x + 1).numpy()
+        number_train = load_manifest(DATASET_DIR, 'CustomCelebahq', 'train')['num_examples']
         print("학습 데이터 개수", number_train)
         steps_per_epoch = number_train // self.BATCH_SIZE
         train_data = train_data.shuffle(1024)
@@ -0,0 +1,166 @@
+import tensorflow_datasets as tfds
+import tensorflow as tf
+from utils.datasets import Dataset
+from utils.record_index import RecordIndex
+from model.pix2pix import Pix2Pix
+import numpy as np
+import argparse
+import json
+import time
+
+# Per-stage input pipeline profile, parameter sweep and input-bound / model-bound verdict
+# python pipeline_benchmark.py --dataset_dir ./datasets/ --num_parallel_calls 1,4,-1 --report pipeline_report.json
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_dir",    type=str,   help="데이터셋 다운로드 디렉토리 설정", default='./datasets/')
+parser.add_argument("--dataset",        type=str,   help="데이터셋 종류", default='CustomCelebahq')
+parser.add_argument("--batch_sizes",    type=str,   help="sweep 할 배치 사이즈 (콤마 구분)", default='8')
+parser.add_argument("--image_sizes",    type=str,   help="sweep 할 이미지 해상도 (콤마 구분)", default='512')
+parser.add_argument("--num_parallel_calls", type=str, help="sweep 할 map 병렬 수 (콤마 구분, -1: AUTOTUNE)", default='-1')
+parser.add_argument("--warmup_batches", type=int,   help="측정 전 warmup 배치 수", default=5)
+parser.add_argument("--num_batches",    type=int,   help="측정할 배치 수", default=50)
+parser.add_argument("--augment_modes",  type=str,   help="전체 파이프라인(get_trainData)으로 비교할 증강 방식 (콤마 구분)", default='example,batch')
+parser.add_argument("--reduced_decode", help="JPEG DCT 축소 디코딩 사용", action='store_true')
+parser.add_argument("--model_steps",    type=int,   help="모델 학습 step 속도 측정 step 수 (0: verdict 생략)", default=20)
+parser.add_argument("--lr",             type=float, help="Learning rate 설정", default=0.001)
+parser.add_argument("--report",         type=str,   help="JSON 리포트 저장 경로", default='pipeline_report.json')
+parser.add_argument("--cpu",            help="CPU에서만 측정", action='store_true')
+
+args = parser.parse_args()
+
+STAGES = ['read', 'decode', 'augment', 'lab', 'batch', 'prefetch']
+
+
+def stage_datasets(dataset_config, num_parallel_calls):
+    """
+    Cumulative pipelines, each one adds a single stage of get_trainData (example mode)
+    on top of the previous one. Elements of read ~ lab are examples, of batch / prefetch batches.
+    """
+    decoders = dict(dataset_config.decoders() or {})
+    decoders['image'] = tfds.decode.SkipDecoding()
+    record_index = RecordIndex(tfds.builder(dataset_config.dataset_name, data_dir=dataset_config.data_dir),
+                               dataset_config.train_split)
+
+    stages = {}
+    stages['read'] = record_index.as_dataset(dataset_config.train_indices(), decoders=decoders)
+    stages['decode'] = stages['read'].map(
+        lambda sample: {'image': dataset_config.decode_image(sample['image'], dataset_config.base_train_size())},
+        num_parallel_calls=num_parallel_calls)
+    stages['augment'] = stages['decode'].enumerate().map(dataset_config.augment_train_ds,
+                                                         num_parallel_calls=num_parallel_calls)
+    stages['lab'] = stages['augment'].map(dataset_config.lab_triple, num_parallel_calls=num_parallel_calls)
+    stages['batch'] = stages['lab'].batch(dataset_config.batch_size)
+    stages['prefetch'] = stages['batch'].prefetch(tf.data.experimental.AUTOTUNE)
+    return stages
+
+
+def profile(dataset, num_elements, warmup_elements, examples_per_element):
+    """ examples/sec and per-element latency percentiles (time spent waiting in next) """
+    iterator = iter(dataset.repeat())
+    for _ in range(warmup_elements):
+        next(iterator)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(num_elements):
+        element_start = time.perf_counter()
+        next(iterator)
+        latencies.append(time.perf_counter() - element_start)
+    elapsed = time.perf_counter() - start
+
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'examples_per_sec': num_elements * examples_per_element / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+def model_examples_per_sec(batch_size, image_size):
+    """ Fused Pix2Pix train step rate on in-memory random batches, the input-free ceiling """
+    model_args = argparse.Namespace(model_prefix='benchmark', precision='float32', lr=args.lr)
+    gan = Pix2Pix(args=model_args, image_size=(image_size, image_size),
+                  gen_input_channel=1, gen_output_channel=2, dis_input_channel=3)
+    gan.compile_train_step(batch_size=batch_size)
+
+    batch = (tf.random.uniform((batch_size, image_size, image_size, 1), -1., 1.),
+             tf.random.uniform((batch_size, image_size, image_size, 2), -1., 1.),
+             tf.random.uniform((batch_size, image_size, image_size, 3), -1., 1.))
+    iterator = iter(tf.data.Dataset.from_tensors(batch).repeat())
+
+    gan.train_steps(iterator, tf.constant(2))[1].numpy()
+    start = time.perf_counter()
+    gan.train_steps(iterator, tf.constant(args.model_steps))[1].numpy()
+    steps_per_sec = args.model_steps / (time.perf_counter() - start)
+    return steps_per_sec * batch_size
+
+
+def verdict(input_rate, model_rate, stages):
+    # Largest per-example cost added by a single stage
+    costs = {}
+    previous = 0.
+    for name in STAGES:
+        cost = 1000. / stages[name]['examples_per_sec']
+        costs[name] = max(cost - previous, 0.)
+        previous = cost
+    bottleneck = max(costs, key=costs.get)
+
+    if input_rate >= model_rate:
+        return 'model-bound: input %.1f >= model %.1f examples/sec' % (input_rate, model_rate), costs
+    return 'input-bound: input %.1f < model %.1f examples/sec, slowest stage: %s (%.3f ms/example)' % (
+        input_rate, model_rate, bottleneck, costs[bottleneck]), costs
+
+
+if __name__ == '__main__':
+    if args.cpu:
+        tf.config.set_visible_devices([], 'GPU')
+
+    report = {'config': vars(args), 'runs': []}
+    model_rates = {}
+
+    for image_size in [int(size) for size in args.image_sizes.split(',')]:
+        for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+            if args.model_steps and (batch_size, image_size) not in model_rates:
+                model_rates[(batch_size, image_size)] = model_examples_per_sec(batch_size, image_size)
+
+            for num_parallel_calls in [int(calls) for calls in args.num_parallel_calls.split(',')]:
+                dataset_config = Dataset(
+                    data_dir=args.dataset_dir,
+                    image_size=(image_size, image_size),
+                    batch_size=batch_size,
+                    dataset=args.dataset,
+                    reduced_decode=args.reduced_decode,
+                )
+
+                run = {'image_size': image_size, 'batch_size': batch_size,
+                       'num_parallel_calls': num_parallel_calls, 'stages': {}, 'pipelines': {}}
+                print("image_size %d, batch_size %d, num_parallel_calls %d" % (image_size, batch_size, num_parallel_calls))
+
+                for name, dataset in stage_datasets(dataset_config, num_parallel_calls).items():
+                    per_element = batch_size if name in ('batch', 'prefetch') else 1
+                    run['stages'][name] = profile(dataset,
+                                                  num_elements=args.num_batches * batch_size // per_element,
+                                                  warmup_elements=args.warmup_batches * batch_size // per_element,
+                                                  examples_per_element=per_element)
+                    print("  %-9s %9.2f examples/sec  p50 %8.3f ms  p90 %8.3f ms  p99 %8.3f ms" % (
+                        name, run['stages'][name]['examples_per_sec'], run['stages'][name]['p50_ms'],
+                        run['stages'][name]['p90_ms'], run['stages'][name]['p99_ms']))
+
+                for augment_mode in args.augment_modes.split(','):
+                    dataset_config.augment_mode = augment_mode
+                    train_data = dataset_config.get_trainData(dataset_config.train_data)
+                    run['pipelines'][augment_mode] = profile(train_data, args.num_batches, args.warmup_batches, batch_size)
+                    print("  get_trainData(%s) %.2f examples/sec" % (augment_mode, run['pipelines'][augment_mode]['examples_per_sec']))
+
+                if args.model_steps:
+                    input_rate = max(result['examples_per_sec'] for result in run['pipelines'].values())
+                    run['model_examples_per_sec'] = model_rates[(batch_size, image_size)]
+                    run['verdict'], run['stage_ms_per_example'] = verdict(input_rate, run['model_examples_per_sec'], run['stages'])
+                    print("  " + run['verdict'])
+
+                report['runs'].append(run)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("리포트 저장:", args.report)
@@ -1,8 +1,13 @@
 from utils.datasets import Dataset
-from model.pix2pix import Pix2Pix
+from utils.data_options import add_data_option_args, data_options_from_args
+from utils.resolution_schedule import parse_resolution_schedule, resolution_phase
+from model.pix2pix import Pix2Pix, INPUT_DTYPES, precision_supported
 from utils.tensorboard import WriteTensorboard
 import tensorflow as tf
 import argparse
+import sys
+import resource
+import json
 import time
 from tqdm import tqdm
 import os
@@ -18,16 +23,282 @@ parser.add_argument("--optimizer",     type=str,   help="Optimizer", default='ad
 parser.add_argument("--model_name",     type=str,   help="저장될 모델 이름",
                     default=str(time.strftime('%m%d', time.localtime(time.time()))))
 parser.add_argument("--dataset_dir",    type=str,   help="데이터셋 다운로드 디렉토리 설정", default='./datasets/')
+parser.add_argument("--dataset",    type=str,   help="데이터셋 종류 (콤마로 여러 개 지정 시 가중치 혼합, e.g. CustomCelebahq,CustomCeleba)", default='CustomCelebahq')
+parser.add_argument("--source_weights",    type=str,   help="여러 데이터셋 샘플링 가중치 (콤마 구분, 미지정 시 데이터 개수 비율)", default=None)
+parser.add_argument("--interleave_mode",    type=str,   help="여러 데이터셋 혼합 순서 (deterministic: 재현/재개 가능, nondeterministic: 먼저 읽힌 example 우선)",
+                    default='deterministic', choices=['deterministic', 'nondeterministic'])
 parser.add_argument("--result_dir",    type=str,   help="Validation 결과 이미지 저장 경로", default='./result_dir/')
 parser.add_argument("--checkpoint_dir", type=str,   help="모델 저장 디렉토리 설정", default='./checkpoints/')
 parser.add_argument("--tensorboard_dir",  type=str,   help="텐서보드 저장 경로", default='tensorboard/')
 parser.add_argument("--use_weightDecay",  type=bool,  help="weightDecay 사용 유무", default=False)
 parser.add_argument("--save_weight",  type=bool, help="학습 가중치 저장", default=True)
 parser.add_argument("--save_frac",  type=int, help="학습 가중치 저장", default=3)
-parser.add_argument("--load_weight",  help="가중치 로드", action='store_true')
-parser.add_argument("--mixed_precision",  type=bool,  help="mixed_precision 사용", default=False)
+parser.add_argument("--load_weight",  help="가중치 로드 (마지막 체크포인트의 가중치와 입력 파이프라인 상태로 이어서 학습)", action='store_true')
+parser.add_argument("--save_steps",  type=int, help="에폭 중간 체크포인트 저장 step 간격 (0: 사용 안함)", default=0)
+parser.add_argument("--precision",  type=str,  help="학습 dtype 정책 (mixed_bfloat16 은 CPU 에서도 사용 가능)", default='float32',
+                    choices=['float32', 'mixed_float16', 'mixed_bfloat16'])
+parser.add_argument("--mixed_precision",  help="--precision mixed_float16 과 같음", action='store_true')
+parser.add_argument("--cache_dir",    type=str,   help="전처리 캐시 저장 경로 (미지정 시 캐시 사용 안함)", default=None)
+parser.add_argument("--cache_max_gb",    type=float,   help="전처리 캐시 최대 크기 (GB)", default=64)
+parser.add_argument("--augment_mode",    type=str,   help="학습 데이터 증강 방식 (example: 이미지 단위, batch: 배치 단위 벡터 연산)",
+                    default='example', choices=['example', 'batch'])
+parser.add_argument("--resolution",    type=str,   help="사전 리사이즈 데이터셋 config (auto, original, 256, 512, 768, 1024)", default='auto')
+parser.add_argument("--archive_path",    type=str,   help="TFDS 대신 압축 해제 없이 읽을 data.zip/.tar 경로 (미지정 시 TFDS 사용)", default=None)
+parser.add_argument("--reduced_decode",  help="JPEG DCT 축소 디코딩 사용", action='store_true')
+parser.add_argument("--shuffle_mode",    type=str,   help="학습 데이터 셔플 방식 (global: 에폭별 전체 index 순열, buffer: shuffle(1024))",
+                    default='global', choices=['global', 'buffer'])
+parser.add_argument("--seed",    type=int,   help="global 셔플 seed", default=0)
+parser.add_argument("--echo_factor",  type=str,  help="data echoing 배수 (1: 사용 안함, auto: 입력/모델 속도 비교로 자동 선택)", default='1')
+parser.add_argument("--max_echo_factor",  type=int,  help="auto echo_factor 최대값", default=4)
+parser.add_argument("--generator",  type=str,  help="Generator 구조", default='unet', choices=['unet', 'resunet'])
+parser.add_argument("--discriminator",  type=str,  help="Discriminator 구조", default='patchgan', choices=['patchgan', 'resnet'])
+parser.add_argument("--subset",  type=float,  help="학습/검증 데이터 중 이 비율만 메모리에 캐시해 사용 (빠른 실험용, e.g. 0.05)", default=None)
+parser.add_argument("--min_chroma",  type=float,  help="평균 채도(LAB |ab|)가 이 값 미만인 흑백/저채도 학습 이미지 제외 (e.g. 5)", default=None)
+parser.add_argument("--low_chroma_keep",  type=float,  help="저채도 이미지 중 남길 비율 (0: 모두 제외)", default=0.)
+parser.add_argument("--synthetic",  help="데이터셋 대신 메모리 내 합성 배치 사용 (입력 비용 없이 학습 속도 측정)", action='store_true')
+parser.add_argument("--benchmark",  help="학습 대신 warmup + 측정 step을 실행하고 steps/sec, images/sec, peak memory 출력", action='store_true')
+parser.add_argument("--warmup_steps",  type=int,  help="benchmark 측정 전 warmup step 수", default=10)
+parser.add_argument("--benchmark_steps",  type=int,  help="benchmark 측정 step 수", default=50)
+parser.add_argument("--benchmark_models",  type=str,  help="benchmark 할 generator:discriminator 구성 (콤마 구분, 미지정 시 --generator:--discriminator)",
+                    default=None)
+parser.add_argument("--benchmark_precisions",  type=str,  help="benchmark 할 precision (콤마 구분, 미지정 시 --precision, CPU peak memory 는 프로세스 전체 최대값)",
+                    default=None)
+parser.add_argument("--benchmark_remats",  type=str,  help="benchmark 할 --remat 설정 (세미콜론 구분, e.g. 'none;full_res;all', 미지정 시 --remat)",
+                    default=None)
+parser.add_argument("--train_loop",  type=str,  help="학습 루프 (keras: predict + train_on_batch, fused: tf.function 단일 그래프)",
+                    default='keras', choices=['keras', 'fused'])
+parser.add_argument("--xla",  help="D/G 학습 step 과 generator 추론을 XLA(jit_compile)로 컴파일 (지원되지 않는 op 가 있는 함수는 XLA 없이 실행)", action='store_true')
+parser.add_argument("--accum_steps",  type=int,  help="optimizer update 당 gradient 누적 배치 수 (유효 배치 = batch_size * accum_steps, fused 루프 전용)", default=1)
+parser.add_argument("--remat",  type=str,  help="backward 에서 activation 을 재계산할 generator 블록 (none | all | encoder | decoder | full_res | 블록 이름, 콤마 구분, fused 루프 전용)",
+                    default='none')
+parser.add_argument("--resolution_schedule",  type=str,
+                    help="에폭별 해상도 단계 '시작 에폭:해상도[:배치 사이즈]' 콤마 구분 (e.g. '0:128:32,10:256:16,30:512:8', 미지정 시 512 고정), 가중치는 단계 간 유지",
+                    default=None)
+parser.add_argument("--steps_per_call",  type=int,  help="fused 루프에서 tf.function 호출당 학습 step 수", default=1)
+add_data_option_args(parser)
 
 args = parser.parse_args()
+if args.mixed_precision:
+    args.precision = 'mixed_float16'
+if args.accum_steps > 1 and args.train_loop != 'fused':
+    parser.error("--accum_steps 는 --train_loop fused 에서만 사용할 수 있습니다")
+if (args.remat != 'none' or args.benchmark_remats) and args.train_loop != 'fused':
+    parser.error("--remat 는 --train_loop fused 에서만 사용할 수 있습니다")
+
+
+def build_dataset(image_size: tuple, echo_factor: int, dtype):
+    """ Input pipeline of one resolution phase, batches of args.batch_size """
+    return Dataset(
+        data_dir=args.dataset_dir,
+        image_size=image_size,
+        batch_size=args.batch_size,
+        dataset=args.dataset,
+        cache_dir=args.cache_dir,
+        cache_max_gb=args.cache_max_gb,
+        augment_mode=args.augment_mode,
+        resolution=None if args.resolution == 'original' else args.resolution,
+        reduced_decode=args.reduced_decode,
+        shuffle_mode=args.shuffle_mode,
+        seed=args.seed,
+        archive_path=args.archive_path,
+        source_weights=None if args.source_weights is None else [float(w) for w in args.source_weights.split(',')],
+        interleave_mode=args.interleave_mode,
+        synthetic=args.synthetic,
+        echo_factor=echo_factor,
+        data_options=data_options_from_args(args),
+        subset=args.subset,
+        min_chroma=args.min_chroma,
+        low_chroma_keep=args.low_chroma_keep,
+        # XLA compiles for one batch shape
+        drop_remainder=args.xla,
+        dtype=dtype,
+    )
+
+
+def switch_resolution(gan, dataset_config, config: dict, phase: tuple):
+    """
+    Continue training in the next phase of --resolution_schedule.
+    The models keep their weights, the input pipeline is rebuilt for the new image and batch size
+    and continues at the same epoch and position.
+
+    Returns:
+        Dataset of the new phase
+    """
+    _, image_size, batch_size = phase
+    config['image_size'] = (image_size, image_size)
+    args.batch_size = batch_size
+    print("해상도 단계: %dx%d, 배치 %d" % (image_size, image_size, batch_size))
+
+    # Dataset traces its tf.functions for one image size, a new one is built per phase
+    phase_config = build_dataset(config['image_size'], echo_factor=dataset_config.echo_factor, dtype=dataset_config.dtype)
+    phase_config.set_epoch(dataset_config.epoch, dataset_config.epoch_position, dataset_config.echo_offset)
+
+    gan.set_resolution(config['image_size'])
+    if args.train_loop == 'fused':
+        gan.compile_train_step(batch_size=batch_size)
+    if args.xla:
+        gan.setup_xla(batch_size=batch_size, train_loop=args.train_loop)
+
+    return phase_config
+
+
+def save_checkpoint(gan, weight_paths: dict, state_path: str, tag: str, pipeline_state: dict):
+    """ Save gen/dis/gan weights and the input pipeline state they were trained up to """
+    weights = {name: path + '_' + tag + '.h5' for name, path in weight_paths.items()}
+    gan.gen_model.save_weights(weights['gen'], overwrite=True)
+    gan.d_model.save_weights(weights['dis'], overwrite=True)
+    gan.gan_model.save_weights(weights['gan'], overwrite=True)
+
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'weights': weights, 'pipeline': pipeline_state,
+                   'label_rng': gan.label_rng.state.numpy().tolist()}, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def keras_train_step(gan, dataset_config, l_channel, ab_channel, batch_size: int):
+    """ One step of the keras loop (predict + train_on_batch), returns dis_res, gan_res """
+    # ---------------------
+    #  Train Discriminator
+    # ---------------------
+    original_lab = tf.concat([l_channel, ab_channel], axis=-1)
+
+    pred_ab = gan.predict_ab(l_channel)
+
+    pred_lab = tf.concat([l_channel, tf.cast(pred_ab, l_channel.dtype)], axis=-1)
+
+    # Unfreeze the discriminator
+    gan.d_model.trainable = True
+
+    fake_y_dis, real_y_dis = dataset_config.generate_patch_labels(
+        batch_size=batch_size,
+        disc_patch=gan.disc_patch,
+        random_augment=True)
+
+    d_real = gan.d_model.train_on_batch(original_lab, real_y_dis)
+    d_fake = gan.d_model.train_on_batch(pred_lab, fake_y_dis)
+
+    dis_res = 0.5 * tf.add(d_fake, d_real)
+
+    # Freeze the discriminator
+    gan.d_model.trainable = False
+
+    # ---------------------
+    #  Train Generator
+    # ---------------------
+    gan_res = gan.gan_model.train_on_batch(l_channel, [real_y_dis, ab_channel])
+
+    return dis_res, gan_res
+
+
+def run_train_steps(gan, dataset_config, train_iterator, steps: int):
+    """ `steps` optimizer steps of the selected train loop (accum_steps batches each), returns once the last one finished """
+    if args.train_loop == 'fused':
+        # numpy() waits for the last step
+        gan.train_steps(train_iterator, tf.constant(steps))[1].numpy()
+    else:
+        for _ in range(steps):
+            l_channel, ab_channel, _ = next(train_iterator)
+            keras_train_step(gan, dataset_config, l_channel, ab_channel, args.batch_size)
+
+
+def measure_model_rate(gan, config: dict, steps: int = 10):
+    """
+    Train step rate (examples/sec) on in-memory synthetic batches.
+    Weights and the label smoothing RNG are restored and optimizer slots zeroed afterwards,
+    so training starts as if never measured.
+    """
+    synthetic_config = Dataset(data_dir=args.dataset_dir, image_size=config['image_size'],
+                               batch_size=args.batch_size, synthetic=True,
+                               # Precision in effect, the model may have fallen back to float32
+                               dtype=INPUT_DTYPES[gan.precision])
+    train_iterator = iter(synthetic_config.get_trainData(synthetic_config.train_data).repeat())
+
+    gen_weights = gan.gen_model.get_weights()
+    dis_weights = gan.d_model.get_weights()
+    label_rng_state = gan.label_rng.state.numpy()
+
+    run_train_steps(gan, synthetic_config, train_iterator, 3)
+    start = time.perf_counter()
+    run_train_steps(gan, synthetic_config, train_iterator, steps)
+    examples_per_sec = steps * args.batch_size * args.accum_steps / (time.perf_counter() - start)
+
+    gan.gen_model.set_weights(gen_weights)
+    gan.d_model.set_weights(dis_weights)
+    gan.label_rng.reset(label_rng_state)
+    for optimizer in {id(model.optimizer): model.optimizer for model in (gan.d_model, gan.gan_model)}.values():
+        for variable in optimizer.variables():
+            variable.assign(tf.zeros_like(variable))
+
+    return examples_per_sec
+
+
+def peak_memory_mb():
+    """ Peak GPU memory since the last reset, or the process peak RSS on CPU """
+    if tf.config.list_physical_devices('GPU'):
+        return tf.config.experimental.get_memory_info('GPU:0')['peak'] / 1024**2
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(config: dict, dataset_config):
+    """ args.warmup_steps + args.benchmark_steps train steps per precision, generator/discriminator and remat configuration """
+    model_configs = args.benchmark_models or '%s:%s' % (args.generator, args.discriminator)
+    precisions = args.benchmark_precisions or args.precision
+    remats = args.benchmark_remats or args.remat
+
+    for precision, model_config, remat in [(p, m, r) for p in precisions.split(',') for m in model_configs.split(',')
+                                           for r in remats.split(';')]:
+        if not precision_supported(precision):
+            continue
+        args.precision = precision
+        args.generator, args.discriminator = model_config.split(':')
+        args.remat = remat
+        # Dataset traces its tf.functions for one dtype, a new one is built per configuration
+        benchmark_config = build_dataset(config['image_size'], echo_factor=dataset_config.echo_factor,
+                                         dtype=INPUT_DTYPES[precision])
+        train_data = benchmark_config.get_trainData(benchmark_config.train_data).repeat()
+        tf.keras.backend.clear_session()
+        gan = Pix2Pix(
+            args = args,
+            image_size = config['image_size'],
+            gen_input_channel=config['gen_input_channel'],
+            gen_output_channel=config['gen_output_channel'],
+            dis_input_channel=config['dis_input_channel'],
+        )
+        if args.train_loop == 'fused':
+            gan.compile_train_step(batch_size=args.batch_size)
+        if args.xla:
+            gan.setup_xla(batch_size=args.batch_size, train_loop=args.train_loop)
+        train_iterator = iter(train_data)
+
+        run_train_steps(gan, benchmark_config, train_iterator, args.warmup_steps)
+        if tf.config.list_physical_devices('GPU'):
+            tf.config.experimental.reset_memory_stats('GPU:0')
+
+        start = time.perf_counter()
+        run_train_steps(gan, benchmark_config, train_iterator, args.benchmark_steps)
+        steps_per_sec = args.benchmark_steps / (time.perf_counter() - start)
+
+        print("Benchmark %s %s (%s loop%s, remat %s, batch %dx%d, %s data): %.2f steps/sec, %.2f images/sec, peak memory %.1f MB" % (
+            model_config, precision, args.train_loop, ', xla' if args.xla else '', remat, args.batch_size, args.accum_steps,
+            dataset_config.dataset_name, steps_per_sec, steps_per_sec * args.batch_size * args.accum_steps, peak_memory_mb()))
+        # Stop the prefetch threads before the shard descriptors they read are closed
+        del train_iterator, train_data
+        benchmark_config.close()
+
+
+def load_checkpoint(gan, dataset_config, state_path: str):
+    with open(state_path, 'r') as f:
+        checkpoint = json.load(f)
+    gan.gen_model.load_weights(checkpoint['weights']['gen'])
+    gan.d_model.load_weights(checkpoint['weights']['dis'])
+    gan.gan_model.load_weights(checkpoint['weights']['gan'])
+    dataset_config.set_state(checkpoint['pipeline'])
+    if 'label_rng' in checkpoint:
+        gan.label_rng.reset(tf.constant(checkpoint['label_rng'], tf.int64))
+    print("체크포인트 로드: %s (epoch %d, position %d)" % (
+        checkpoint['weights']['gen'], dataset_config.epoch, dataset_config.epoch_position))
+
 
 if __name__ == '__main__':
     CURRENT_DATE = str(time.strftime('%m%d', time.localtime(time.time()))) + '_' + args.model_prefix
@@ -39,14 +310,33 @@ if __name__ == '__main__':
     os.makedirs(WEIGHTS_GEN, exist_ok=True)
     os.makedirs(WEIGHTS_DIS, exist_ok=True)
     os.makedirs(WEIGHTS_GAN, exist_ok=True)
+    WEIGHT_PATHS = {'gen': WEIGHTS_GEN, 'dis': WEIGHTS_DIS, 'gan': WEIGHTS_GAN}
+    # Fixed per model prefix so a restart on another day still finds it
+    CHECKPOINT_STATE = args.checkpoint_dir + '/' + args.model_prefix + '_latest.json'
+
+    try:
+        schedule = parse_resolution_schedule(args.resolution_schedule, args.batch_size)
+    except ValueError as e:
+        parser.error(str(e))
+    # Image and batch size of the first phase, switch_resolution moves to the later ones
+    phase = schedule[0]
+    args.batch_size = phase[2]
 
     config = {
-        'image_size': (512, 512),
+        'image_size': (phase[1], phase[1]),
         'gen_input_channel': 1,
         'gen_output_channel': 2,
         'dis_input_channel': 3
     }
 
+    dataset_config = build_dataset(config['image_size'],
+                                   echo_factor=1 if args.echo_factor == 'auto' else int(args.echo_factor),
+                                   dtype=INPUT_DTYPES[args.precision])
+
+    if args.benchmark:
+        run_benchmark(config, dataset_config)
+        sys.exit()
+
     gan = Pix2Pix(
         args = args,
         image_size = config['image_size'],
@@ -55,83 +345,116 @@ if __name__ == '__main__':
         dis_input_channel=config['dis_input_channel'],
     )
 
-    dataset_config = Dataset(
-        data_dir=args.dataset_dir,
-        image_size=config['image_size'],
-        batch_size=args.batch_size,
-    )
+    # The model falls back to float32 where bfloat16 is not supported,
+    # set before the first get_trainData / get_validData which trace the dtype
+    dataset_config.dtype = tf.as_dtype(INPUT_DTYPES[gan.precision])
+
+    if args.train_loop == 'fused':
+        gan.compile_train_step(batch_size=args.batch_size)
+    if args.xla:
+        gan.setup_xla(batch_size=args.batch_size, train_loop=args.train_loop)
+
+    if args.echo_factor == 'auto':
+        dataset_config.choose_echo_factor(measure_model_rate(gan, config), max_factor=args.max_echo_factor)
+
+    if args.load_weight:
+        load_checkpoint(gan, dataset_config, CHECKPOINT_STATE)
+    start_epoch = dataset_config.epoch
 
     train_data = dataset_config.get_trainData(dataset_config.train_data)
-    steps_per_epoch = dataset_config.number_train // args.batch_size
 
     valid_data = dataset_config.get_validData(dataset_config.valid_data)
-    valid_per_epoch = dataset_config.number_valid // args.batch_size
+    valid_per_epoch = dataset_config.valid_steps()
 
     tensorboard = WriteTensorboard(date_time=args.model_name,
                                    tensorboard_dir=args.tensorboard_dir,
                                    model_prefix=args.model_prefix)
 
-    for epoch in range(args.epoch):
-        pbar = tqdm(train_data, total=steps_per_epoch, desc='Batch', leave=True, disable=False)
+    for epoch in range(start_epoch, args.epoch):
+        if epoch > start_epoch:
+            dataset_config.set_epoch(epoch)
+        if resolution_phase(schedule, epoch) != phase:
+            phase = resolution_phase(schedule, epoch)
+            dataset_config = switch_resolution(gan, dataset_config, config, phase)
+            train_data = dataset_config.get_trainData(dataset_config.train_data)
+            valid_data = dataset_config.get_validData(dataset_config.valid_data)
+            valid_per_epoch = dataset_config.valid_steps()
+        # Optimizer steps, each one trains on accum_steps batches
+        steps_per_epoch = dataset_config.steps_per_epoch() // args.accum_steps
         valid_pbar = tqdm(valid_data, total=valid_per_epoch, desc='Valid Batch', leave=True, disable=False)
+        epoch_start = time.perf_counter()
 
         #  Train Session
-        for l_channel, ab_channel, _ in pbar:
-            # ---------------------
-            #  Train Discriminator
-            # ---------------------
-            original_lab = tf.concat([l_channel, ab_channel], axis=-1)
-    
-            pred_ab = gan.gen_model.predict(l_channel)
-            
-            pred_lab = tf.concat([l_channel, pred_ab], axis=-1)
-
-            # Unfreeze the discriminator
-            gan.d_model.trainable = True
-            
-            fake_y_dis, real_y_dis = dataset_config.generate_patch_labels(
-                batch_size=args.batch_size,
-                disc_patch=gan.disc_patch,
-                random_augment=True)
-            
-            d_real = gan.d_model.train_on_batch(original_lab, real_y_dis)
-            d_fake = gan.d_model.train_on_batch(pred_lab, fake_y_dis)
-            
-            dis_res = 0.5 * tf.add(d_fake, d_real)
-
-            # Freeze the discriminator
-            gan.d_model.trainable = False
-            
-            # ---------------------
-            #  Train Generator
-            # ---------------------
-            gan_res = gan.gan_model.train_on_batch(l_channel, [real_y_dis, ab_channel])
-            
-            pbar.set_description("Epoch : %d Dis loss: %f, Dis ACC: %f, Gan loss: %f, Gan ACC: %f Gen loss: %f Gen MAE: %f" % (
-                                        epoch,
-                                        dis_res[0],
-                                        dis_res[1],
-                                        gan_res[0],
-                                        gan_res[1],
-                                        gan_res[2],
-                                        gan_res[3] * 100))
-                
+        if args.train_loop == 'fused':
+            train_iterator = iter(train_data)
+            pbar = tqdm(total=steps_per_epoch, desc='Batch', leave=True, disable=False)
+            done_steps = 0
+            while done_steps < steps_per_epoch:
+                call_steps = min(args.steps_per_call, steps_per_epoch - done_steps)
+                dis_res, gan_res = gan.train_steps(train_iterator, tf.constant(call_steps))
+                done_steps += call_steps
+
+                if args.save_steps and done_steps // args.save_steps > (done_steps - call_steps) // args.save_steps:
+                    save_checkpoint(gan, WEIGHT_PATHS, CHECKPOINT_STATE, tag='%d_%d' % (epoch, done_steps),
+                                    pipeline_state=dataset_config.get_state(consumed=done_steps * args.batch_size * args.accum_steps))
+
+                pbar.update(call_steps)
+                pbar.set_description("Epoch : %d Dis loss: %f, Dis ACC: %f, Gan loss: %f, Gan adv loss: %f Gen MAE: %f Gan ACC: %f" % (
+                                            epoch,
+                                            dis_res[0],
+                                            dis_res[1],
+                                            gan_res[0],
+                                            gan_res[1],
+                                            gan_res[2] * 100,
+                                            gan_res[3]))
+            pbar.close()
+            consumed = done_steps * args.batch_size * args.accum_steps
+        else:
+            pbar = tqdm(train_data, total=steps_per_epoch, desc='Batch', leave=True, disable=False)
+            done_steps = 0
+            consumed = 0
+            for l_channel, ab_channel, _ in pbar:
+                done_steps += 1
+                consumed += int(tf.shape(l_channel)[0])
+                dis_res, gan_res = keras_train_step(gan, dataset_config, l_channel, ab_channel, args.batch_size)
+
+                pbar.set_description("Epoch : %d Dis loss: %f, Dis ACC: %f, Gan loss: %f, Gan adv loss: %f Gen MAE: %f Gan ACC: %f" % (
+                                            epoch,
+                                            dis_res[0],
+                                            dis_res[1],
+                                            gan_res[0],
+                                            gan_res[1],
+                                            gan_res[2] * 100,
+                                            gan_res[3]))
+
+                if args.save_steps and done_steps % args.save_steps == 0:
+                    save_checkpoint(gan, WEIGHT_PATHS, CHECKPOINT_STATE, tag='%d_%d' % (epoch, done_steps),
+                                    pipeline_state=dataset_config.get_state(consumed=consumed))
+
+        epoch_time = time.perf_counter() - epoch_start
+        steps_per_sec = done_steps / epoch_time
+        print("Train loop: %s, %.2f steps/sec" % (args.train_loop, steps_per_sec))
+        for source_name, count in dataset_config.source_counts(consumed).items():
+            print("  %s: %d examples, %.1f examples/sec" % (source_name, count, count / epoch_time))
+
         write_dict = {
             'Discriminator Loss': dis_res[0],
             'Discriminator Accuracy': dis_res[1],
+            # gan_model.train_on_batch order, the fused step returns the same
             'GAN Loss': gan_res[0],
-            'GAN Accuracy': gan_res[1],
-            'Generator Loss': gan_res[2],
-            'Generator MAE': gan_res[3] * 100
+            'GAN Adversarial Loss': gan_res[1],
+            'Generator MAE': gan_res[2] * 100,
+            'GAN Accuracy': gan_res[3],
+            'Steps per sec': steps_per_sec
         }
                 
     
         # Save Training Weights
         if args.save_weight:
             if epoch % args.save_frac == 0:
-                gan.gen_model.save_weights(WEIGHTS_GEN + '_'+ str(epoch) + '.h5', overwrite=True)
-                gan.d_model.save_weights(WEIGHTS_DIS + '_'+ str(epoch) + '.h5', overwrite=True)
-                gan.gan_model.save_weights(WEIGHTS_GAN + '_'+ str(epoch) + '.h5', overwrite=True)
+                # Epoch finished, a restart continues with the next epoch
+                save_checkpoint(gan, WEIGHT_PATHS, CHECKPOINT_STATE, tag=str(epoch),
+                                pipeline_state=dataset_config.get_epoch_end_state())
         
 
         #  Valid Session
@@ -139,11 +462,11 @@ if __name__ == '__main__':
             # ---------------------
             #  Predict ab channels
             # ---------------------
-            pred_ab = gan.gen_model.predict(l_channel)
+            pred_ab = gan.predict_ab(l_channel)
 
-            pred_lab = tf.concat([l_channel, pred_ab], axis=-1)
+            pred_lab = tf.concat([tf.cast(l_channel, tf.float32), pred_ab], axis=-1)
 
-            rgb = dataset_config.lab_to_rgb(pred_lab, dim=4)
+            rgb = dataset_config.lab_to_rgb(pred_lab)
 
             mae_percent = gan.calc_metric(
                 y_true=original_img, y_pred=rgb, method='mae')
@@ -0,0 +1,89 @@
+from model.pix2pix import Pix2Pix
+import tensorflow as tf
+import argparse
+import time
+
+# python train_loop_benchmark.py --batch_size 8 --steps 50
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--model_prefix",     type=str,   help="Model name", default='benchmark')
+parser.add_argument("--batch_size",     type=int,   help="배치 사이즈값 설정", default=8)
+parser.add_argument("--image_size",     type=int,   help="이미지 해상도", default=512)
+parser.add_argument("--lr",             type=float, help="Learning rate 설정", default=0.001)
+parser.add_argument("--warmup_steps",   type=int,   help="측정 전 warmup step 수", default=5)
+parser.add_argument("--steps",          type=int,   help="측정할 step 수", default=50)
+parser.add_argument("--steps_per_call",  type=int,  help="fused 루프에서 tf.function 호출당 학습 step 수", default=1)
+parser.add_argument("--precision",  type=str,  help="학습 dtype 정책 (mixed_bfloat16 은 CPU 에서도 사용 가능)", default='float32',
+                    choices=['float32', 'mixed_float16', 'mixed_bfloat16'])
+
+args = parser.parse_args()
+
+
+def random_dataset(batch_size, image_size):
+    l_channel = tf.random.uniform((batch_size, image_size, image_size, 1), -1., 1.)
+    ab_channel = tf.random.uniform((batch_size, image_size, image_size, 2), -1., 1.)
+    norm_rgb = tf.random.uniform((batch_size, image_size, image_size, 3), -1., 1.)
+    return tf.data.Dataset.from_tensors((l_channel, ab_channel, norm_rgb)).repeat()
+
+
+def keras_loop(gan, iterator, steps):
+    fake_y_dis = tf.zeros((args.batch_size,) + gan.disc_patch)
+    real_y_dis = tf.ones((args.batch_size,) + gan.disc_patch)
+
+    for _ in range(steps):
+        l_channel, ab_channel, _ = next(iterator)
+        original_lab = tf.concat([l_channel, ab_channel], axis=-1)
+        pred_ab = gan.gen_model.predict(l_channel)
+        pred_lab = tf.concat([l_channel, pred_ab], axis=-1)
+
+        gan.d_model.trainable = True
+        gan.d_model.train_on_batch(original_lab, real_y_dis)
+        gan.d_model.train_on_batch(pred_lab, fake_y_dis)
+        gan.d_model.trainable = False
+
+        gan_res = gan.gan_model.train_on_batch(l_channel, [real_y_dis, ab_channel])
+
+    return gan_res
+
+
+def fused_loop(gan, iterator, steps):
+    done_steps = 0
+    while done_steps < steps:
+        call_steps = min(args.steps_per_call, steps - done_steps)
+        _, gan_res = gan.train_steps(iterator, tf.constant(call_steps))
+        done_steps += call_steps
+
+    # Wait for the last step to finish
+    return gan_res.numpy()
+
+
+def measure(loop_fn, gan, iterator):
+    loop_fn(gan, iterator, args.warmup_steps)
+
+    start = time.perf_counter()
+    loop_fn(gan, iterator, args.steps)
+    elapsed = time.perf_counter() - start
+
+    return args.steps / elapsed
+
+
+if __name__ == '__main__':
+    gan = Pix2Pix(
+        args=args,
+        image_size=(args.image_size, args.image_size),
+        gen_input_channel=1,
+        gen_output_channel=2,
+        dis_input_channel=3,
+    )
+
+    iterator = iter(random_dataset(args.batch_size, args.image_size))
+
+    # The keras loop must run first, compile_train_step leaves D trainable.
+    keras_steps_per_sec = measure(keras_loop, gan, iterator)
+
+    gan.compile_train_step(batch_size=args.batch_size)
+    fused_steps_per_sec = measure(fused_loop, gan, iterator)
+
+    print("keras loop : %.2f steps/sec" % keras_steps_per_sec)
+    print("fused loop : %.2f steps/sec (steps_per_call=%d)" % (fused_steps_per_sec, args.steps_per_call))
+    print("speedup    : %.2fx" % (fused_steps_per_sec / keras_steps_per_sec))
@@ -0,0 +1,97 @@
+import tensorflow as tf
+import threading
+import tarfile
+import zipfile
+import fnmatch
+import os
+
+# One open handle per archive and thread (or worker process), members are read concurrently
+_local = threading.local()
+
+
+def is_tar(archive_path: str):
+    return not zipfile.is_zipfile(archive_path) and tarfile.is_tarfile(archive_path)
+
+
+def list_members(archive_path: str, member_dir: str, pattern: str):
+    """
+    Sorted names of the archive members `<member_dir>/<pattern>`, without extracting anything.
+
+    Args:
+        archive_path (str): .zip or uncompressed .tar
+        member_dir (str): directory inside the archive (e.g. 'train')
+        pattern (str): glob pattern of the file names (e.g. '*.jpg')
+    """
+    if is_tar(archive_path):
+        with tarfile.open(archive_path, 'r:') as archive:
+            names = [member.name for member in archive.getmembers() if member.isfile()]
+    else:
+        with zipfile.ZipFile(archive_path) as archive:
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+
+    member_pattern = os.path.join(member_dir, pattern) if member_dir else pattern
+    return sorted(name for name in names if fnmatch.fnmatch(name, member_pattern))
+
+
+def _open_archive(archive_path: str):
+    archives = getattr(_local, 'archives', None)
+    if archives is None:
+        archives = _local.archives = {}
+
+    if archive_path not in archives:
+        if is_tar(archive_path):
+            # 'r:' only, compressed tars have no random access to their members
+            archive = tarfile.open(archive_path, 'r:')
+            archives[archive_path] = (archive, {member.name: member for member in archive.getmembers()})
+        else:
+            archives[archive_path] = (zipfile.ZipFile(archive_path), None)
+    return archives[archive_path]
+
+
+def read_member(archive_path: str, name: str):
+    """ Bytes of one archive member, through the calling thread's own handle """
+    archive, tar_members = _open_archive(archive_path)
+    if tar_members is not None:
+        return archive.extractfile(tar_members[name]).read()
+    return archive.read(name)
+
+
+class ArchiveReader:
+    """
+    Random access to image files inside a .zip or uncompressed .tar,
+    used as a tf.data source without extracting the archive.
+    """
+    def __init__(self, archive_path: str, members: list):
+        """
+        Args:
+            archive_path (str): .zip or uncompressed .tar
+            members (list): member names, examples are numbered in this order
+        """
+        self.archive_path = archive_path
+        self.members = list(members)
+
+
+    def __len__(self):
+        return len(self.members)
+
+
+    def _read_member(self, index):
+        return read_member(self.archive_path, self.members[int(index)])
+
+
+    def read(self, index):
+        """ Encoded image of member `index` (Tensor, string) """
+        encoded = tf.numpy_function(self._read_member, [index], tf.string, stateful=False)
+        encoded.set_shape([])
+        return encoded
+
+
+    def as_dataset(self, indices):
+        """
+        {'image': encoded image} in the order of `indices`, members are read by parallel map calls.
+
+        Args:
+            indices (tf.data.Dataset, int64): member indices
+        """
+        return indices.map(lambda index: {'image': self.read(index)},
+                           num_parallel_calls=tf.data.experimental.AUTOTUNE)
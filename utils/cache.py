@@ -0,0 +1,131 @@
+import tensorflow as tf
+import hashlib
+import json
+import os
+import shutil
+import time
+
+# Bump when the on-disk layout of a cache entry changes.
+CACHE_FORMAT_VERSION = 1
+COMPLETE_FILE = 'COMPLETE'
+# An .incomplete entry written to within this many seconds may belong to another process, eviction keeps it
+INCOMPLETE_MAX_AGE = 3600
+
+
+class DatasetCache:
+    def __init__(self, cache_dir: str, max_bytes: int, compression=None):
+        """
+        Fingerprinted on-disk cache for the deterministic stages of the input pipeline.
+        Every entry is a tf.data snapshot directory named `<name>-<fingerprint>`,
+        so changing any parameter that feeds the fingerprint invalidates it automatically.
+
+        Args:
+            cache_dir: 캐시 저장 경로
+            max_bytes: 캐시 디렉토리 최대 크기 (byte), 초과 시 사용하지 않는 fingerprint부터 삭제
+            compression: tf.data snapshot 압축 방식 (None, 'GZIP')
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.active_entries = set()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    @staticmethod
+    def fingerprint(**params):
+        params['cache_format_version'] = CACHE_FORMAT_VERSION
+        serialized = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()[:16]
+
+
+    def entry_path(self, name: str, fingerprint: str):
+        return os.path.join(self.cache_dir, name + '-' + fingerprint)
+
+
+    def is_complete(self, path: str):
+        return os.path.exists(os.path.join(path, COMPLETE_FILE))
+
+
+    def cached(self, dataset, name: str, fingerprint: str):
+        """
+        Return `dataset` read back from its cache entry, writing the entry first if needed.
+
+        Args:
+            dataset (tf.data.Dataset): deterministic dataset to cache
+            name (str): entry prefix (e.g. 'CustomCelebahq-train')
+            fingerprint (str): DatasetCache.fingerprint() of every parameter the dataset depends on
+
+        Returns:
+            tf.data.Dataset with the same element_spec as `dataset`
+        """
+        path = self.entry_path(name, fingerprint)
+        self.active_entries.add(os.path.basename(path))
+
+        if not self.is_complete(path):
+            tmp_path = path + '.incomplete'
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.rmtree(path, ignore_errors=True)
+
+            print("캐시 생성:", path)
+            start = time.perf_counter()
+            tf.data.experimental.save(dataset, tmp_path, compression=self.compression)
+            open(os.path.join(tmp_path, COMPLETE_FILE), 'w').close()
+            os.rename(tmp_path, path)
+            print("캐시 생성 완료: %.1f sec" % (time.perf_counter() - start))
+
+            self.evict()
+        else:
+            # Mark as recently used for eviction ordering
+            os.utime(path)
+
+        return tf.data.experimental.load(path,
+                                         element_spec=dataset.element_spec,
+                                         compression=self.compression)
+
+
+    def entry_bytes(self, path: str):
+        total = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                total += os.path.getsize(os.path.join(root, file))
+        return total
+
+
+    def last_write(self, path: str):
+        """ Latest mtime of the entry and its files, a snapshot being written grows its shard files in place """
+        latest = os.path.getmtime(path)
+        for root, _, files in os.walk(path):
+            for file in files:
+                latest = max(latest, os.path.getmtime(os.path.join(root, file)))
+        return latest
+
+
+    def evict(self):
+        """
+        Delete stale entries, least recently used first, until the cache fits in max_bytes.
+        Entries used by this process are never evicted, nor .incomplete entries
+        written to within INCOMPLETE_MAX_AGE, which another process may still be writing.
+        """
+        now = time.time()
+        entries = []
+        for entry in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, entry)
+            if os.path.isdir(path):
+                entries.append((os.path.getmtime(path), entry, self.entry_bytes(path)))
+
+        total = sum(size for _, _, size in entries)
+
+        for _, entry, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry in self.active_entries:
+                continue
+            path = os.path.join(self.cache_dir, entry)
+            if entry.endswith('.incomplete') and now - self.last_write(path) < INCOMPLETE_MAX_AGE:
+                continue
+            print("캐시 삭제:", entry)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+        if total > self.max_bytes:
+            print("경고: 현재 사용 중인 캐시가 최대 크기를 초과합니다 (%.2f GB)" % (total / 1024**3))
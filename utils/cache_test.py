@@ -0,0 +1,87 @@
+import tensorflow as tf
+import os
+import time
+from unittest import mock
+from utils.cache import DatasetCache, INCOMPLETE_MAX_AGE
+
+
+def make_entry(cache_dir, entry, num_bytes, mtime):
+    """ Fake cache entry directory of `num_bytes`, last written at `mtime` """
+    path = os.path.join(cache_dir, entry)
+    os.makedirs(path)
+    file_path = os.path.join(path, 'data')
+    with open(file_path, 'wb') as f:
+        f.write(b'\0' * num_bytes)
+    os.utime(file_path, (mtime, mtime))
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+class DatasetCacheTest(tf.test.TestCase):
+    """ Fingerprinted entries and LRU eviction of DatasetCache """
+
+    def test_fingerprint_follows_parameters(self):
+        fingerprint = DatasetCache.fingerprint(dataset='CustomCelebahq', image_size=(512, 512), scale=1.5)
+
+        # Same parameters in any order give the same entry
+        self.assertEqual(fingerprint, DatasetCache.fingerprint(scale=1.5, image_size=(512, 512), dataset='CustomCelebahq'))
+        self.assertNotEqual(fingerprint, DatasetCache.fingerprint(dataset='CustomCelebahq', image_size=(256, 256), scale=1.5))
+        self.assertNotEqual(fingerprint, DatasetCache.fingerprint(dataset='CustomCelebahq', image_size=(512, 512), scale=1.4))
+
+    def test_entry_is_written_once_and_invalidated_by_fingerprint(self):
+        cache = DatasetCache(self.get_temp_dir(), max_bytes=1024**3)
+        dataset = tf.data.Dataset.range(5)
+
+        fingerprint = DatasetCache.fingerprint(stage='range', count=5)
+        self.assertEqual(list(cache.cached(dataset, 'test', fingerprint).as_numpy_iterator()), list(range(5)))
+        path = cache.entry_path('test', fingerprint)
+        self.assertTrue(cache.is_complete(path))
+
+        # A complete entry is read back, not written again
+        with mock.patch.object(tf.data.experimental, 'save') as save:
+            self.assertEqual(list(cache.cached(dataset, 'test', fingerprint).as_numpy_iterator()), list(range(5)))
+            save.assert_not_called()
+
+        # Another fingerprint is another entry, the old one is left to eviction
+        other = DatasetCache.fingerprint(stage='range', count=6)
+        self.assertEqual(len(list(cache.cached(tf.data.Dataset.range(6), 'test', other).as_numpy_iterator())), 6)
+        self.assertNotEqual(cache.entry_path('test', other), path)
+        self.assertTrue(os.path.isdir(path))
+
+    def test_evicts_least_recently_used_first(self):
+        cache_dir = self.get_temp_dir()
+        cache = DatasetCache(cache_dir, max_bytes=2500)
+        now = time.time()
+        for age, entry in ((300, 'oldest'), (200, 'older'), (100, 'recent')):
+            make_entry(cache_dir, entry, 1000, now - age)
+
+        cache.evict()
+
+        self.assertCountEqual(os.listdir(cache_dir), ['older', 'recent'])
+
+    def test_active_entries_are_kept(self):
+        cache_dir = self.get_temp_dir()
+        cache = DatasetCache(cache_dir, max_bytes=1500)
+        now = time.time()
+        make_entry(cache_dir, 'active', 1000, now - 300)
+        make_entry(cache_dir, 'stale', 1000, now - 100)
+        cache.active_entries.add('active')
+
+        cache.evict()
+
+        self.assertCountEqual(os.listdir(cache_dir), ['active'])
+
+    def test_incomplete_entries_of_other_writers_are_kept(self):
+        cache_dir = self.get_temp_dir()
+        cache = DatasetCache(cache_dir, max_bytes=500)
+        now = time.time()
+        make_entry(cache_dir, 'writing.incomplete', 1000, now - 10)
+        make_entry(cache_dir, 'crashed.incomplete', 1000, now - 2 * INCOMPLETE_MAX_AGE)
+
+        cache.evict()
+
+        self.assertCountEqual(os.listdir(cache_dir), ['writing.incomplete'])
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,73 @@
+import tensorflow as tf
+import numpy as np
+import os
+from utils import color
+from utils.color import AB_SCALE
+from utils.manifest import manifest_path
+
+# Bump when the statistic changes, stored files of older versions are recomputed.
+CHROMA_VERSION = 1
+# Images are measured at this size, enough for a mean and cheap to convert
+CHROMA_SIZE = 64
+
+
+def chroma_path(data_dir: str, dataset_name: str, version: str, split: str):
+    """ Per-example chroma of a split, stored next to its manifest """
+    path = manifest_path(data_dir, dataset_name.replace('/', '_'), version, split)
+    return os.path.splitext(path)[0] + '-chroma%d.npy' % CHROMA_VERSION
+
+
+def mean_abs_ab(encoded):
+    """
+    Mean |ab| (LAB chroma, sqrt(a^2 + b^2) in LAB units) over the image, near 0 for grayscale images.
+    JPEGs are decoded at 1/8 scale in the DCT domain.
+
+    Args:
+        encoded (Tensor, string): encoded image
+    """
+    img = tf.cond(tf.io.is_jpeg(encoded),
+                  lambda: tf.io.decode_jpeg(encoded, channels=3, ratio=8),
+                  lambda: tf.io.decode_image(encoded, channels=3, expand_animations=False))
+    img.set_shape([None, None, 3])
+    img = tf.image.resize(img, (CHROMA_SIZE, CHROMA_SIZE), method=tf.image.ResizeMethod.AREA)
+    _, ab = color.rgb_to_lab(img)
+    return tf.reduce_mean(tf.norm(ab, axis=-1)) * AB_SCALE
+
+
+def compute_chroma(encoded_data):
+    """
+    mean_abs_ab of every example, measured by parallel map calls.
+
+    Args:
+        encoded_data (tf.data.Dataset): {'image': encoded image} in split order
+    """
+    chroma = encoded_data.map(lambda sample: mean_abs_ab(sample['image']),
+                              num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    chroma = chroma.batch(256).prefetch(tf.data.experimental.AUTOTUNE)
+    return np.concatenate([batch.numpy() for batch in chroma] or [np.zeros([0])]).astype(np.float32)
+
+
+def load_chroma(path: str, encoded_data_fn):
+    """
+    Read the stored per-example chroma of a split, measuring it on first use.
+
+    Args:
+        path (str): chroma_path of the split
+        encoded_data_fn: returns the compute_chroma input, only called when nothing is stored
+
+    Returns:
+        np.ndarray (float32): mean |ab| of each example, in split order
+    """
+    if os.path.exists(path):
+        return np.load(path)
+
+    print("이미지별 채도 계산 중:", path)
+    chroma = compute_chroma(encoded_data_fn())
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, chroma)
+    os.replace(tmp_path, path)
+
+    return chroma
@@ -0,0 +1,54 @@
+import tensorflow as tf
+import numpy as np
+import os
+from utils import chroma
+
+
+def encode_png(rgb):
+    return tf.io.encode_png(tf.constant(rgb, tf.uint8))
+
+
+class ChromaTest(tf.test.TestCase):
+    """ Per-image chroma used by the low-chroma filter """
+
+    def test_grayscale_has_no_chroma(self):
+        gray = np.repeat(np.linspace(0, 255, 128 * 128).reshape(128, 128, 1), 3, axis=-1).astype(np.uint8)
+
+        self.assertLess(float(chroma.mean_abs_ab(encode_png(gray))), 0.5)
+
+    def test_colour_image_has_chroma(self):
+        red = np.zeros((128, 128, 3), np.uint8)
+        red[..., 0] = 255
+
+        # Pure sRGB red is about 104 in LAB |ab|
+        self.assertAllClose(float(chroma.mean_abs_ab(encode_png(red))), 104.6, atol=1.)
+
+    def test_jpeg_is_measured_like_png(self):
+        image = np.zeros((128, 128, 3), np.uint8)
+        image[..., 1] = 200
+        image[..., 2] = 60
+        jpeg = tf.io.encode_jpeg(tf.constant(image), quality=100)
+
+        self.assertAllClose(float(chroma.mean_abs_ab(jpeg)), float(chroma.mean_abs_ab(encode_png(image))), atol=2.)
+
+    def test_load_chroma_stores_split_order(self):
+        images = [np.full((16, 16, 3), value, np.uint8) for value in ((128, 128, 128), (255, 0, 0), (0, 0, 255))]
+        calls = []
+
+        def encoded_data():
+            calls.append(1)
+            return tf.data.Dataset.from_tensor_slices({'image': tf.stack([encode_png(image) for image in images])})
+
+        path = os.path.join(self.get_temp_dir(), 'manifests', 'test-chroma1.npy')
+        measured = chroma.load_chroma(path, encoded_data)
+        stored = chroma.load_chroma(path, encoded_data)
+
+        self.assertAllEqual(measured, stored)
+        self.assertLen(calls, 1)
+        self.assertLess(measured[0], 0.5)
+        self.assertGreater(measured[1], 50.)
+        self.assertGreater(measured[2], 50.)
+
+
+if __name__ == '__main__':
+    tf.test.main()
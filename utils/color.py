@@ -0,0 +1,103 @@
+"""
+sRGB <-> CIE LAB (D65) conversion shared by the dataset pipeline and the trainers.
+Same formulas as tfio.experimental.color / skimage.color, works on any rank (..., 3).
+
+Normalized value range
+    L  : -1 ~ 1  ((L - 50) / 50)
+    ab : -1 ~ 1  (ab / 128)
+"""
+import numpy as np
+import tensorflow as tf
+
+L_SCALE = 50.
+AB_SCALE = 128.
+
+# sRGB -> XYZ (D65)
+RGB_TO_XYZ = np.array([[0.412453, 0.357580, 0.180423],
+                       [0.212671, 0.715160, 0.072169],
+                       [0.019334, 0.119193, 0.950227]], dtype=np.float64)
+XYZ_REF_WHITE = np.array([0.95047, 1., 1.08883], dtype=np.float64)
+
+# Reference white folded into the matrix: rgb_linear -> xyz / white
+RGB_TO_XYZN = RGB_TO_XYZ / XYZ_REF_WHITE[:, None]
+XYZN_TO_RGB = np.linalg.inv(RGB_TO_XYZN)
+
+# f(xyz) -> normalized L, a, b
+#   L = 116 * fy - 16, a = 500 * (fx - fy), b = 200 * (fy - fz)
+F_TO_LAB = np.array([[0., 116., 0.],
+                     [500., -500., 0.],
+                     [0., 200., -200.]], dtype=np.float64)
+LAB_OFFSET = np.array([-16., 0., 0.], dtype=np.float64)
+LAB_NORM = np.array([L_SCALE, AB_SCALE, AB_SCALE], dtype=np.float64)
+LAB_NORM_OFFSET = np.array([L_SCALE, 0., 0.], dtype=np.float64)
+
+F_TO_NORM_LAB = F_TO_LAB / LAB_NORM[:, None]
+NORM_LAB_OFFSET = (LAB_OFFSET - LAB_NORM_OFFSET) / LAB_NORM
+NORM_LAB_TO_F = np.linalg.inv(F_TO_NORM_LAB)
+
+
+def _srgb_to_linear(rgb):
+    return np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+
+
+# 256 entry sRGB gamma lookup table for uint8 input
+SRGB_LINEAR_LUT = _srgb_to_linear(np.arange(256, dtype=np.float64) / 255.).astype(np.float32)
+
+
+def _matmul_channels(x, matrix):
+    """ (..., 3) x (3, 3)^T for any rank """
+    return tf.tensordot(x, tf.constant(matrix.T, dtype=x.dtype), axes=1)
+
+
+def rgb_to_lab(rgb, dtype=tf.float32):
+    """
+    Convert to rgb image to normalized lab image
+
+    Args:
+        rgb (Tensor): (..., 3), uint8 or float in 0 ~ 255
+        dtype: output dtype (tf.float32, tf.float16)
+
+    Returns:
+        L, ab (Tensor): (..., 1), (..., 2), -1 ~ 1
+    """
+    if rgb.dtype == tf.uint8:
+        # Fast path: gamma through the lookup table
+        linear = tf.gather(tf.constant(SRGB_LINEAR_LUT), tf.cast(rgb, tf.int32))
+    else:
+        rgb = tf.cast(rgb, tf.float32) / 255.
+        linear = tf.where(rgb > 0.04045, tf.pow((rgb + 0.055) / 1.055, 2.4), rgb / 12.92)
+
+    xyz = _matmul_channels(linear, RGB_TO_XYZN)
+    f = tf.where(xyz > 0.008856, tf.pow(tf.maximum(xyz, 0.008856), 1. / 3.), xyz * 7.787 + 16. / 116.)
+    lab = _matmul_channels(f, F_TO_NORM_LAB) + tf.constant(NORM_LAB_OFFSET, dtype=tf.float32)
+
+    lab = tf.cast(lab, dtype)
+    return lab[..., :1], lab[..., 1:]
+
+
+def lab_to_rgb(lab, dtype=tf.float32):
+    """
+    Convert to normalized lab image to rgb image
+
+    Args:
+        lab (Tensor): (..., 3), normalized L, a, b (-1 ~ 1)
+        dtype: tf.float32 -> 0 ~ 1 rgb, tf.uint8 -> clipped 0 ~ 255 rgb
+
+    Returns:
+        RGB (Tensor): (..., 3)
+    """
+    lab = tf.cast(lab, tf.float32)
+    f = _matmul_channels(lab - tf.constant(NORM_LAB_OFFSET, dtype=tf.float32), NORM_LAB_TO_F)
+    # fz can not be negative
+    f = tf.concat([f[..., :2], tf.maximum(f[..., 2:], 0.)], axis=-1)
+
+    xyz = tf.where(f > 0.2068966, tf.pow(f, 3.), (f - 16. / 116.) / 7.787)
+    linear = _matmul_channels(xyz, XYZN_TO_RGB)
+    rgb = tf.where(linear > 0.0031308,
+                   1.055 * tf.pow(tf.maximum(linear, 0.0031308), 1. / 2.4) - 0.055,
+                   linear * 12.92)
+
+    if dtype == tf.uint8:
+        return tf.cast(tf.round(tf.clip_by_value(rgb, 0., 1.) * 255.), tf.uint8)
+
+    return tf.cast(rgb, dtype)
@@ -0,0 +1,58 @@
+import tensorflow as tf
+import numpy as np
+from utils import color
+
+
+def rgb_grid(step=15):
+    """ uint8 colours on a regular grid of the RGB cube, (N, 3) """
+    levels = np.arange(0, 256, step, dtype=np.uint8)
+    return np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+class ColorTest(tf.test.TestCase):
+    """ utils.color rgb <-> lab """
+
+    def test_lut_path_matches_float_path(self):
+        rgb = rgb_grid()
+        lut_l, lut_ab = color.rgb_to_lab(tf.constant(rgb))
+        float_l, float_ab = color.rgb_to_lab(tf.constant(rgb, tf.float32))
+
+        self.assertAllClose(lut_l, float_l, atol=1e-5)
+        self.assertAllClose(lut_ab, float_ab, atol=1e-5)
+
+    def test_round_trip(self):
+        rgb = rgb_grid()
+        l, ab = color.rgb_to_lab(tf.constant(rgb))
+        restored = color.lab_to_rgb(tf.concat([l, ab], axis=-1), dtype=tf.uint8)
+
+        self.assertLessEqual(int(np.max(np.abs(restored.numpy().astype(np.int32) - rgb.astype(np.int32)))), 1)
+
+    def test_any_rank(self):
+        # A batch of images gives the same values as its flattened pixels
+        rgb = rgb_grid()[:32].reshape(2, 4, 4, 3)
+        l, ab = color.rgb_to_lab(tf.constant(rgb))
+        flat_l, flat_ab = color.rgb_to_lab(tf.constant(rgb.reshape(-1, 3)))
+
+        self.assertEqual(l.shape, (2, 4, 4, 1))
+        self.assertEqual(ab.shape, (2, 4, 4, 2))
+        self.assertAllClose(tf.reshape(l, [-1, 1]), flat_l)
+        self.assertAllClose(tf.reshape(ab, [-1, 2]), flat_ab)
+
+    def test_white_and_black(self):
+        l, ab = color.rgb_to_lab(tf.constant([[255, 255, 255], [0, 0, 0]], tf.uint8))
+
+        # L 100 / 0 normalized to 1 / -1, neutral grey has no chroma
+        self.assertAllClose(l[:, 0], [1., -1.], atol=1e-4)
+        self.assertAllClose(ab, np.zeros((2, 2)), atol=1e-4)
+
+    def test_float16_output(self):
+        l, ab = color.rgb_to_lab(tf.constant(rgb_grid()), dtype=tf.float16)
+        float_l, float_ab = color.rgb_to_lab(tf.constant(rgb_grid()))
+
+        self.assertEqual(l.dtype, tf.float16)
+        self.assertAllClose(tf.cast(l, tf.float32), float_l, atol=1e-3)
+        self.assertAllClose(tf.cast(ab, tf.float32), float_ab, atol=1e-3)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,83 @@
+import tensorflow as tf
+import socket
+import json
+import os
+
+# Keys of a data options dict / profile, None keeps the tf.data default.
+#   threadpool_size: private threadpool of the input pipeline
+#   max_intra_op_parallelism: threads a single tf.data op may use
+#   autotune_ram_gb: RAM budget AUTOTUNE may spend on buffers
+#   deterministic: keep element order of parallel maps
+#   prefetch: prefetch depth in batches (None: AUTOTUNE)
+DATA_OPTION_KEYS = ('threadpool_size', 'max_intra_op_parallelism', 'autotune_ram_gb', 'deterministic', 'prefetch')
+
+
+def build_options(data_options: dict):
+    """
+    tf.data.Options for a data options dict
+
+    Args:
+        data_options (dict): keys of DATA_OPTION_KEYS, missing or None values keep the default
+    """
+    options = tf.data.Options()
+    if data_options.get('threadpool_size') is not None:
+        options.threading.private_threadpool_size = data_options['threadpool_size']
+    if data_options.get('max_intra_op_parallelism') is not None:
+        options.threading.max_intra_op_parallelism = data_options['max_intra_op_parallelism']
+    if data_options.get('autotune_ram_gb') is not None:
+        options.autotune.ram_budget = int(data_options['autotune_ram_gb'] * 1024**3)
+    if data_options.get('deterministic') is not None:
+        options.deterministic = data_options['deterministic']
+    return options
+
+
+def merge_options(profile: dict, overrides: dict):
+    """ Profile values, replaced by every override that is not None """
+    data_options = {key: profile.get(key) for key in DATA_OPTION_KEYS}
+    data_options.update({key: value for key, value in overrides.items() if value is not None})
+    return data_options
+
+
+def save_profile(path: str, data_options: dict, examples_per_sec: float):
+    """ Save the best data options of this host, with what they were measured on """
+    profile = {key: data_options.get(key) for key in DATA_OPTION_KEYS}
+    profile['host'] = socket.gethostname()
+    profile['cpu_count'] = os.cpu_count()
+    profile['examples_per_sec'] = examples_per_sec
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_profile(path: str):
+    with open(path, 'r') as f:
+        profile = json.load(f)
+
+    if profile.get('host') != socket.gethostname() or profile.get('cpu_count') != os.cpu_count():
+        print("데이터 옵션 프로파일이 다른 호스트에서 측정되었습니다: %s (%s cores)" % (
+            profile.get('host'), profile.get('cpu_count')))
+    return {key: profile.get(key) for key in DATA_OPTION_KEYS}
+
+
+def add_data_option_args(parser):
+    """ tf.data option flags shared by train.py and data_options_sweep.py """
+    parser.add_argument("--data_profile",  type=str,  help="data_options_sweep.py 로 저장한 tf.data 옵션 프로파일 (json)", default=None)
+    parser.add_argument("--threadpool_size",  type=int,  help="입력 파이프라인 전용 threadpool 크기", default=None)
+    parser.add_argument("--max_intra_op_parallelism",  type=int,  help="tf.data op 하나가 사용할 최대 thread 수", default=None)
+    parser.add_argument("--autotune_ram_gb",  type=float,  help="AUTOTUNE 버퍼 RAM 예산 (GB)", default=None)
+    parser.add_argument("--deterministic",  type=str,  help="병렬 map 순서 유지", default=None, choices=['true', 'false'])
+    parser.add_argument("--prefetch",  type=int,  help="prefetch 배치 수 (미지정 시 AUTOTUNE)", default=None)
+
+
+def data_options_from_args(args):
+    """ --data_profile values, replaced by the tf.data option flags given on the command line """
+    profile = load_profile(args.data_profile) if args.data_profile else {}
+    return merge_options(profile, {
+        'threadpool_size': args.threadpool_size,
+        'max_intra_op_parallelism': args.max_intra_op_parallelism,
+        'autotune_ram_gb': args.autotune_ram_gb,
+        'deterministic': None if args.deterministic is None else args.deterministic == 'true',
+        'prefetch': args.prefetch,
+    })
@@ -1,48 +1,706 @@
-import tensorflow_io as tfio
 import tensorflow_datasets as tfds
 import tensorflow as tf
+import numpy as np
+import math
+import time
+import os
+import re
+from utils.cache import DatasetCache
+from utils.data_options import build_options
+from utils.archive_reader import ArchiveReader, list_members
+from utils.image_folder_builder import RESOLUTIONS, ImageFolderBuilder, legacy_version_dirs
+from utils.manifest import load_manifest
+from utils.chroma import chroma_path, load_chroma
+from utils.record_index import RecordIndex
+from utils import color
+from utils.color import L_SCALE, AB_SCALE
 
 AUTO = tf.data.experimental.AUTOTUNE
 
+# Distinct in-memory batches of the synthetic source
+SYNTHETIC_BATCHES = 4
+
+# Normalization constant of norm_rgb, part of the cache fingerprint with L_SCALE / AB_SCALE.
+RGB_SCALE = 128.
+
+
+def base_dataset_name(dataset_name: str):
+    """ Dataset name without its resolution configs, e.g. 'CustomCelebahq/768:1.0.0' -> 'CustomCelebahq:1.0.0' """
+    return re.sub(r'/\d+(?=[:+]|$)', '', dataset_name)
+
+
 class Dataset:
-    def __init__(self, data_dir, image_size, batch_size, dataset='CustomCelebahq'):
+    def __init__(self, data_dir, image_size, batch_size, dataset='CustomCelebahq',
+                 cache_dir=None, cache_max_gb=64, augment_mode='example', resolution='auto',
+                 reduced_decode=False, shuffle_mode='global', seed=0, archive_path=None,
+                 source_weights=None, interleave_mode='deterministic', synthetic=False, echo_factor=1,
+                 data_options=None, subset=None, min_chroma=None, low_chroma_keep=0., drop_remainder=False,
+                 dtype='float32'):
         """from i
         Args:
             data_dir: 데이터셋 상대 경로 ( default : './datasets/' )
             image_size: 백본에 따른 이미지 해상도 크기
             batch_size: 배치 사이즈 크기
-            dataset: 데이터셋 종류 (celebA: 'CustomCeleba', celebAHQ: 'CustomCelebahq')
+            dataset: 데이터셋 종류 (celebA: 'CustomCeleba', celebAHQ: 'CustomCelebahq'),
+                     버전 지정 가능 (e.g. 'CustomCelebahq:1.0.0')
+            cache_dir: 전처리 캐시 저장 경로 (None이면 캐시 사용 안함)
+            cache_max_gb: 캐시 최대 크기 (GB)
+            augment_mode: 학습 데이터 증강 방식 ('example': 이미지 단위 map, 'batch': 배치 단위 벡터 연산)
+            resolution: 사전 리사이즈된 BuilderConfig 선택
+                        ('auto': image_size * scale_max 이상인 가장 작은 해상도, None: dataset 이름 그대로 사용)
+            reduced_decode: JPEG DCT 축소 디코딩 사용 (1/2, 1/4, 1/8 중 목표 해상도를 덮는 가장 작은 크기로 디코딩)
+            shuffle_mode: 학습 데이터 셔플 방식
+                          ('global': 에폭마다 전체 example index 순열, 'buffer': shuffle(1024) 버퍼)
+            seed: global 셔플 seed (에폭 순열은 (seed, epoch)로 결정)
+            archive_path: 지정 시 TFDS 대신 압축 해제 없이 data.zip (또는 .tar)에서 직접 이미지를 읽음
+                          (앞 1%: 검증, 나머지: 학습)
+            source_weights: dataset에 콤마로 여러 데이터셋을 지정했을 때 샘플링 가중치 (None: 학습 데이터 개수 비율)
+            interleave_mode: 여러 데이터셋 혼합 방식
+                             ('deterministic': 재현/재개 가능한 순서, 'nondeterministic': 먼저 준비된 example 우선)
+            synthetic: 데이터셋 대신 메모리에 만든 (l_channel, ab_channel, norm_rgb) 배치를 반복 (학습 속도 측정용)
+            echo_factor: data echoing 배수, 디코딩 + 리사이즈된 이미지를 새 crop/flip으로 k번 재사용 (1: 사용 안함)
+            data_options: tf.data 옵션 dict (utils.data_options.DATA_OPTION_KEYS,
+                          threadpool_size, max_intra_op_parallelism, autotune_ram_gb, deterministic, prefetch)
+            subset: 지정 시 학습/검증 데이터 중 이 비율만 고정 선택 (여러 데이터셋은 데이터셋별로 같은 비율),
+                    디코딩 + 리사이즈 결과를 메모리에 캐시해 에폭마다 증강만 다시 적용 (빠른 실험용)
+            min_chroma: 지정 시 평균 채도(LAB |ab|)가 이 값 미만인 흑백/저채도 학습 이미지를 제외
+                        (채도는 처음 한 번 병렬로 계산해 manifest 옆에 저장, 학습 중에는 디코딩 없이 index로 제외)
+            low_chroma_keep: 저채도 이미지 중 남길 비율 (0: 모두 제외, 0 ~ 1: seed로 고정된 일부만 남겨 가중치를 낮춤)
+            drop_remainder: 학습 데이터의 마지막 불완전 배치를 버림 (XLA 등 고정 shape 가 필요한 경우)
+            dtype: (l_channel, ab_channel, norm_rgb) 출력 dtype ('float32', 'float16', 'bfloat16'),
+                   mixed precision 학습 시 입력 파이프라인 메모리/전송량 감소 (LAB 변환 자체는 float32)
         """
         self.data_dir = data_dir
         self.image_size = image_size
         self.batch_size = batch_size
-        self.dataset_name = dataset
+        self.augment_mode = augment_mode
+        self.reduced_decode = reduced_decode
+        self.shuffle_mode = shuffle_mode
+        self.seed = seed
+
+        # Epoch permutation and the position to start it from, see set_epoch
+        self.epoch = 0
+        self.epoch_position = 0
+        self.echo_offset = 0
+
+        # Random scale range of prepare_train_ds
+        self.scale_min = 0.5
+        self.scale_max = 1.5
+
+        self.archive_path = archive_path
+        self.interleave_mode = interleave_mode
+        self.sources = None
+        self.synthetic = synthetic
+        self.echo_factor = echo_factor
+        self.data_options = dict(data_options or {})
+        self.subset = subset
+        self.min_chroma = min_chroma
+        self.low_chroma_keep = low_chroma_keep
+        self.drop_remainder = drop_remainder
+        self.dtype = tf.as_dtype(dtype)
+        # Full-split indices of the train examples kept by the chroma filter (None: all)
+        self.train_selection = None
+        self._synthetic_batches = None
+        # RecordIndex per split, built once and shared by every reader of the split
+        self._record_indices = {}
+
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = DatasetCache(cache_dir=cache_dir, max_bytes=int(cache_max_gb * 1024**3))
+
+        # train -> 30000
+        # train[:1%] -> 300
+        # train[1%:] -> 29700
+        self.train_split = 'train[1%:]'
+        self.valid_split = 'train[:1%]'
+
+        source_names = [name.strip() for name in dataset.split(',')]
+        if self.synthetic:
+            self.dataset_name = 'synthetic'
+            self.dataset_version = 'synthetic'
+            # Same epoch length as CelebA-HQ train[1%:] / train[:1%]
+            self.number_train = 29700
+            self.number_valid = 300
+        elif len(source_names) > 1:
+            self.load_sources(source_names, source_weights, resolution=resolution)
+        elif self.archive_path is not None:
+            self.load_archive_members(dataset)
+        else:
+            self.dataset_name = self.select_resolution_config(dataset, resolution)
+            self.check_legacy_layout(self.dataset_name)
+
+            # Split sizes come from the persisted manifest, tf.data objects are built on first use
+            self.train_manifest = load_manifest(self.data_dir, self.dataset_name, self.train_split)
+            self.valid_manifest = load_manifest(self.data_dir, self.dataset_name, self.valid_split)
+            self.dataset_version = self.train_manifest['version']
+
+            self.number_train = self.train_manifest['num_examples']
+            self.number_valid = self.valid_manifest['num_examples']
+        if self.min_chroma is not None and self.sources is None and not self.synthetic:
+            self.select_chroma()
+        if self.subset is not None and self.sources is None and not self.synthetic:
+            self.select_subset()
+        print("학습 데이터 개수", self.number_train)
+        print("검증 데이터 개수:", self.number_valid)
+
+        self._train_data = None
+        self._valid_data = None
+
+
+    def load_sources(self, source_names, source_weights, resolution):
+        """
+        One single-source Dataset per TFDS dataset, mixed by weight in _load_train_datasets.
+        Each source keeps its own resolution config, images of every source go through the same augmentation.
+        """
+        if self.cache is not None or self.archive_path is not None:
+            raise ValueError("여러 데이터셋 혼합은 cache_dir, archive_path 와 함께 사용할 수 없습니다")
+        if self.shuffle_mode != 'global':
+            # The mix is drawn from index permutations, there is no sequential stream to buffer-shuffle
+            print("여러 데이터셋 혼합은 global 셔플을 사용합니다")
+            self.shuffle_mode = 'global'
+
+        self.sources = [Dataset(data_dir=self.data_dir, image_size=self.image_size, batch_size=self.batch_size,
+                                dataset=name, augment_mode=self.augment_mode, resolution=resolution,
+                                reduced_decode=self.reduced_decode, shuffle_mode=self.shuffle_mode, seed=self.seed,
+                                subset=self.subset, min_chroma=self.min_chroma,
+                                low_chroma_keep=self.low_chroma_keep)
+                        for name in source_names]
+
+        if source_weights is None:
+            source_weights = [source.number_train for source in self.sources]
+        if len(source_weights) != len(self.sources):
+            raise ValueError("source_weights 개수(%d)가 데이터셋 개수(%d)와 다릅니다" % (len(source_weights), len(self.sources)))
+        self.source_weights = np.asarray(source_weights, np.float64) / np.sum(source_weights)
+
+        self.dataset_name = '+'.join(source.dataset_name for source in self.sources)
+        self.dataset_version = '+'.join(source.dataset_version for source in self.sources)
+        # One epoch draws as many examples as all sources hold, smaller sources are cycled when over-weighted
+        self.number_train = sum(source.number_train for source in self.sources)
+        self.number_valid = sum(source.number_valid for source in self.sources)
+        for source, weight in zip(self.sources, self.source_weights):
+            print("데이터셋 %s: 가중치 %.3f, 에폭당 %.2f회 반복" % (
+                source.dataset_name, weight, weight * self.number_train / source.number_train))
+
+
+    def load_archive_members(self, dataset):
+        """ Member lists of the archive source, split like train[:1%] / train[1%:] over the sorted names """
+        members = list_members(self.archive_path, ImageFolderBuilder.IMAGE_DIR, ImageFolderBuilder.IMAGE_PATTERN)
+        number_valid = len(members) // 100
+        self.valid_members = members[:number_valid]
+        self.train_members = members[number_valid:]
+
+        self.dataset_name = dataset.partition(':')[0] + '-archive'
+        # Cache entries follow the archive file
+        stat = os.stat(self.archive_path)
+        self.dataset_version = 'archive-%d-%d' % (stat.st_size, int(stat.st_mtime))
+        self.number_train = len(self.train_members)
+        self.number_valid = len(self.valid_members)
+        print("압축 해제 없이 읽는 데이터셋:", self.archive_path)
+
+
+    def train_chroma(self):
+        """ Stored mean |ab| of every train example, measured once from the encoded images """
+        def encoded_data():
+            indices = tf.data.Dataset.range(self.number_train)
+            if self.archive_path is not None:
+                return ArchiveReader(self.archive_path, self.train_members).as_dataset(indices)
+            decoders = dict(self.decoders() or {})
+            decoders['image'] = tfds.decode.SkipDecoding()
+            return self.record_index(self.train_split).as_dataset(indices, decoders=decoders)
+
+        return load_chroma(chroma_path(self.data_dir, self.dataset_name, self.dataset_version, self.train_split),
+                           encoded_data)
+
+
+    def select_chroma(self):
+        """
+        Drop grayscale / low-chroma train examples by index, before anything is read.
+        low_chroma_keep keeps a seed-fixed share of them, which down-weights instead of removing.
+        """
+        chroma = self.train_chroma()
+        low = np.flatnonzero(chroma < self.min_chroma)
+        rng = np.random.default_rng([self.seed, 2])
+        kept_low = rng.choice(low, size=int(round(len(low) * self.low_chroma_keep)), replace=False)
+        excluded = len(low) - len(kept_low)
+
+        self.train_selection = np.sort(np.concatenate([np.flatnonzero(chroma >= self.min_chroma), kept_low])).astype(np.int64)
+        self.number_train = len(self.train_selection)
+        print("저채도 이미지 (|ab| < %g): %d / %d (%.1f%%), 제외 %d, 유지 %d" % (
+            self.min_chroma, len(low), len(chroma), 100. * len(low) / max(len(chroma), 1), excluded, len(kept_low)))
+
+
+    def select_subset(self):
+        """
+        Fixed subset of both splits, fixed by seed so every run of an experiment sees the same images.
+        Multi-source datasets take it per source, which keeps the source proportions.
+        """
+        if not 0. < self.subset <= 1.:
+            raise ValueError("subset 은 (0, 1] 범위의 비율이어야 합니다 (%s)" % self.subset)
+
+        def choose(number, split_id):
+            count = min(max(int(round(number * self.subset)), self.batch_size), number)
+            rng = np.random.default_rng([self.seed, split_id])
+            # Sorted, the subset is read once in file order
+            return np.sort(rng.choice(number, size=count, replace=False)).astype(np.int64)
+
+        self.train_subset = choose(self.number_train, 0)
+        self.valid_subset = choose(self.number_valid, 1)
+        self.number_train = len(self.train_subset)
+        self.number_valid = len(self.valid_subset)
+        print("메모리 캐시 subset: 학습 %d, 검증 %d" % (self.number_train, self.number_valid))
+
+
+    def check_legacy_layout(self, dataset_name):
+        """
+        Data prepared before the resolution BuilderConfigs sits in <dataset>/<version>, TFDS now reads the
+        'original' config (also the config-less name) from <dataset>/original/<version> and would not find it.
+        """
+        name = dataset_name.partition(':')[0]
+        base_name, _, config = name.partition('/')
+        if config not in ('', 'original'):
+            return
+
+        dataset_dir = os.path.join(self.data_dir, tfds.core.naming.camelcase_to_snakecase(base_name))
+        legacy = legacy_version_dirs(dataset_dir)
+        if legacy and not os.path.isdir(os.path.join(dataset_dir, 'original')):
+            raise ValueError("%s 는 BuilderConfig 이전 경로 (%s) 에 준비되어 있습니다. "
+                             "%s 를 %s 로 옮기거나 tfds build --config original 로 다시 빌드하세요" % (
+                                 base_name, ', '.join(os.path.join(dataset_dir, v) for v in legacy),
+                                 os.path.join(dataset_dir, '<version>'), os.path.join(dataset_dir, 'original', '<version>')))
+
+
+    def select_resolution_config(self, dataset, resolution):
+        """
+        Pick the smallest prepared resolution config that still covers the largest random scale.
+
+        Returns:
+            TFDS dataset name, e.g. 'CustomCelebahq' -> 'CustomCelebahq/768' for image_size 512
+        """
+        name, _, version = dataset.partition(':')
+        if resolution is None or '/' in name:
+            return dataset
+
+        if resolution == 'auto':
+            required = math.ceil(max(self.image_size) * self.scale_max)
+            candidates = [res for res in RESOLUTIONS if res >= required]
+        else:
+            candidates = [int(resolution)]
+
+        dataset_dir = os.path.join(self.data_dir, tfds.core.naming.camelcase_to_snakecase(name))
+        for res in candidates:
+            if os.path.isdir(os.path.join(dataset_dir, str(res))):
+                config_name = '%s/%d' % (name, res)
+                print("데이터셋 해상도 config:", config_name)
+                return config_name + (':' + version if version else '')
+
+        if resolution != 'auto':
+            raise ValueError("%s/%s 가 준비되지 않았습니다 (tfds build --config %s)" % (name, resolution, resolution))
+
+        return dataset
+
+
+    @property
+    def train_data(self):
+        if self._train_data is None:
+            self._train_data = self._load_train_datasets()
+        return self._train_data
+
+
+    @property
+    def valid_data(self):
+        if self._valid_data is None:
+            self._valid_data = self._load_valid_datasets()
+        return self._valid_data
+
+
+    def global_shuffle(self):
+        """ Cached base images are read back sequentially from the snapshot and keep the shuffle buffer """
+        return self.shuffle_mode == 'global' and self.cache is None and self.subset is None
+
+
+    def shuffle_buffer(self):
+        """ The in-memory subset is shuffled as a whole, which is a full permutation per epoch """
+        if self.subset is not None:
+            return self.number_train
+        return 1024
+
+
+    def set_epoch(self, epoch, position=0, echo_offset=0):
+        """
+        Select the permutation read by the next iterator over train_data.
+
+        Args:
+            epoch (int): epoch number, the permutation is fixed by (seed, epoch)
+            position (int): number of examples of this epoch already consumed
+            echo_offset (int): echoed examples already consumed from the echo group starting at position
+        """
+        self.epoch = epoch
+        self.epoch_position = position
+        self.echo_offset = echo_offset
+
+
+    def get_state(self, consumed=0):
+        """
+        Input pipeline state to save with a checkpoint.
+        Order and augmentation are pure functions of (seed, epoch, position),
+        so this is all a restart needs to continue at the next unseen example.
+
+        Args:
+            consumed (int): examples trained on since the last set_epoch
+        """
+        echo_offset = 0
+        if self.echo_factor > 1:
+            # Echoed copies of a source example count once. An echo group of batch_size * echo_factor examples
+            # is shuffled as a whole, so the position stops at the last started group and the copies
+            # already trained on are skipped
+            group_size = self.batch_size * self.echo_factor
+            consumed += self.echo_offset
+            echo_offset = consumed % (group_size * self.echo_factor)
+            consumed = consumed // (group_size * self.echo_factor) * group_size
+        return {
+            'dataset': self.dataset_name,
+            'number_train': self.number_train,
+            'shuffle_mode': self.shuffle_mode,
+            'seed': self.seed,
+            'epoch': self.epoch,
+            'position': self.epoch_position + consumed,
+            'echo_offset': echo_offset,
+        }
+
+
+    def get_epoch_end_state(self):
+        """ get_state of a checkpoint taken after the last step of the epoch, the next epoch starts from its first group """
+        return dict(self.get_state(), epoch=self.epoch + 1, position=0, echo_offset=0)
+
+
+    def set_state(self, state):
+        """ Restore a get_state dict, a finished epoch moves on to the next one """
+        current = self.get_state()
+        # Resolution configs of a dataset hold the same examples in the same order,
+        # a progressive-resolution run reads a different one per image size
+        state = dict(state, dataset=base_dataset_name(state['dataset']))
+        current['dataset'] = base_dataset_name(current['dataset'])
+        for key in ('dataset', 'number_train', 'shuffle_mode'):
+            if state[key] != current[key]:
+                raise ValueError("저장된 입력 파이프라인 상태와 %s 가 다릅니다 (%s != %s)" % (key, state[key], current[key]))
+
+        self.seed = state['seed']
+        if state['position'] >= self.number_train:
+            self.set_epoch(state['epoch'] + 1)
+        else:
+            self.set_epoch(state['epoch'], state['position'], state.get('echo_offset', 0))
+
+
+    def epoch_order(self, epoch):
+        """ Permutation of the train example indices for `epoch` """
+        rng = np.random.default_rng([self.seed, epoch])
+        return rng.permutation(self.number_train).astype(np.int64)
+
+
+    def _remaining_indices(self):
+        return self.epoch_order(self.epoch)[self.epoch_position:]
+
+
+    def source_choices(self):
+        """ Source id of every example of the current epoch, fixed by (seed, epoch) """
+        rng = np.random.default_rng([self.seed, self.epoch, len(self.sources)])
+        return rng.choice(len(self.sources), size=self.number_train, p=self.source_weights).astype(np.int64)
+
+
+    def _remaining_choices(self):
+        return self.source_choices()[self.epoch_position:]
+
+
+    def _remaining_source_indices(self, source_id):
+        """ Example indices the current epoch still reads from one source, cycling its permutations """
+        choices = self.source_choices()
+        offset = np.count_nonzero(choices[:self.epoch_position] == source_id)
+        count = np.count_nonzero(choices == source_id)
+
+        number_train = self.sources[source_id].number_train
+        cycles = max(-(-count // number_train), 1)
+        orders = [np.random.default_rng([self.seed, self.epoch, source_id, cycle]).permutation(number_train)
+                  for cycle in range(cycles)]
+
+        return np.concatenate(orders)[offset:count].astype(np.int64)
+
+
+    def source_counts(self, consumed):
+        """ Examples taken from each source in the last `consumed` examples since set_epoch """
+        consumed = consumed // self.echo_factor
+        if self.sources is None:
+            return {self.dataset_name: consumed}
+        if self.subset is not None:
+            # The subset mixes the sources by their share of the shuffled cache
+            shares = np.asarray([source.number_train for source in self.sources]) / self.number_train
+            return {source.dataset_name: int(round(consumed * share)) for source, share in zip(self.sources, shares)}
+
+        choices = self.source_choices()[self.epoch_position:self.epoch_position + consumed]
+        counts = np.bincount(choices, minlength=len(self.sources))
+        return {source.dataset_name: int(count) for source, count in zip(self.sources, counts)}
+
+
+    def _epoch_state(self):
+        """ (buffer shuffle seed, global example counter of the first example) of the next iterator """
+        shuffle_seed = np.random.default_rng([self.seed, self.epoch]).integers(2**31)
+        start = self.epoch * self.number_train + self.epoch_position
+        return np.int64(shuffle_seed), np.int64(start)
+
+
+    def _epoch_stream(self, train_data):
+        shuffle_seed, start = tf.numpy_function(self._epoch_state, [], [tf.int64, tf.int64], stateful=True)
+        if not self.global_shuffle():
+            # Seeded buffer, the same (seed, epoch) gives the same order so consumed examples can be skipped
+            train_data = train_data.shuffle(self.shuffle_buffer(), seed=shuffle_seed)
+            train_data = train_data.skip(tf.math.floormod(start, self.number_train))
+        # Example counter over the whole run, seeds the augmentation of each example
+        return train_data.enumerate(start=start)
+
+
+    def augment_seed(self, counter):
+        """ Stateless RNG seed of one example (or batch), from the run seed and its example counter """
+        return tf.stack([tf.constant(self.seed, tf.int64), tf.cast(counter, tf.int64)])
+
+
+    def steps_per_epoch(self):
+        """ Steps left in the epoch selected by set_epoch """
+        return ((self.number_train - self.epoch_position) * self.echo_factor - self.echo_offset) // self.batch_size
+
+
+    def valid_steps(self):
+        return self.number_valid // self.batch_size
+
+
+    def decoders(self):
+        """ 1.0.0 datasets store every image twice, only `image` is decoded """
+        decoders = {}
+        if 'label' in self.train_manifest['features']:
+            decoders['label'] = tfds.decode.SkipDecoding()
+        if self.reduced_decode:
+            # Decoded by decode_reduced from the encoded bytes
+            decoders['image'] = tfds.decode.SkipDecoding()
+        return decoders or None
+
+
+    def decode_reduced(self, encoded, target_size):
+        """
+        Decode a JPEG with the decoder's DCT-domain downscaling (1/2, 1/4, 1/8),
+        using the largest ratio whose output still covers target_size.
+        Non-JPEG images are decoded at full resolution.
+
+        Args:
+            encoded (Tensor, string): encoded image
+            target_size (tuple): (H, W) the decoded image has to cover
+
+        Returns:
+            img (Tensor, uint8): (H', W', 3)
+        """
+        def decode_jpeg():
+            shape = tf.image.extract_jpeg_shape(encoded)
+            # ratios are monotonic, count how many of 2, 4, 8 still cover the target
+            fits = [tf.logical_and(shape[0] >= target_size[0] * ratio, shape[1] >= target_size[1] * ratio)
+                    for ratio in (2, 4, 8)]
+            ratio_index = tf.reduce_sum(tf.cast(tf.stack(fits), tf.int32))
+
+            return tf.switch_case(ratio_index, [
+                lambda ratio=ratio: tf.io.decode_jpeg(encoded, channels=3, ratio=ratio)
+                for ratio in (1, 2, 4, 8)])
+
+        def decode_other():
+            return tf.io.decode_image(encoded, channels=3, expand_animations=False)
+
+        img = tf.cond(tf.io.is_jpeg(encoded), decode_jpeg, decode_other)
+        img.set_shape([None, None, 3])
+        return img
+
+
+    def decode_image(self, encoded, target_size):
+        if self.reduced_decode:
+            return self.decode_reduced(encoded, target_size)
+        img = tf.io.decode_image(encoded, channels=3, expand_animations=False)
+        img.set_shape([None, None, 3])
+        return img
+
+
+    def decode_train_sample(self, sample):
+        sample = dict(sample)
+        sample['image'] = self.decode_image(sample['image'], self.base_train_size())
+        return sample
 
-        self.train_data, self.number_train = self._load_train_datasets()
-        self.valid_data, self.number_valid = self._load_valid_datasets()
+
+    def decode_valid_sample(self, sample):
+        sample = dict(sample)
+        sample['image'] = self.decode_image(sample['image'], self.image_size)
+        return sample
+
+
+    def train_indices(self):
+        """ Train example indices of the epoch chosen by set_epoch """
+        if not self.global_shuffle():
+            return tf.data.Dataset.range(self.number_train)
+
+        # Evaluated on every new iterator, so each epoch reads the order chosen by set_epoch
+        return tf.data.Dataset.range(1).flat_map(
+            lambda _: tf.data.Dataset.from_tensor_slices(
+                tf.numpy_function(self._remaining_indices, [], tf.int64, stateful=True)))
+
+
+    def record_index(self, split):
+        """ Shared RecordIndex of `split`, its shard descriptors are closed with close() """
+        if split not in self._record_indices:
+            self._record_indices[split] = RecordIndex(tfds.builder(self.dataset_name, data_dir=self.data_dir), split)
+        return self._record_indices[split]
+
+
+    def close(self):
+        """ Close the shard descriptors of the record indices, of every source too """
+        for source in self.sources or []:
+            source.close()
+        for record_index in self._record_indices.values():
+            record_index.close()
+
+
+    def read_train(self, indices, deterministic=None):
+        """
+        Decoded train examples of a single source in the order of `indices`.
+        With deterministic=False the parallel reads return whichever example is ready first.
+        """
+        if self.train_selection is not None:
+            # Positions among the examples kept by select_chroma -> indices of the split
+            selection = tf.constant(self.train_selection)
+            indices = indices.map(lambda index: tf.gather(selection, index))
+
+        if self.archive_path is not None:
+            train_data = ArchiveReader(self.archive_path, self.train_members).as_dataset(indices)
+            return train_data.map(self.decode_train_sample, num_parallel_calls=AUTO)
+
+        train_data = self.record_index(self.train_split).as_dataset(indices, decoders=self.decoders(), deterministic=deterministic)
+        if self.reduced_decode:
+            train_data = train_data.map(self.decode_train_sample, num_parallel_calls=AUTO, deterministic=deterministic)
+        return train_data
+
+
+    def read_valid(self, indices):
+        """ Decoded valid examples of a single source in the order of `indices` """
+        if self.archive_path is not None:
+            valid_data = ArchiveReader(self.archive_path, self.valid_members).as_dataset(indices)
+            return valid_data.map(self.decode_valid_sample, num_parallel_calls=AUTO)
+
+        valid_data = self.record_index(self.valid_split).as_dataset(indices, decoders=self.decoders())
+        if self.reduced_decode:
+            valid_data = valid_data.map(self.decode_valid_sample, num_parallel_calls=AUTO)
+        return valid_data
+
+
+    def _load_subset(self, split):
+        """ Subset examples of every source in file order, read once and then served from memory """
+        if self.sources is not None:
+            datasets = [source._load_subset(split).map(lambda sample: {'image': sample['image']})
+                        for source in self.sources]
+            for other in datasets[1:]:
+                datasets[0] = datasets[0].concatenate(other)
+            return datasets[0]
+
+        if split == 'train':
+            return self.read_train(tf.data.Dataset.from_tensor_slices(self.train_subset))
+        return self.read_valid(tf.data.Dataset.from_tensor_slices(self.valid_subset))
+
+
+    def _load_mixed_train_datasets(self):
+        """
+        Weighted mix of the sources. Every source is read by its own parallel random-access reader,
+        the per-example source id sequence (source_choices) decides the mix.
+        """
+        # Parallel reads of a source return whichever example is ready first, the per-source counts stay exact.
+        # Set on the reads themselves, options of this dataset would not reach the pipeline get_trainData builds around it
+        deterministic = False if self.interleave_mode == 'nondeterministic' else None
+        streams = []
+        for source_id, source in enumerate(self.sources):
+            indices = tf.data.Dataset.range(1).flat_map(
+                lambda _, source_id=source_id: tf.data.Dataset.from_tensor_slices(
+                    tf.numpy_function(lambda: self._remaining_source_indices(source_id), [], tf.int64, stateful=True)))
+            # Same structure for every source, 1.0.0 sources may carry an undecoded `label`
+            streams.append(source.read_train(indices, deterministic=deterministic).map(
+                lambda sample, source_id=source_id: {'image': sample['image'],
+                                                     'source': tf.constant(source_id, tf.int64)},
+                num_parallel_calls=AUTO, deterministic=deterministic))
+
+        choices = tf.data.Dataset.range(1).flat_map(
+            lambda _: tf.data.Dataset.from_tensor_slices(
+                tf.numpy_function(self._remaining_choices, [], tf.int64, stateful=True)))
+        return tf.data.Dataset.choose_from_datasets(streams, choices)
+
+
+    def synthetic_batches(self):
+        """
+        SYNTHETIC_BATCHES fixed batches of smooth random colour fields, converted once to
+        (l_channel, ab_channel, norm_rgb) so they have the real value ranges and cost nothing to read.
+        """
+        if self._synthetic_batches is None:
+            rng = tf.random.Generator.from_seed(self.seed)
+            low_res = rng.uniform((SYNTHETIC_BATCHES * self.batch_size, 8, 8, 3), 0., 255.)
+            img = self.quantize(tf.image.resize(low_res, self.image_size, method=tf.image.ResizeMethod.BICUBIC))
+            self._synthetic_batches = tuple(
+                tf.reshape(tensor, (SYNTHETIC_BATCHES, self.batch_size) + tuple(tensor.shape[1:]))
+                for tensor in self.lab_triple(img))
+
+        return tf.data.Dataset.from_tensor_slices(self._synthetic_batches)
+
+
+    def cast_synthetic(self, batches):
+        """ Synthetic batches are built once, a later dtype change is applied per batch """
+        if batches.element_spec[0].dtype == self.dtype:
+            return batches
+        return batches.map(lambda *batch: tuple(tf.cast(tensor, self.dtype) for tensor in batch))
 
 
     def _load_valid_datasets(self):
-        valid_data = tfds.load(self.dataset_name,
-                               data_dir=self.data_dir, split='train[:1%]')
+        if self.synthetic:
+            return self.synthetic_batches()
 
-        number_valid = valid_data.reduce(0, lambda x, _: x + 1).numpy()
-        print("검증 데이터 개수:", number_valid)
+        if self.subset is not None:
+            return self._load_subset('valid')
 
-        return valid_data, number_valid
+        if self.sources is not None:
+            valid_data = [source.valid_data.map(lambda sample: {'image': sample['image']}) for source in self.sources]
+            for other in valid_data[1:]:
+                valid_data[0] = valid_data[0].concatenate(other)
+            return valid_data[0]
+
+        if self.archive_path is not None:
+            valid_data = ArchiveReader(self.archive_path, self.valid_members).as_dataset(
+                tf.data.Dataset.range(self.number_valid))
+            return valid_data.map(self.decode_valid_sample, num_parallel_calls=AUTO)
+
+        valid_data = tfds.load(self.dataset_name,
+                               data_dir=self.data_dir, split=self.valid_split,
+                               decoders=self.decoders())
+        if self.reduced_decode:
+            valid_data = valid_data.map(self.decode_valid_sample, num_parallel_calls=AUTO)
+
+        return valid_data
 
 
     def _load_train_datasets(self):
-        # train -> 30000
-        # train[:1%] -> 300
-        # train[1%:] -> 29700
-        train_data = tfds.load(self.dataset_name,
-                               data_dir=self.data_dir, split='train[1%:]')
+        if self.synthetic:
+            return self.synthetic_batches()
+
+        if self.subset is not None:
+            return self._load_subset('train')
+
+        if self.sources is not None:
+            return self._load_mixed_train_datasets()
+
+        if self.archive_path is not None or self.global_shuffle() or self.train_selection is not None:
+            return self.read_train(self.train_indices())
 
-        number_train = train_data.reduce(0, lambda x, _: x + 1).numpy()
-        print("학습 데이터 개수", number_train)
+        train_data = tfds.load(self.dataset_name,
+                               data_dir=self.data_dir, split=self.train_split,
+                               decoders=self.decoders())
+        if self.reduced_decode:
+            train_data = train_data.map(self.decode_train_sample, num_parallel_calls=AUTO)
 
-        return train_data, number_train
+        return train_data
 
 
     @tf.function
@@ -56,48 +714,145 @@ class Dataset:
         return x
 
 
+    def random_crop_boxes(self, batch_size, seed):
+        """
+        Source crop windows for flip + random scale + center crop/pad.
+        Scaling by `scale` then center crop/pad to image_size == sampling a centered window of 1/scale,
+        so only that window is resampled straight to image_size. Windows larger than the source
+        (scale < 1) are zero padded through crop_and_resize extrapolation.
+
+        Args:
+            batch_size: number of windows
+            seed (Tensor, int64): (2,) stateless RNG seed, see augment_seed
+
+        Returns:
+            boxes (Tensor, float32): (batch_size, 4) normalized [y1, x1, y2, x2]
+        """
+        scale_seed, flip_seed = tf.unstack(tf.random.experimental.stateless_split(seed, num=2))
+        scale = tf.random.stateless_uniform([batch_size], scale_seed, self.scale_min, self.scale_max)
+        half = 0.5 / scale
+        y1, y2 = 0.5 - half, 0.5 + half
+        x1, x2 = 0.5 - half, 0.5 + half
+
+        # Swapped x coordinates sample a left-right flipped window
+        flip = tf.random.stateless_uniform([batch_size], flip_seed, minval=0, maxval=1) > 0.5
+        x1, x2 = tf.where(flip, x2, x1), tf.where(flip, x1, x2)
+
+        return tf.stack([y1, x1, y2, x2], axis=-1)
+
+
     @tf.function
-    def prepare_train_ds(self, sample):
+    def augment_train_ds(self, counter, sample):
+        """ Augmentation stage of prepare_train_ds, returns the uint8 crop """
         img = sample['image']
-        # data augmentation
-        
-        if tf.random.uniform([], minval=0, maxval=1) > 0.5:
-            img = tf.image.flip_left_right(img)
-            
-        
-        scale = tf.random.uniform([], 0.5, 1.5)
-        
-        nh = self.image_size[0] * scale
-        nw = self.image_size[1] * scale
-
-        img = tf.image.resize(img, (nh, nw), method=tf.image.ResizeMethod.BILINEAR)
-        img = tf.image.resize_with_crop_or_pad(img, self.image_size[0], self.image_size[1])
-        
-        l_channel, ab_channel = self.rgb_to_lab(rgb=img)
-        
-        norm_rgb = (img / 128) - 1
-        
+        # data augmentation (flip, scale, crop) without materializing the scaled image
+        boxes = self.random_crop_boxes(1, self.augment_seed(counter))
+        img = tf.image.crop_and_resize(tf.expand_dims(img, axis=0), boxes,
+                                       box_indices=[0],
+                                       crop_size=self.image_size,
+                                       method='bilinear', extrapolation_value=0.)
+        return self.quantize(img[0])
+
+
+    @tf.function
+    def lab_triple(self, img):
+        """ LAB conversion stage, uint8 rgb -> (l_channel, ab_channel, norm_rgb) """
+        l_channel, ab_channel = self.rgb_to_lab(rgb=img, dtype=self.dtype)
+
+        norm_rgb = tf.cast((tf.cast(img, tf.float32) / RGB_SCALE) - 1, self.dtype)
+
         return (l_channel, ab_channel, norm_rgb)
 
+
+    @tf.function
+    def prepare_train_ds(self, counter, sample):
+        return self.lab_triple(self.augment_train_ds(counter, sample))
+
     
     @tf.function
     def prepare_valid_ds(self, sample):
         img = sample['image']
 
         img = tf.image.resize(img, (self.image_size[0], self.image_size[1]), method=tf.image.ResizeMethod.BILINEAR)
-        l_channel, ab_channel = self.rgb_to_lab(rgb=img)
-        norm_rgb = (img / 128) - 1
+        img = self.quantize(img)
+
+        return self.lab_triple(img)
+
+
+    @tf.function
+    def prepare_train_batch(self, counter, sample):
+        """
+        Vectorized version of prepare_train_ds over a whole batch of base-resized images,
+        one crop window per example, seeded by the counter of the first example.
+        """
+        img = sample['image']
+        batch_size = tf.shape(img)[0]
+
+        boxes = self.random_crop_boxes(batch_size, self.augment_seed(counter[0]))
+        img = tf.image.crop_and_resize(img, boxes,
+                                       box_indices=tf.range(batch_size),
+                                       crop_size=self.image_size,
+                                       method='bilinear', extrapolation_value=0.)
+        img = self.quantize(img)
+
+        return self.lab_triple(img)
+
+
+    def base_train_size(self):
+        """ Smallest resolution that still covers the largest random scale of prepare_train_ds """
+        return (int(self.image_size[0] * self.scale_max), int(self.image_size[1] * self.scale_max))
+
+
+    @tf.function
+    def prepare_train_base(self, sample):
+        """ Deterministic part of the train pipeline (decode + base resize), stored as uint8 """
+        img = tf.image.resize(sample['image'], self.base_train_size(), method=tf.image.ResizeMethod.BILINEAR)
+        return {'image': self.quantize(img)}
+
+
+    @tf.function
+    def encode_valid_cache(self, l_channel, ab_channel, norm_rgb):
+        return (tf.cast(l_channel, tf.float16), tf.cast(ab_channel, tf.float16), tf.cast(norm_rgb, tf.float16))
+
+
+    @tf.function
+    def decode_valid_cache(self, l_channel, ab_channel, norm_rgb):
+        return (tf.cast(l_channel, self.dtype), tf.cast(ab_channel, self.dtype), tf.cast(norm_rgb, self.dtype))
+
+
+    def cache_fingerprint(self, split, stage):
+        chroma = {}
+        if split == self.train_split and self.min_chroma is not None:
+            # Only the train split is filtered, existing entries stay valid without a filter
+            chroma = {'min_chroma': self.min_chroma, 'low_chroma_keep': self.low_chroma_keep, 'seed': self.seed}
+        return DatasetCache.fingerprint(
+            dataset=self.dataset_name,
+            version=self.dataset_version,
+            split=split,
+            stage=stage,
+            image_size=list(self.image_size),
+            scale_max=self.scale_max,
+            quantized_rgb=True,
+            reduced_decode=self.reduced_decode,
+            l_scale=L_SCALE,
+            ab_scale=AB_SCALE,
+            rgb_scale=RGB_SCALE,
+            **chroma)
 
-        return (l_channel, ab_channel, norm_rgb)
 
 
+    def quantize(self, img):
+        """ Round resampled float rgb back to uint8 so rgb_to_lab takes the lookup table path """
+        return tf.cast(tf.round(tf.clip_by_value(img, 0., 255.)), tf.uint8)
 
-    def rgb_to_lab(self, rgb):
+
+    def rgb_to_lab(self, rgb, dtype=tf.float32):
         """
         Convert to rgb image to lab image
 
         Args:
-            rgb (Tensor): (H, W, 3)
+            rgb (Tensor): (..., H, W, 3), uint8 or float 0 ~ 255
+            dtype: output dtype, computed in float32
 
         Returns:
             Normalized lab image
@@ -106,71 +861,26 @@ class Dataset:
                 L : -1 ~ 1
                 ab : -1 ~ 1
             }
-            L, ab (Tensor): (H, W, 1), (H, W, 2)
-        """
-        # normalize image 0 ~ 1.
-        rgb /= 255. 
-        
-        # Convert to float32 data type.
-        rgb = tf.cast(rgb, tf.float32)
-        
-        # Convert to rgb to lab
-        lab = tfio.experimental.color.rgb_to_lab(rgb)
-
-        l_channel = lab[:, :, 0]
-        a_channel = lab[:, :, 1]
-        b_channel = lab[:, :, 2]
-        
-        l_channel = tf.expand_dims(l_channel, axis=-1)
-        a_channel = tf.expand_dims(a_channel, axis=-1)
-        b_channel = tf.expand_dims(b_channel, axis=-1)
-
-        ab_channel = tf.concat([a_channel, b_channel], axis=-1)
-        
-        # -1 ~ 1 scaling
-        l_channel = (l_channel - 50.) / 50. 
-        ab_channel /= 128.       
-        
-        return l_channel, ab_channel
-
-
-    def lab_to_rgb(self, lab, dim=3):
+            L, ab (Tensor, dtype): (..., H, W, 1), (..., H, W, 2)
+        """
+        return color.rgb_to_lab(rgb, dtype=dtype)
+
+
+    def lab_to_rgb(self, lab):
         """
         Convert to lab image to rgb image
 
         Args:
-            lab (Tensor, float32): (H, W, 3)
+            lab (Tensor, float32): (..., H, W, 3)
 
         Returns:
             {
                 Normalized lab image
                 Value Range : 0 ~ 1
             }
-            RGB (Tensor, float32) :(H, W, 3)
-        """      
-        if dim == 4:
-            batch_l = lab[:, :, :, 0]
-            batch_a = lab[:, :, :, 1]
-            batch_b = lab[:, :, :, 2]
-        else:
-            batch_l = lab[:, :, 0]
-            batch_a = lab[:, :, 1]
-            batch_b = lab[:, :, 2]
-
-        
-        batch_l = (batch_l * 50) + 50.
-        batch_a *= 128.
-        batch_b *= 128.
-        
-        batch_l = tf.expand_dims(batch_l, axis=-1)
-        batch_a = tf.expand_dims(batch_a, axis=-1)
-        batch_b = tf.expand_dims(batch_b, axis=-1)
-        
-        batch_lab = tf.concat([batch_l, batch_a, batch_b], axis=-1)
-
-        rgb = tfio.experimental.color.lab_to_rgb(batch_lab)
-        
-        return rgb
+            RGB (Tensor, float32) :(..., H, W, 3)
+        """
+        return color.lab_to_rgb(lab)
 
 
     def generate_patch_labels(self, batch_size: int, disc_patch, random_augment: bool):
@@ -185,16 +895,113 @@ class Dataset:
         return fake_y_dis, real_y_dis
 
 
+    def prefetch_depth(self):
+        prefetch = self.data_options.get('prefetch')
+        return AUTO if prefetch is None else prefetch
+
+
+    def echo(self, train_data):
+        """
+        Data echoing after the expensive decode + base resize: every base image is emitted echo_factor times
+        and gets its own crop/flip downstream. Each echo group of batch_size * echo_factor images is repeated
+        at example level and its copies are shuffled together, so copies of one image are spread over the
+        echo_factor * echo_factor batches of the group instead of following each other.
+        The shuffle is fixed by the group, which keeps the order deterministic and resumable.
+
+        Args:
+            train_data (tf.data.Dataset): (counter, {'image': base-resized uint8}) from _epoch_stream
+        """
+        echo_factor = self.echo_factor
+
+        def echo_group(counters, samples):
+            # Distinct augmentation seed for every copy
+            copies = tf.range(echo_factor, dtype=tf.int64)
+            echo_counters = tf.reshape(counters[:, tf.newaxis] * echo_factor + copies, [-1])
+            # Negative counter, the group seed never equals the augmentation seed of an example
+            keys = tf.random.stateless_uniform(tf.shape(echo_counters), self.augment_seed(-1 - counters[0]))
+            order = tf.argsort(keys)
+            samples = tf.nest.map_structure(
+                lambda value: tf.gather(tf.repeat(value, echo_factor, axis=0), order), samples)
+            return tf.data.Dataset.from_tensor_slices((tf.gather(echo_counters, order), samples))
+
+        # Copies of the first group a resumed run already trained on, see get_state
+        echo_offset = tf.numpy_function(lambda: np.int64(self.echo_offset), [], tf.int64, stateful=True)
+        return train_data.batch(self.batch_size * echo_factor).flat_map(echo_group).skip(echo_offset)
+
+
+    def measure_input_rate(self, num_batches=20, warmup_batches=5):
+        """ examples/sec of get_trainData without echoing """
+        echo_factor, self.echo_factor = self.echo_factor, 1
+        iterator = iter(self.get_trainData(self.train_data).repeat())
+        self.echo_factor = echo_factor
+
+        for _ in range(warmup_batches):
+            next(iterator)
+        start = time.perf_counter()
+        for _ in range(num_batches):
+            next(iterator)
+        return num_batches * self.batch_size / (time.perf_counter() - start)
+
+
+    def choose_echo_factor(self, model_examples_per_sec, max_factor=4):
+        """
+        Smallest echo factor whose echoed input rate keeps up with the model, at most max_factor.
+
+        Args:
+            model_examples_per_sec (float): measured train step rate * batch_size
+        """
+        input_examples_per_sec = self.measure_input_rate()
+        self.echo_factor = int(min(max(math.ceil(model_examples_per_sec / input_examples_per_sec), 1), max_factor))
+        print("입력 %.1f examples/sec, 모델 %.1f examples/sec -> echo_factor %d" % (
+            input_examples_per_sec, model_examples_per_sec, self.echo_factor))
+        return self.echo_factor
+
+
     def get_trainData(self, train_data):
-        train_data = train_data.shuffle(1024)
-        train_data = train_data.map(self.prepare_train_ds, num_parallel_calls=AUTO)
-        # train_data = train_data.padded_batch(self.batch_size)
-        train_data = train_data.batch(self.batch_size)
-        train_data = train_data.prefetch(AUTO)
+        if self.synthetic:
+            return self.cast_synthetic(train_data).repeat().take(self.steps_per_epoch())
+
+        if self.subset is not None:
+            # Decoded and resized once, later epochs only redo the random augmentation
+            train_data = train_data.map(self.prepare_train_base, num_parallel_calls=AUTO).cache()
+        elif self.cache is not None:
+            train_data = train_data.map(self.prepare_train_base, num_parallel_calls=AUTO)
+            train_data = self.cache.cached(train_data,
+                                           name=self.dataset_name + '-train',
+                                           fingerprint=self.cache_fingerprint(self.train_split, 'base_resize'))
+        elif self.augment_mode == 'batch' or self.echo_factor > 1:
+            # Batching / echo groups need a common image size
+            train_data = train_data.map(self.prepare_train_base, num_parallel_calls=AUTO)
+
+        # Every new iterator starts from the state chosen by set_epoch / set_state
+        source = train_data
+        if self.echo_factor > 1:
+            train_data = tf.data.Dataset.range(1).flat_map(lambda _: self.echo(self._epoch_stream(source)))
+        else:
+            train_data = tf.data.Dataset.range(1).flat_map(lambda _: self._epoch_stream(source))
+        if self.augment_mode == 'batch':
+            train_data = train_data.batch(self.batch_size, drop_remainder=self.drop_remainder)
+            train_data = train_data.map(self.prepare_train_batch, num_parallel_calls=AUTO)
+        else:
+            train_data = train_data.map(self.prepare_train_ds, num_parallel_calls=AUTO)
+            # train_data = train_data.padded_batch(self.batch_size)
+            train_data = train_data.batch(self.batch_size, drop_remainder=self.drop_remainder)
+        train_data = train_data.prefetch(self.prefetch_depth())
 
-        return train_data
+        return train_data.with_options(build_options(self.data_options))
 
     def get_validData(self, valid_data):
+        if self.synthetic:
+            return self.cast_synthetic(valid_data).repeat().take(self.valid_steps())
+
         valid_data = valid_data.map(self.prepare_valid_ds, num_parallel_calls=AUTO)
-        valid_data = valid_data.batch(self.batch_size).prefetch(AUTO)
-        return valid_data
\ No newline at end of file
+        if self.subset is not None:
+            valid_data = valid_data.cache()
+        elif self.cache is not None:
+            valid_data = valid_data.map(self.encode_valid_cache, num_parallel_calls=AUTO)
+            valid_data = self.cache.cached(valid_data,
+                                           name=self.dataset_name + '-valid',
+                                           fingerprint=self.cache_fingerprint(self.valid_split, 'lab_triple'))
+            valid_data = valid_data.map(self.decode_valid_cache, num_parallel_calls=AUTO)
+        valid_data = valid_data.batch(self.batch_size).prefetch(self.prefetch_depth())
+        return valid_data.with_options(build_options(self.data_options))
\ No newline at end of file
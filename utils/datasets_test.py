@@ -0,0 +1,194 @@
+import tensorflow as tf
+import numpy as np
+import collections
+from unittest import mock
+from utils.datasets import Dataset
+
+
+def echo_dataset(number_train=10, batch_size=2, echo_factor=2):
+    """ Synthetic Dataset with a short epoch, its train examples are read as their example index """
+    dataset = Dataset(data_dir='.', image_size=(8, 8), batch_size=batch_size, synthetic=True, echo_factor=echo_factor)
+    dataset.number_train = number_train
+    return dataset
+
+
+def echoed_stream(dataset):
+    """ (counter, example index) of every echoed example the next iterator over the epoch yields """
+    source = tf.data.Dataset.from_tensor_slices({'image': dataset._remaining_indices()})
+    echoed = dataset.echo(dataset._epoch_stream(source))
+    return [(int(counter), int(sample['image'])) for counter, sample in echoed.as_numpy_iterator()]
+
+
+class EchoTest(tf.test.TestCase):
+    """ Dataset.echo order and the echo_offset of get_state / set_state """
+
+    def test_copies_are_spread_over_the_group(self):
+        dataset = echo_dataset()
+        stream = echoed_stream(dataset)
+
+        self.assertLen(stream, dataset.number_train * dataset.echo_factor)
+        self.assertEqual(set(collections.Counter(index for _, index in stream).values()), {dataset.echo_factor})
+        # Every copy gets its own augmentation seed
+        self.assertLen(set(counter for counter, _ in stream), len(stream))
+        # The first echo group mixes the copies of the first batch_size * echo_factor images
+        group_size = dataset.batch_size * dataset.echo_factor
+        self.assertEqual(set(index for _, index in stream[:group_size * dataset.echo_factor]),
+                         set(dataset._remaining_indices()[:group_size].tolist()))
+
+    def test_resume_inside_echo_group(self):
+        dataset = echo_dataset()
+        stream = echoed_stream(dataset)
+
+        # 8 echoed examples per group, 3 copies into the second one
+        consumed = 11
+        state = dataset.get_state(consumed=consumed)
+        self.assertEqual(state['position'], 4)
+        self.assertEqual(state['echo_offset'], 3)
+
+        resumed = echo_dataset()
+        resumed.set_state(state)
+        self.assertEqual(echoed_stream(resumed), stream[consumed:])
+        self.assertEqual(resumed.steps_per_epoch(), (len(stream) - consumed) // resumed.batch_size)
+
+    def test_resume_crosses_epoch_boundary(self):
+        dataset = echo_dataset()
+        resumed = echo_dataset()
+        resumed.set_state(dataset.get_state(consumed=11))
+
+        # Checkpoint after the last step of the resumed epoch
+        state = resumed.get_epoch_end_state()
+        self.assertEqual(state['epoch'], 1)
+        self.assertEqual(state['position'], 0)
+        self.assertEqual(state['echo_offset'], 0)
+
+        restarted = echo_dataset()
+        restarted.set_state(state)
+        dataset.set_epoch(1)
+        # The next epoch starts at its first echo group
+        self.assertEqual(echoed_stream(restarted), echoed_stream(dataset))
+        self.assertEqual(restarted.steps_per_epoch(), dataset.number_train * dataset.echo_factor // dataset.batch_size)
+
+
+
+class CropBoxTest(tf.test.TestCase):
+    """ random_crop_boxes + crop_and_resize against the former resize + resize_with_crop_or_pad """
+
+    def crop(self, dataset, images, boxes):
+        return tf.image.crop_and_resize(images, boxes, box_indices=tf.range(tf.shape(images)[0]),
+                                        crop_size=dataset.image_size, method='bilinear', extrapolation_value=0.)
+
+    def resize_crop(self, dataset, image, scale, flip):
+        """ Former prepare_train_ds: flip, resize by scale, center crop or pad to image_size """
+        if flip:
+            image = tf.image.flip_left_right(image)
+        size = (int(dataset.image_size[0] * scale), int(dataset.image_size[1] * scale))
+        image = tf.image.resize(image, size, method=tf.image.ResizeMethod.BILINEAR)
+        return tf.image.resize_with_crop_or_pad(image, dataset.image_size[0], dataset.image_size[1])
+
+    def test_scale_one_with_flip(self):
+        dataset = echo_dataset()
+        dataset.scale_min = dataset.scale_max = 1.
+        batch_size = 16
+        images = tf.random.stateless_uniform((batch_size, 8, 8, 3), seed=[0, 1], maxval=255.)
+
+        boxes = dataset.random_crop_boxes(batch_size, dataset.augment_seed(0))
+        flips = (boxes[:, 1] > boxes[:, 3]).numpy()
+        # Both branches are covered
+        self.assertTrue(flips.any() and not flips.all())
+
+        crops = self.crop(dataset, images, boxes)
+        for image, crop, flip in zip(images, crops, flips):
+            self.assertAllClose(crop, self.resize_crop(dataset, image, 1., flip), atol=1e-3)
+
+    def test_scale_below_one_pads_with_zeros(self):
+        dataset = echo_dataset()
+        images = tf.random.stateless_uniform((1, 8, 8, 3), seed=[0, 2], minval=1., maxval=255.)
+        # Window of twice the source, the former path resized to 4x4 and padded
+        boxes = tf.constant([[-0.5, -0.5, 1.5, 1.5]])
+
+        crop = self.crop(dataset, images, boxes)[0]
+        expected = self.resize_crop(dataset, images[0], 0.5, False)
+        # Same zero border, and both sample the source at 0.5, 2.5, 4.5, 6.5 inside it
+        self.assertAllEqual(crop == 0., expected == 0.)
+        self.assertAllClose(crop[2:6, 2:6], expected[2:6, 2:6], atol=1e-3)
+
+    def test_boxes_are_reproducible(self):
+        dataset = echo_dataset()
+        boxes = dataset.random_crop_boxes(4, dataset.augment_seed(7))
+
+        self.assertAllEqual(boxes, dataset.random_crop_boxes(4, dataset.augment_seed(7)))
+        self.assertNotAllEqual(boxes, dataset.random_crop_boxes(4, dataset.augment_seed(8)))
+        # Centered windows of 1/scale, scale in [scale_min, scale_max]
+        heights = (boxes[:, 2] - boxes[:, 0]).numpy()
+        self.assertTrue(np.all(heights >= 1. / dataset.scale_max - 1e-6))
+        self.assertTrue(np.all(heights <= 1. / dataset.scale_min + 1e-6))
+        self.assertAllClose(boxes[:, 0] + boxes[:, 2], np.ones(4))
+
+
+
+class EpochOrderTest(tf.test.TestCase):
+    """ Per-epoch global permutation of the train indices """
+
+    def test_permutation_is_a_bijection(self):
+        dataset = echo_dataset(number_train=1000)
+        order = dataset.epoch_order(3)
+
+        self.assertEqual(order.dtype, np.int64)
+        self.assertAllEqual(np.sort(order), np.arange(1000))
+
+    def test_reproducible_from_seed_and_epoch(self):
+        dataset, other = echo_dataset(number_train=1000), echo_dataset(number_train=1000)
+
+        self.assertAllEqual(dataset.epoch_order(3), other.epoch_order(3))
+        self.assertNotAllEqual(dataset.epoch_order(3), dataset.epoch_order(4))
+        other.seed = 1
+        self.assertNotAllEqual(dataset.epoch_order(3), other.epoch_order(3))
+
+    def test_remaining_indices_resume_the_permutation(self):
+        dataset = echo_dataset(number_train=1000)
+        dataset.set_epoch(2, position=250)
+
+        self.assertAllEqual(dataset._remaining_indices(), dataset.epoch_order(2)[250:])
+
+
+
+class ChromaSelectionTest(tf.test.TestCase):
+    """ min_chroma / low_chroma_keep selection of the train examples """
+
+    # Examples 0, 1, 4 and 6 are below min_chroma 5
+    CHROMA = np.array([0., 1., 10., 20., 2., 30., 0.5, 40.], np.float32)
+
+    def select(self, low_chroma_keep, seed=0):
+        dataset = echo_dataset(number_train=len(self.CHROMA))
+        dataset.min_chroma = 5.
+        dataset.low_chroma_keep = low_chroma_keep
+        dataset.seed = seed
+        with mock.patch.object(Dataset, 'train_chroma', return_value=self.CHROMA):
+            dataset.select_chroma()
+        return dataset
+
+    def test_low_chroma_examples_are_dropped(self):
+        dataset = self.select(low_chroma_keep=0.)
+
+        self.assertAllEqual(dataset.train_selection, [2, 3, 5, 7])
+        self.assertEqual(dataset.number_train, 4)
+
+    def test_low_chroma_keep_keeps_a_fixed_share(self):
+        dataset = self.select(low_chroma_keep=0.5)
+        kept_low = sorted(set(dataset.train_selection.tolist()) - {2, 3, 5, 7})
+
+        self.assertEqual(dataset.number_train, 6)
+        self.assertLen(kept_low, 2)
+        self.assertTrue(set(kept_low) <= {0, 1, 4, 6})
+        self.assertAllEqual(dataset.train_selection, np.sort(dataset.train_selection))
+        # Fixed by the seed
+        self.assertAllEqual(dataset.train_selection, self.select(low_chroma_keep=0.5).train_selection)
+
+    def test_keep_all(self):
+        dataset = self.select(low_chroma_keep=1.)
+
+        self.assertAllEqual(dataset.train_selection, np.arange(len(self.CHROMA)))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,242 @@
+"""Shared builder for the custom image-folder datasets (CustomCeleba, CustomCelebahq)."""
+
+import tensorflow_datasets as tfds
+from tensorflow_datasets.core import registered
+from utils.archive_reader import list_members, read_member
+from concurrent import futures
+from typing import Optional
+import collections
+import dataclasses
+from PIL import Image
+import io
+import os
+import re
+import time
+
+
+JPEG_QUALITY = 95
+
+
+def _load_image(archive_path, name, resolution=None):
+  """Reads and validates one image member of the archive.
+
+  Images whose shorter side is larger than `resolution` are downscaled to it
+  (aspect ratio kept) and re-encoded as JPEG, smaller images are stored as is.
+
+  Returns:
+    (name, encoded bytes or None, error message or None)
+  """
+  try:
+    encoded = read_member(archive_path, name)
+    with Image.open(io.BytesIO(encoded)) as img:
+      # Full decode, catches truncated files that `verify` misses
+      img.load()
+      if resolution is not None and min(img.size) > resolution:
+        scale = resolution / min(img.size)
+        size = (round(img.size[0] * scale), round(img.size[1] * scale))
+        img = img.convert('RGB').resize(size, Image.BICUBIC)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=JPEG_QUALITY)
+        encoded = buffer.getvalue()
+    return name, encoded, None
+  except Exception as e:  # pylint: disable=broad-except
+    return name, None, str(e)
+
+
+def _load_images(archive_path, names, resolution=None):
+  """Runs in a worker process, one task per chunk of members to amortize IPC.
+
+  Each worker keeps its own archive handle, so members are read concurrently.
+  """
+  return [_load_image(archive_path, name, resolution) for name in names]
+
+
+def _encode_example(encoded, stores_label):
+  example = {'image': io.BytesIO(encoded)}
+  if stores_label:
+    example['label'] = io.BytesIO(encoded)
+  return example
+
+
+@dataclasses.dataclass(eq=False)
+class ImageFolderConfig(tfds.core.BuilderConfig):
+  """BuilderConfig storing images with their shorter side at most `resolution` (None: original size)."""
+  resolution: Optional[int] = None
+
+
+RESOLUTIONS = (256, 512, 768, 1024)
+
+
+def legacy_version_dirs(dataset_dir):
+  """Versions prepared before the BuilderConfigs, in `<dataset_dir>/<version>` instead of `<dataset_dir>/<config>/<version>`."""
+  if not os.path.isdir(dataset_dir):
+    return []
+  return sorted(name for name in os.listdir(dataset_dir)
+                if re.fullmatch(r'\d+\.\d+\.\d+', name)
+                and os.path.isfile(os.path.join(dataset_dir, name, 'dataset_info.json')))
+
+
+with registered.skip_registration():
+
+  class ImageFolderBuilder(tfds.core.GeneratorBasedBuilder):
+    """Builds a single `train` split from the `<IMAGE_DIR>/<IMAGE_PATTERN>` members of `<manual_dir>/<ARCHIVE_NAME>`.
+
+    The archive (.zip or uncompressed .tar) is read in place, nothing is
+    extracted. Members are sorted so example keys are stable and examples are
+    assigned to shards deterministically from their keys.
+
+    Without Beam options, members are read and validated (and resized for the
+    resolution configs) in a process pool, but the single TFDS writer still
+    serializes and writes every shard. With Beam options, e.g.
+    `tfds build --beam_pipeline_options="direct_running_mode=multi_processing,direct_num_workers=8"`,
+    the whole generation runs as a Beam pipeline and the workers also
+    serialize and write the shards in parallel. Both paths print images/sec
+    and MB/sec, the Beam one over the whole read + write pipeline from the
+    prepared split statistics, since the Beam workers report only counters.
+    """
+
+    VERSION = tfds.core.Version('2.0.0')
+    SUPPORTED_VERSIONS = [tfds.core.Version('1.0.0')]
+    RELEASE_NOTES = {
+        '1.0.0': 'Initial release.',
+        '2.0.0': 'Store each image once, the supervised target is derived from `image` at read time.',
+    }
+
+    MANUAL_DOWNLOAD_INSTRUCTIONS = '/home/kp/tensorflow_datasets/downloads/manual'
+
+    # 'original' first so the config-less name keeps loading full size images,
+    # from <data_dir>/<dataset>/original/<version> (see Dataset.check_legacy_layout for older layouts)
+    BUILDER_CONFIGS = [
+        ImageFolderConfig(name='original', description='Images at their original size.'),
+    ] + [
+        ImageFolderConfig(name=str(resolution), resolution=resolution,
+                          description='Images pre-resized to a shorter side of %d px.' % resolution)
+        for resolution in RESOLUTIONS
+    ]
+
+    DESCRIPTION = ''
+    CITATION = ''
+    HOMEPAGE = 'https://dataset-homepage/'
+    ARCHIVE_NAME = 'data.zip'
+    IMAGE_DIR = 'train'
+    IMAGE_PATTERN = '*.jpg'
+
+    # Number of worker processes, None -> os.cpu_count()
+    NUM_WORKERS = None
+    CHUNK_SIZE = 64
+    MAX_PENDING_CHUNKS = 2
+
+    def _info(self) -> tfds.core.DatasetInfo:
+      """Returns the dataset metadata."""
+      features = {
+          'image': tfds.features.Image(shape=(None, None, 3)),
+      }
+      supervised_keys = ('image', 'image')
+      if self._stores_label():
+        # 1.0.0 stored a second copy of every image as `label`
+        features['label'] = tfds.features.Image(shape=(None, None, 3))
+        supervised_keys = ('image', 'label')
+
+      return tfds.core.DatasetInfo(
+          builder=self,
+          description=self.DESCRIPTION,
+          features=tfds.features.FeaturesDict(features),
+          supervised_keys=supervised_keys,
+          homepage=self.HOMEPAGE,
+          citation=self.CITATION,
+      )
+
+    def _stores_label(self):
+      return self.version < '2.0.0'
+
+    def _split_generators(self, dl_manager: tfds.download.DownloadManager):
+      """Returns SplitGenerators."""
+      archive_path = os.fspath(dl_manager.manual_dir / self.ARCHIVE_NAME)
+      # Beam runs the pipeline only when the build was given a runner or pipeline options
+      use_beam = dl_manager.beam_runner is not None or dl_manager.beam_options is not None
+      self._beam_start = time.perf_counter() if use_beam else None
+
+      return {'train': self._generate_examples(archive_path=archive_path, use_beam=use_beam)}
+
+    def _generate_examples(self, archive_path, use_beam=False):
+      """Yields examples, or returns a Beam PTransform of them with `use_beam`."""
+      img_files = list_members(archive_path, self.IMAGE_DIR, self.IMAGE_PATTERN)
+      if use_beam:
+        return self._generate_examples_beam(archive_path, img_files)
+      return self._generate_examples_serial(archive_path, img_files)
+
+    def _generate_examples_beam(self, archive_path, img_files):
+      """Beam pipeline over chunks of members, read, encoded and written to shards by the Beam workers."""
+      beam = tfds.core.lazy_imports.apache_beam
+      chunks = [img_files[i:i + self.CHUNK_SIZE] for i in range(0, len(img_files), self.CHUNK_SIZE)]
+      resolution = self.builder_config.resolution
+      image_dir = self.IMAGE_DIR
+      stores_label = self._stores_label()
+      name = self.name
+
+      def load_chunk(names):
+        for member, encoded, error in _load_images(archive_path, names, resolution):
+          if encoded is None:
+            beam.metrics.Metrics.counter(name, 'skipped_images').inc()
+            print('  skipped %s: %s' % (member, error))
+            continue
+          beam.metrics.Metrics.counter(name, 'images').inc()
+          beam.metrics.Metrics.counter(name, 'bytes').inc(len(encoded))
+          yield os.path.relpath(member, image_dir), _encode_example(encoded, stores_label)
+
+      print('%s: %d images in %d chunks, read and shard writing on the Beam workers' % (
+          name, len(img_files), len(chunks)))
+      # Reshuffle spreads the chunks over the workers instead of fusing them with Create
+      return beam.Create(chunks) | beam.Reshuffle() | beam.FlatMap(load_chunk)
+
+    def _download_and_prepare(self, *args, **kwargs):
+      """Runs the generation, then reports the throughput of a Beam build."""
+      self._beam_start = None
+      super()._download_and_prepare(*args, **kwargs)
+      if self._beam_start is None:
+        return
+
+      # The pipeline has finished and the split statistics are set
+      elapsed = time.perf_counter() - self._beam_start
+      split = self.info.splits['train']
+      print('%s: %d images, %.1f images/sec, %.1f MB/sec of shards written by the Beam workers' % (
+          self.name, split.num_examples, split.num_examples / elapsed, split.num_bytes / 1024**2 / elapsed))
+
+    def _generate_examples_serial(self, archive_path, img_files):
+      """Yields examples read in a process pool, the TFDS writer writes them from this process."""
+
+      num_workers = self.NUM_WORKERS or os.cpu_count()
+      num_bytes = 0
+      skipped = []
+      start = time.perf_counter()
+
+      chunks = [img_files[i:i + self.CHUNK_SIZE] for i in range(0, len(img_files), self.CHUNK_SIZE)]
+
+      with futures.ProcessPoolExecutor(max_workers=num_workers) as pool:
+        # Bounded queue of in-flight chunks, consumed in sorted order so keys are stable
+        # and at most num_workers * MAX_PENDING_CHUNKS chunks of encoded bytes are held in memory.
+        pending = collections.deque()
+        next_chunk = 0
+        while pending or next_chunk < len(chunks):
+          while next_chunk < len(chunks) and len(pending) < num_workers * self.MAX_PENDING_CHUNKS:
+            pending.append(pool.submit(_load_images, archive_path, chunks[next_chunk], self.builder_config.resolution))
+            next_chunk += 1
+
+          for name, encoded, error in pending.popleft().result():
+            if encoded is None:
+              skipped.append((name, error))
+              continue
+
+            num_bytes += len(encoded)
+            # Same keys (and shard assignment) as the former extracted `<IMAGE_DIR>/<file>` paths
+            key = os.path.relpath(name, self.IMAGE_DIR)
+            yield key, _encode_example(encoded, self._stores_label())
+
+      elapsed = time.perf_counter() - start
+      print('%s: %d images, %.1f images/sec, %.1f MB/sec with %d read workers, %d skipped' % (
+          self.name, len(img_files) - len(skipped), (len(img_files) - len(skipped)) / elapsed,
+          num_bytes / 1024**2 / elapsed, num_workers, len(skipped)))
+      print('  shards were serialized and written by one TFDS writer, '
+            'pass --beam_pipeline_options to write them in parallel')
+      for name, error in skipped:
+        print('  skipped %s: %s' % (name, error))
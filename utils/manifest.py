@@ -0,0 +1,87 @@
+import tensorflow_datasets as tfds
+import json
+import os
+import re
+
+# Bump when the manifest fields change.
+MANIFEST_VERSION = 2
+
+
+def manifest_path(data_dir: str, dataset_name: str, version: str, split: str):
+    # 'train[1%:]' -> 'train.1pct-', 'train[:1%]' -> 'train.-1pct'
+    split_name = split.replace('[', '.').replace(']', '').replace(':', '-').replace('%', 'pct')
+    split_name = re.sub(r'[^0-9A-Za-z.\-]+', '_', split_name)
+    return os.path.join(data_dir, 'manifests', '%s-%s-%s.json' % (dataset_name, version, split_name))
+
+
+def build_manifest(builder, dataset_name: str, split: str):
+    """
+    Collect split metadata without iterating the split.
+    Example counts and byte sizes come from the prepared DatasetInfo,
+    image shape from the first example only.
+
+    Args:
+        builder (tfds.core.DatasetBuilder): prepared dataset builder
+        dataset_name (str): name passed to tfds.load
+        split (str): TFDS split string (e.g. 'train[1%:]')
+    """
+    split_info = builder.info.splits[split]
+    num_examples = int(split_info.num_examples)
+
+    parent_info = builder.info.splits[split.split('[')[0]]
+    parent_examples = int(parent_info.num_examples)
+    parent_bytes = int(parent_info.num_bytes)
+
+    if num_examples == 0:
+        # DatasetInfo without split statistics, count once and persist
+        dataset = builder.as_dataset(split=split)
+        num_examples = int(dataset.reduce(0, lambda x, _: x + 1).numpy())
+
+    image_shape = None
+    for sample in builder.as_dataset(split=split).take(1):
+        image_shape = [int(dim) for dim in sample['image'].shape]
+
+    return {
+        'manifest_version': MANIFEST_VERSION,
+        'dataset': dataset_name,
+        'version': str(builder.info.version),
+        'split': split,
+        'features': sorted(builder.info.features.keys()),
+        'num_examples': num_examples,
+        'image_shape': image_shape,
+        'num_bytes': int(parent_bytes * num_examples / max(parent_examples, 1)),
+        'avg_example_bytes': int(parent_bytes / max(parent_examples, 1)),
+    }
+
+
+def load_manifest(data_dir: str, dataset_name: str, split: str):
+    """
+    Read the persisted manifest of a dataset split, building it on first use.
+
+    Args:
+        data_dir: 데이터셋 경로
+        dataset_name: TFDS 데이터셋 이름 (e.g. 'CustomCelebahq', 'CustomCelebahq/512')
+        split: TFDS split string
+
+    Returns:
+        dict {dataset, version, split, features, num_examples, image_shape, num_bytes, avg_example_bytes}
+    """
+    builder = tfds.builder(dataset_name, data_dir=data_dir)
+    version = str(builder.info.version)
+    path = manifest_path(data_dir, dataset_name.replace('/', '_'), version, split)
+
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('manifest_version') == MANIFEST_VERSION:
+            return manifest
+
+    manifest = build_manifest(builder, dataset_name, split)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+    return manifest
@@ -0,0 +1,76 @@
+import tensorflow as tf
+import types
+import os
+from unittest import mock
+from utils import manifest
+
+
+class FakeBuilder:
+    """ Prepared builder with the DatasetInfo fields and as_dataset the manifest reads """
+
+    def __init__(self, split_examples, image_shape=(6, 4, 3)):
+        self.split_examples = split_examples
+        self.image_shape = image_shape
+        self.read_splits = []
+        splits = {'train': types.SimpleNamespace(num_examples=1000, num_bytes=2000000)}
+        splits.update({name: types.SimpleNamespace(num_examples=count, num_bytes=0)
+                       for name, count in split_examples.items()})
+        self.info = types.SimpleNamespace(version='2.0.0', splits=splits, features={'image': None})
+
+    def as_dataset(self, split):
+        self.read_splits.append(split)
+        count = self.split_examples[split] or 990
+        return tf.data.Dataset.from_tensors({'image': tf.zeros(self.image_shape, tf.uint8)}).repeat(count)
+
+
+class ManifestTest(tf.test.TestCase):
+    """ Split manifest counts and their persistence """
+
+    def test_counts_from_split_info(self):
+        builder = FakeBuilder({'train[1%:]': 990})
+        split_manifest = manifest.build_manifest(builder, 'CustomCelebahq', 'train[1%:]')
+
+        self.assertEqual(split_manifest['num_examples'], 990)
+        self.assertEqual(split_manifest['image_shape'], [6, 4, 3])
+        # Bytes scale with the share of the parent split
+        self.assertEqual(split_manifest['avg_example_bytes'], 2000)
+        self.assertEqual(split_manifest['num_bytes'], 990 * 2000)
+        self.assertEqual(split_manifest['features'], ['image'])
+        # Only the first example is read for its shape
+        self.assertEqual(builder.read_splits, ['train[1%:]'])
+
+    def test_counts_split_without_statistics(self):
+        builder = FakeBuilder({'train[1%:]': 0})
+        split_manifest = manifest.build_manifest(builder, 'CustomCelebahq', 'train[1%:]')
+
+        self.assertEqual(split_manifest['num_examples'], 990)
+
+    def test_persisted_and_reused(self):
+        data_dir = self.get_temp_dir()
+        builder = FakeBuilder({'train[:1%]': 10})
+
+        with mock.patch.object(manifest.tfds, 'builder', return_value=builder):
+            first = manifest.load_manifest(data_dir, 'CustomCelebahq/512', 'train[:1%]')
+            second = manifest.load_manifest(data_dir, 'CustomCelebahq/512', 'train[:1%]')
+
+        self.assertEqual(first, second)
+        self.assertEqual(second['num_examples'], 10)
+        self.assertTrue(os.path.exists(manifest.manifest_path(data_dir, 'CustomCelebahq_512', '2.0.0', 'train[:1%]')))
+        # The second load reads the file, not the split
+        self.assertLen(builder.read_splits, 1)
+
+    def test_rebuilt_on_manifest_version_change(self):
+        data_dir = self.get_temp_dir()
+        builder = FakeBuilder({'train[:1%]': 10})
+
+        with mock.patch.object(manifest.tfds, 'builder', return_value=builder):
+            manifest.load_manifest(data_dir, 'CustomCeleba', 'train[:1%]')
+            with mock.patch.object(manifest, 'MANIFEST_VERSION', manifest.MANIFEST_VERSION + 1):
+                rebuilt = manifest.load_manifest(data_dir, 'CustomCeleba', 'train[:1%]')
+
+        self.assertEqual(rebuilt['manifest_version'], manifest.MANIFEST_VERSION + 1)
+        self.assertLen(builder.read_splits, 2)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,121 @@
+import tensorflow_datasets as tfds
+import tensorflow as tf
+import numpy as np
+import threading
+import struct
+import os
+
+# TFRecord framing: uint64 length, uint32 masked crc of length, data, uint32 masked crc of data
+_HEADER_BYTES = 12
+_FOOTER_BYTES = 4
+
+
+def scan_tfrecord(path: str):
+    """
+    Offsets and lengths of every record in a TFRecord file, read from the record headers only.
+
+    Returns:
+        offsets, lengths (np.ndarray, int64): data offset / length of each record
+    """
+    offsets, lengths = [], []
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        position = 0
+        while position < file_size:
+            f.seek(position)
+            length, = struct.unpack('<Q', f.read(8))
+            offsets.append(position + _HEADER_BYTES)
+            lengths.append(length)
+            position += _HEADER_BYTES + length + _FOOTER_BYTES
+
+    return np.asarray(offsets, np.int64), np.asarray(lengths, np.int64)
+
+
+class RecordIndex:
+    """
+    Random access to the serialized examples of a prepared TFDS split.
+
+    Only (shard, offset, length) of each example is held in memory, so a full
+    permutation of the split costs O(number of examples) instead of a shuffle
+    buffer of decoded images. Examples are numbered in TFDS read order, the
+    same order `tfds.load(split=...)` yields without file shuffling.
+    """
+    def __init__(self, builder, split: str):
+        """
+        Args:
+            builder (tfds.core.DatasetBuilder): prepared dataset builder
+            split (str): TFDS split string (e.g. 'train[1%:]')
+        """
+        # Split sizes by name, the form to_absolute takes on every TFDS release
+        split_sizes = {name: split_info.num_examples for name, split_info in builder.info.splits.items()}
+        instruction, = tfds.core.ReadInstruction.from_spec(split).to_absolute(split_sizes)
+        split_info = builder.info.splits[instruction.splitname]
+        self.features = builder.info.features
+
+        self.paths = [os.fspath(path) for path in split_info.filepaths]
+        shards, offsets, lengths = [], [], []
+        for shard, path in enumerate(self.paths):
+            shard_offsets, shard_lengths = scan_tfrecord(path)
+            shards.append(np.full(len(shard_offsets), shard, np.int64))
+            offsets.append(shard_offsets)
+            lengths.append(shard_lengths)
+
+        start = instruction.from_ or 0
+        end = instruction.to if instruction.to is not None else sum(len(x) for x in offsets)
+        self.shards = np.concatenate(shards)[start:end]
+        self.offsets = np.concatenate(offsets)[start:end]
+        self.lengths = np.concatenate(lengths)[start:end]
+
+        self._fds = {}
+        # tf.data runs _read_record on parallel threads, one descriptor per shard
+        self._fds_lock = threading.Lock()
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    def _read_record(self, index):
+        index = int(index)
+        shard = int(self.shards[index])
+        fd = self._fds.get(shard)
+        if fd is None:
+            with self._fds_lock:
+                if shard not in self._fds:
+                    self._fds[shard] = os.open(self.paths[shard], os.O_RDONLY)
+                fd = self._fds[shard]
+        # pread does not move a shared file position, safe across parallel map calls
+        return os.pread(fd, int(self.lengths[index]), int(self.offsets[index]))
+
+
+    def read(self, index):
+        """ Serialized example at `index` (Tensor, string) """
+        record = tf.numpy_function(self._read_record, [index], tf.string, stateful=False)
+        record.set_shape([])
+        return record
+
+
+    def as_dataset(self, indices, decoders=None, deterministic=None):
+        """
+        Examples in the order of `indices`.
+
+        Args:
+            indices (tf.data.Dataset, int64): example indices
+            decoders: TFDS decoders, as passed to tfds.load
+            deterministic: False returns examples as their parallel reads finish (None: tf.data option)
+        """
+        return indices.map(lambda index: self.features.deserialize_example(self.read(index), decoders=decoders),
+                           num_parallel_calls=tf.data.experimental.AUTOTUNE, deterministic=deterministic)
+
+
+    def close(self):
+        with self._fds_lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = {}
+
+
+    def __del__(self):
+        # Released with the last dataset that reads through it
+        if hasattr(self, '_fds_lock'):
+            self.close()
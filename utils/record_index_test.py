@@ -0,0 +1,77 @@
+import tensorflow as tf
+import numpy as np
+import types
+import os
+from utils.record_index import RecordIndex, scan_tfrecord
+
+
+def write_shards(directory, records_per_shard):
+    """ TFRecord shards of records of different lengths, returns the paths and every record in read order """
+    paths, records = [], []
+    for shard, count in enumerate(records_per_shard):
+        path = os.path.join(directory, 'test-train.tfrecord-%05d-of-%05d' % (shard, len(records_per_shard)))
+        with tf.io.TFRecordWriter(path) as writer:
+            for i in range(count):
+                record = ('shard %d record %d ' % (shard, i)).encode() * (i + 1)
+                writer.write(record)
+                records.append(record)
+        paths.append(path)
+    return paths, records
+
+
+def fake_builder(paths, num_examples):
+    """ Only the DatasetInfo fields RecordIndex reads """
+    split_info = types.SimpleNamespace(filepaths=paths, num_examples=num_examples)
+    info = types.SimpleNamespace(splits={'train': split_info}, features=None)
+    return types.SimpleNamespace(info=info)
+
+
+class RecordIndexTest(tf.test.TestCase):
+    """ RecordIndex random access against sequential reading """
+
+    def setUp(self):
+        super().setUp()
+        self.paths, self.records = write_shards(self.get_temp_dir(), [3, 5, 4])
+
+    def test_scan_matches_sequential_read(self):
+        offsets, lengths = scan_tfrecord(self.paths[1])
+        sequential = list(tf.data.TFRecordDataset(self.paths[1]).as_numpy_iterator())
+
+        self.assertLen(offsets, len(sequential))
+        with open(self.paths[1], 'rb') as f:
+            data = f.read()
+        for offset, length, record in zip(offsets, lengths, sequential):
+            self.assertEqual(data[offset:offset + length], record)
+
+    def test_random_access_matches_sequential_read(self):
+        record_index = RecordIndex(fake_builder(self.paths, len(self.records)), 'train')
+        sequential = list(tf.data.TFRecordDataset(self.paths).as_numpy_iterator())
+
+        self.assertLen(record_index, len(sequential))
+        self.assertEqual(sequential, self.records)
+        # Reverse order, every shard is opened out of sequence
+        for index in reversed(range(len(sequential))):
+            self.assertEqual(record_index._read_record(index), sequential[index])
+        self.assertEqual(record_index.read(tf.constant(4, tf.int64)).numpy(), sequential[4])
+        record_index.close()
+
+    def test_split_slice(self):
+        record_index = RecordIndex(fake_builder(self.paths, len(self.records)), 'train[2:9]')
+
+        self.assertLen(record_index, 7)
+        self.assertEqual([record_index._read_record(i) for i in range(7)], self.records[2:9])
+        record_index.close()
+
+    def test_parallel_reads_open_one_descriptor_per_shard(self):
+        record_index = RecordIndex(fake_builder(self.paths, len(self.records)), 'train')
+        indices = tf.data.Dataset.from_tensor_slices(np.tile(np.arange(len(self.records)), 20))
+        reads = indices.map(record_index.read, num_parallel_calls=8)
+
+        self.assertEqual(list(reads.as_numpy_iterator()), self.records * 20)
+        self.assertLen(record_index._fds, len(self.paths))
+        record_index.close()
+        self.assertEmpty(record_index._fds)
+
+
+if __name__ == '__main__':
+    tf.test.main()
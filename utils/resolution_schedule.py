@@ -0,0 +1,29 @@
+def parse_resolution_schedule(schedule: str, batch_size: int):
+    """
+    Phases of --resolution_schedule, a single 512 phase without one.
+
+    Returns:
+        list of (start epoch, image size, batch size), sorted by start epoch
+    """
+    if schedule is None:
+        return [(0, 512, batch_size)]
+
+    phases = []
+    for phase in schedule.split(','):
+        values = [int(value) for value in phase.split(':')]
+        if len(values) == 2:
+            values.append(batch_size)
+        if len(values) != 3:
+            raise ValueError("해상도 단계 형식이 잘못되었습니다: %s" % phase)
+        if values[1] % 64 != 0:
+            raise ValueError("해상도는 64의 배수여야 합니다: %d" % values[1])
+        phases.append(tuple(values))
+    phases.sort()
+    if phases[0][0] != 0:
+        raise ValueError("첫 해상도 단계는 에폭 0 에서 시작해야 합니다")
+    return phases
+
+
+def resolution_phase(schedule: list, epoch: int):
+    """ Phase of `epoch`, the last one that started at or before it """
+    return [phase for phase in schedule if phase[0] <= epoch][-1]
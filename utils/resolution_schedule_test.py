@@ -0,0 +1,39 @@
+import tensorflow as tf
+from utils.resolution_schedule import parse_resolution_schedule, resolution_phase
+
+
+class ResolutionScheduleTest(tf.test.TestCase):
+    """ --resolution_schedule parsing and the phase of each epoch """
+
+    def test_default_is_a_single_512_phase(self):
+        self.assertEqual(parse_resolution_schedule(None, 8), [(0, 512, 8)])
+
+    def test_phases_are_parsed_and_sorted(self):
+        schedule = parse_resolution_schedule('10:256:16,0:128:32,30:512', 8)
+
+        # The batch size defaults to --batch_size
+        self.assertEqual(schedule, [(0, 128, 32), (10, 256, 16), (30, 512, 8)])
+
+    def test_invalid_schedules(self):
+        with self.assertRaisesRegex(ValueError, '64'):
+            parse_resolution_schedule('0:100', 8)
+        with self.assertRaisesRegex(ValueError, '0'):
+            parse_resolution_schedule('5:128,10:256', 8)
+        with self.assertRaisesRegex(ValueError, '0:128:8:1'):
+            parse_resolution_schedule('0:128:8:1', 8)
+        with self.assertRaises(ValueError):
+            parse_resolution_schedule('0:high', 8)
+
+    def test_phase_lookup(self):
+        schedule = parse_resolution_schedule('0:128:32,10:256:16,30:512:8', 8)
+
+        self.assertEqual(resolution_phase(schedule, 0), (0, 128, 32))
+        self.assertEqual(resolution_phase(schedule, 9), (0, 128, 32))
+        self.assertEqual(resolution_phase(schedule, 10), (10, 256, 16))
+        self.assertEqual(resolution_phase(schedule, 29), (10, 256, 16))
+        # The last phase runs to the end of training
+        self.assertEqual(resolution_phase(schedule, 100), (30, 512, 8))
+
+
+if __name__ == '__main__':
+    tf.test.main()
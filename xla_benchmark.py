@@ -0,0 +1,95 @@
+import tensorflow as tf
+from model.pix2pix import Pix2Pix, INPUT_DTYPES
+import argparse
+import time
+
+# Train / inference steps per second with and without XLA, on CPU unless --gpu
+# python xla_benchmark.py --batch_size 4 --image_size 256 --steps 20
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--model_prefix",     type=str,   help="Model name", default='benchmark')
+parser.add_argument("--batch_size",     type=int,   help="배치 사이즈값 설정", default=4)
+parser.add_argument("--image_size",     type=int,   help="이미지 해상도", default=256)
+parser.add_argument("--lr",             type=float, help="Learning rate 설정", default=0.001)
+parser.add_argument("--warmup_steps",   type=int,   help="측정 전 warmup step 수 (XLA 컴파일 포함)", default=3)
+parser.add_argument("--steps",          type=int,   help="측정할 step 수", default=20)
+parser.add_argument("--steps_per_call",  type=int,  help="fused 루프에서 tf.function 호출당 학습 step 수", default=1)
+parser.add_argument("--generator",  type=str,  help="Generator 구조", default='unet', choices=['unet', 'resunet'])
+parser.add_argument("--discriminator",  type=str,  help="Discriminator 구조", default='patchgan', choices=['patchgan', 'resnet'])
+parser.add_argument("--precision",  type=str,  help="학습 dtype 정책 (mixed_bfloat16 은 CPU 에서도 사용 가능)", default='float32',
+                    choices=['float32', 'mixed_float16', 'mixed_bfloat16'])
+parser.add_argument("--gpu",  help="GPU에서 측정 (기본: CPU)", action='store_true')
+
+args = parser.parse_args()
+
+
+def random_dataset(batch_size, image_size):
+    l_channel = tf.random.uniform((batch_size, image_size, image_size, 1), -1., 1.)
+    ab_channel = tf.random.uniform((batch_size, image_size, image_size, 2), -1., 1.)
+    norm_rgb = tf.random.uniform((batch_size, image_size, image_size, 3), -1., 1.)
+    # Dtype of the Dataset batches, setup_xla compiles for it
+    batch = tuple(tf.cast(tensor, INPUT_DTYPES[args.precision]) for tensor in (l_channel, ab_channel, norm_rgb))
+    return tf.data.Dataset.from_tensors(batch).repeat()
+
+
+def train_loop(gan, iterator, steps):
+    done_steps = 0
+    while done_steps < steps:
+        call_steps = min(args.steps_per_call, steps - done_steps)
+        _, gan_res = gan.train_steps(iterator, tf.constant(call_steps))
+        done_steps += call_steps
+
+    # Wait for the last step to finish
+    return gan_res.numpy()
+
+
+def inference_loop(gan, iterator, steps):
+    for _ in range(steps):
+        l_channel, _, _ = next(iterator)
+        pred_ab = gan.predict_ab(l_channel)
+    return pred_ab.numpy()
+
+
+def measure(loop_fn, gan, iterator):
+    loop_fn(gan, iterator, args.warmup_steps)
+
+    start = time.perf_counter()
+    loop_fn(gan, iterator, args.steps)
+    return args.steps / (time.perf_counter() - start)
+
+
+def run(xla: bool):
+    tf.keras.backend.clear_session()
+    args.xla = xla
+    gan = Pix2Pix(
+        args=args,
+        image_size=(args.image_size, args.image_size),
+        gen_input_channel=1,
+        gen_output_channel=2,
+        dis_input_channel=3,
+    )
+    gan.compile_train_step(batch_size=args.batch_size)
+    if xla:
+        gan.setup_xla(batch_size=args.batch_size)
+    else:
+        # Same graph function without jit_compile, so only XLA differs
+        gan.infer_fn = tf.function(lambda x: gan.gen_model(x, training=False))
+        gan.infer_batch_size = args.batch_size
+
+    iterator = iter(random_dataset(args.batch_size, args.image_size))
+    return measure(train_loop, gan, iterator), measure(inference_loop, gan, iterator), gan.xla_report
+
+
+if __name__ == '__main__':
+    if not args.gpu:
+        tf.config.set_visible_devices([], 'GPU')
+
+    train_graph, infer_graph, _ = run(xla=False)
+    train_xla, infer_xla, report = run(xla=True)
+
+    print("device     : %s, %s:%s, batch %d, %dx%d" % ('GPU' if args.gpu else 'CPU', args.generator, args.discriminator,
+                                                     args.batch_size, args.image_size, args.image_size))
+    for name, result in report.items():
+        print("  %-20s %s" % (name, result))
+    print("train      : %.2f -> %.2f steps/sec (%.2fx)" % (train_graph, train_xla, train_xla / train_graph))
+    print("inference  : %.2f -> %.2f steps/sec (%.2fx)" % (infer_graph, infer_xla, infer_xla / infer_graph))